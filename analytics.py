@@ -0,0 +1,165 @@
+import argparse
+import datetime
+import json
+from array import array
+from itertools import accumulate, repeat
+from operator import sub, truediv
+
+from spendwise import aggregate_ledger, month_bounds, year_bounds
+from storage import parse_date
+
+# Windowed spending analytics: rolling sums and moving averages over any
+# number of days, overall or per category, and month- and year-to-date burn
+# rates projected against spending limits.
+#
+# A SpendingSeries holds the spending of every day in a ledger's span as
+# integer cents with prefix sums, so the total of any window is two lookups
+# and exact. It is built from the rollup cube's day cells, so no records are
+# read, and a saved cube makes ledger_series() cheap enough to run over many
+# ledgers. Series come back as arrays of floats (one per day, aligned with
+# days()), computed with map() over whole slices of the prefix sums rather
+# than per day in Python.
+
+
+def as_ordinal(value):
+    if isinstance(value, int):
+        return value
+    if isinstance(value, datetime.date):
+        return value.toordinal()
+    return parse_date(value).toordinal()
+
+
+def cumulative(prefix, lo, hi):
+    # prefix[lo:hi], reading 0 before the start and the final total past
+    # the end.
+    size = len(prefix)
+    before = max(0, min(hi, 0) - lo)
+    after = max(0, hi - max(lo, size))
+    return array('q', bytes(8 * before)) + prefix[max(lo, 0):max(min(hi, size), 0)] + prefix[-1:] * after
+
+
+def prefix_at(prefix, i):
+    return prefix[min(max(i, 0), len(prefix) - 1)]
+
+
+def to_amounts(cents, divisor=1):
+    return array('d', map(truediv, cents, repeat(divisor * 100)))
+
+
+class SpendingSeries:
+    # prefix[i] is the cents spent on the i days before first + i, for the
+    # whole ledger and per category. Days outside first..last spent nothing.
+    def __init__(self, aggregates):
+        aggregates.load_periods()
+        days = {key[1]: categories for key, categories in aggregates.category_totals.items() if key[0] == 'day'}
+        self.first = min(days, default=datetime.date.today().toordinal())
+        self.last = max(days, default=self.first - 1)
+        size = self.last - self.first + 1
+        daily = array('q', bytes(8 * size))
+        per_category = {}
+        for ordinal, categories in days.items():
+            i = ordinal - self.first
+            for category, cell in categories.items():
+                cents = round(cell[0] * 100)
+                daily[i] += cents
+                column = per_category.get(category)
+                if column is None:
+                    column = per_category[category] = array('q', bytes(8 * size))
+                column[i] += cents
+        self.prefix = array('q', accumulate(daily, initial=0))
+        self.category_prefix = {category: array('q', accumulate(column, initial=0)) for category, column in per_category.items()}
+
+    @property
+    def categories(self):
+        return list(self.category_prefix)
+
+    def prefix_for(self, category=None):
+        if category is None:
+            return self.prefix
+        return self.category_prefix.get(category, array('q', [0]))
+
+    def span(self, start=None, end=None):
+        # Ordinals of start..end, defaulting to the ledger's first and last days.
+        start = self.first if start is None else as_ordinal(start)
+        end = self.last if end is None else as_ordinal(end)
+        return start, max(end, start - 1)
+
+    def days(self, start=None, end=None):
+        # The ordinals the arrays below are aligned with.
+        start, end = self.span(start, end)
+        return array('q', range(start, end + 1))
+
+    def total(self, start=None, end=None, category=None):
+        # Spending over the days start..end inclusive.
+        start, end = self.span(start, end)
+        prefix = self.prefix_for(category)
+        return (prefix_at(prefix, end + 1 - self.first) - prefix_at(prefix, start - self.first)) / 100
+
+    def window_cents(self, window, start, end, category):
+        start, end = self.span(start, end)
+        prefix = self.prefix_for(category)
+        lo, hi = start + 1 - self.first, end + 2 - self.first
+        return map(sub, cumulative(prefix, lo, hi), cumulative(prefix, lo - window, hi - window))
+
+    def rolling_sum(self, window, start=None, end=None, category=None):
+        # For each day start..end, the spending of the `window` days ending
+        # on it.
+        return to_amounts(self.window_cents(window, start, end, category))
+
+    def moving_average(self, window, start=None, end=None, category=None):
+        # rolling_sum divided by the window: average daily spending.
+        return to_amounts(self.window_cents(window, start, end, category), window)
+
+    def rolling_sums(self, windows=(7, 30, 90), start=None, end=None, category=None):
+        return {window: self.rolling_sum(window, start, end, category) for window in windows}
+
+    def category_moving_averages(self, window, start=None, end=None):
+        return {category: self.moving_average(window, start, end, category) for category in self.category_prefix}
+
+    def burn_rate(self, date=None, monthly_limit=None, yearly_limit=None):
+        # Month- and year-to-date spending on date (default: the last day of
+        # the ledger), the average daily rate so far and the total it
+        # projects for the whole period, against the limits if given.
+        ordinal = self.last if date is None else as_ordinal(date)
+        day = datetime.date.fromordinal(ordinal)
+        result = {"date": day.strftime('%d-%m-%Y')}
+        for name, (first, last), limit in (('month', month_bounds(day.year, day.month), monthly_limit),
+                                           ('year', year_bounds(day.year), yearly_limit)):
+            spent = self.total(first, ordinal)
+            elapsed, length = ordinal - first + 1, last - first + 1
+            rate = spent / elapsed
+            period = {"spent": spent, "days_elapsed": elapsed, "days_in_period": length, "daily_rate": rate, "projected": rate * length}
+            if limit is not None:
+                period.update(limit=limit, remaining=limit - spent, projected_over_limit=rate * length > limit,
+                              # Days left until the limit is reached at this rate.
+                              days_to_limit=max(0.0, (limit - spent) / rate) if rate > 0 else None)
+            result[name] = period
+        return result
+
+
+def ledger_series(filename):
+    # SpendingSeries of a ledger file, from its saved cube when current.
+    return SpendingSeries(aggregate_ledger(filename))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rolling spending and burn rates of SpendWise ledgers, as JSON lines.")
+    parser.add_argument('ledgers', nargs='+')
+    parser.add_argument('--date', help="dd-mm-yyyy, default each ledger's last day")
+    parser.add_argument('--windows', default='7,30,90', help="comma separated window lengths in days")
+    parser.add_argument('--monthly-limit', type=float)
+    parser.add_argument('--yearly-limit', type=float)
+    args = parser.parse_args()
+    windows = [int(window) for window in args.windows.split(',')]
+    for filename in args.ledgers:
+        series = ledger_series(filename)
+        day = series.last if args.date is None else as_ordinal(args.date)
+        print(json.dumps({"ledger": filename,
+                          "rolling": {window: series.rolling_sum(window, day, day)[0] for window in windows},
+                          "moving_average": {category: {window: series.moving_average(window, day, day, category)[0] for window in windows}
+                                             for category in series.categories},
+                          "burn_rate": series.burn_rate(day, args.monthly_limit, args.yearly_limit)}))
+
+
+if __name__ == "__main__":
+    main()
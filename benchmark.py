@@ -0,0 +1,213 @@
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from generatequery import write_random_data
+from spendwise import ExpenseManager
+from storage import migrate
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def timed(results, rows, operation, calls, function):
+    # Run function() `calls` times with printing suppressed and record the time.
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        seconds = time.perf_counter() - start
+    results.append({"rows": rows, "operation": operation, "calls": calls, "seconds": seconds, "per_call": seconds / calls})
+    print(f"{rows:>10} {operation:<36} {seconds / calls * 1000:12.3f} ms/call", file=sys.stderr)
+
+
+def timed_startup(results, rows, operation, calls, code):
+    # Median wall time of running code in a fresh interpreter, after one
+    # untimed run that leaves the bytecode cached as in a normal install.
+    env = {name: value for name, value in os.environ.items() if name != 'PYTHONDONTWRITEBYTECODE'}
+    command = [sys.executable, '-c', code]
+    subprocess.run(command, stdout=subprocess.DEVNULL, env=env, check=True)
+    times = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, env=env, check=True)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    seconds = times[len(times) // 2]
+    results.append({"rows": rows, "operation": operation, "calls": calls, "seconds": sum(times), "per_call": seconds})
+    print(f"{rows:>10} {operation:<36} {seconds * 1000:12.3f} ms/call", file=sys.stderr)
+
+
+def benchmark_startup(results, rows, filename, year, month, args):
+    # Cold start of a query-only command: a new process that imports
+    # spendwise, loads the ledger lazily and prints one total from the
+    # saved cube, next to a bare interpreter and the import alone. The
+    # command is flagged when it takes longer than args.startup_budget.
+    directory = os.path.dirname(os.path.abspath(__file__))
+    prelude = f"import sys; sys.path.insert(0, {directory!r}); "
+    timed_startup(results, rows, 'startup: python', args.repeat, 'pass')
+    timed_startup(results, rows, 'startup: import spendwise', args.repeat, prelude + 'import spendwise')
+    timed_startup(results, rows, 'startup: total_monthly_expense (lazy)', args.repeat,
+                  prelude + f"from spendwise import ExpenseManager; manager = ExpenseManager(lazy=True); "
+                  f"manager.load_expenses({filename!r}); manager.total_monthly_expense({year}, {month})")
+    result = results[-1]
+    result["budget"] = args.startup_budget / 1000
+    result["over_budget"] = result["per_call"] > result["budget"]
+    if result["over_budget"]:
+        print(f"{rows:>10} startup over budget: {result['per_call'] * 1000:.3f} ms > {args.startup_budget:g} ms", file=sys.stderr)
+
+
+def naive_rolling_sum(manager, window, start, end):
+    # Rolling sums by rescanning the rows of every window.
+    cents = manager.columns.cents
+    return [sum(cents[row] for row in manager.rows_between(day - window + 1, day)) / 100 for day in range(start, end + 1)]
+
+
+def benchmark_analytics(results, rows, manager, end_date, args):
+    # A year of 7/30/90-day rolling sums from prefix sums (including
+    # building them) against rescanning every window.
+    end = end_date.toordinal()
+    start = end - 364
+    windows = (7, 30, 90)
+    timed(results, rows, 'analytics: build', args.repeat, manager.analytics)
+    series = manager.analytics()
+    timed(results, rows, 'analytics: rolling 7/30/90 (year)', args.repeat,
+          lambda: manager.analytics().rolling_sums(windows, start, end))
+    timed(results, rows, 'analytics: rescan 7/30/90 (year)', 1,
+          lambda: [naive_rolling_sum(manager, window, start, end) for window in windows])
+    timed(results, rows, 'analytics: burn_rate', args.repeat, lambda: series.burn_rate(end, 20000, 200000))
+    for window, values in series.rolling_sums(windows, start, end).items():
+        if any(abs(a - b) > 0.005 for a, b in zip(values, naive_rolling_sum(manager, window, start, end))):
+            raise RuntimeError(f"{window}-day rolling sums differ from a rescan")
+
+
+def benchmark_size(results, rows, directory, args):
+    start_date = datetime.datetime.strptime(args.start, '%d-%m-%Y').date()
+    end_date = datetime.datetime.strptime(args.end, '%d-%m-%Y').date()
+    filename = os.path.join(directory, f"ledger_{rows}.txt")
+    write_random_data(filename, rows=rows, start_date=start_date, end_date=end_date, categories=args.categories,
+                      skew=args.skew, comment_length=args.comment_length, seed=args.seed)
+    if args.format == 'shards':
+        migrated = os.path.join(directory, f"ledger_{rows}", '')
+        migrate(filename, migrated)
+        filename = migrated
+    elif args.format != 'txt':
+        migrated = os.path.join(directory, f"ledger_{rows}.{args.format}")
+        migrate(filename, migrated)
+        filename = migrated
+
+    manager = ExpenseManager(journal=args.journal, stable_ids=args.stable_ids, cache_size=args.cache_size)
+    timed(results, rows, 'load_expenses', 1, lambda: manager.load_expenses(filename))
+
+    middle = start_date + (end_date - start_date) / 2
+    date = middle.strftime('%d-%m-%Y')
+    year, month = middle.year, middle.month
+    rng = random.Random(args.seed)
+    ops = args.ops
+    # Loading saved the cube the lazy start reads.
+    benchmark_startup(results, rows, filename, year, month, args)
+
+    queries = [
+        ('view_expenses', lambda: manager.view_expenses(date)),
+        ('view_monthly_expenses', lambda: manager.view_monthly_expenses(year, month)),
+        ('view_yearly_expenses', lambda: manager.view_yearly_expenses(year)),
+        ('total_expenses', lambda: manager.total_expenses(date)),
+        ('total_monthly_expense', lambda: manager.total_monthly_expense(year, month)),
+        ('total_yearly_expense', lambda: manager.total_yearly_expense(year)),
+        ('view_daily_expense_by_category', lambda: manager.view_daily_expense_by_category(date)),
+        ('view_monthly_expense_by_category', lambda: manager.view_monthly_expense_by_category(year, month)),
+        ('view_yearly_expense_by_category', lambda: manager.view_yearly_expense_by_category(year)),
+        ('total_daily_expense_by_category', lambda: manager.total_daily_expense_by_category(date)),
+        ('total_monthly_expense_by_category', lambda: manager.total_monthly_expense_by_category(year, month)),
+        ('total_yearly_expense_by_category', lambda: manager.total_yearly_expense_by_category(year)),
+        ('query_month', lambda: manager.query(datetime.date(year, month, 1), datetime.date(year, month, 28))),
+        ('query_month_one_category', lambda: manager.query(datetime.date(year, month, 1), datetime.date(year, month, 28), ['food'])),
+    ]
+    for operation, function in queries:
+        timed(results, rows, operation, args.repeat, function)
+
+    def first_view():
+        # A fresh lazy manager answering one month's records: a sharded
+        # ledger reads only that month's shard.
+        lazy = ExpenseManager(journal=args.journal, stable_ids=args.stable_ids, lazy=True)
+        lazy.load_expenses(filename)
+        lazy.view_monthly_expenses(year, month)
+        lazy.ledger_storage().close()
+    timed(results, rows, 'lazy load + view_monthly_expenses', args.repeat, first_view)
+    benchmark_analytics(results, rows, manager, end_date, args)
+
+    def add():
+        day = start_date + datetime.timedelta(days=rng.randint(0, (end_date - start_date).days))
+        manager.add_expense('food', round(rng.uniform(10.0, 500.0), 2), day.strftime('%d-%m-%Y'), 'benchmark')
+
+    # Targets are picked up front so the timings don't include the picking.
+    # Delete targets stay valid even when legacy mode renumbers after each
+    # delete, because they all lie below the last `ops` serial numbers.
+    serials = sorted(manager.slots)
+    edit_targets = iter(rng.choices(serials, k=2 * ops))
+    delete_targets = iter(rng.sample(serials[:max(len(serials) - ops, 1)], min(ops, max(len(serials) - ops, 1))))
+
+    timed(results, rows, 'add_expense', ops, add)
+    timed(results, rows, 'edit_expense (amount)', ops, lambda: manager.edit_expense(next(edit_targets), new_amount=12.5))
+    timed(results, rows, 'edit_expense (date)', ops, lambda: manager.edit_expense(next(edit_targets), new_date=date))
+    timed(results, rows, 'delete_expense', ops, lambda: manager.delete_expense(next(delete_targets, None)))
+    timed(results, rows, 'save_expenses', 1, lambda: manager.save_expenses(manager.filename))
+    manager.ledger_storage().close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time ExpenseManager operations on generated ledgers and write the results as JSON.")
+    parser.add_argument('--sizes', default='1000,10000,100000', help="comma separated row counts")
+    parser.add_argument('--start', default='01-01-2020', help="first date, dd-mm-yyyy")
+    parser.add_argument('--end', default='31-12-2024', help="last date, dd-mm-yyyy")
+    parser.add_argument('--categories', type=int, default=5)
+    parser.add_argument('--skew', type=float, default=0.0)
+    parser.add_argument('--comment-length', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--format', choices=['txt', 'swb', 'db', 'shards'], default='txt')
+    parser.add_argument('--journal', action='store_true', help="use the journaled storage mode")
+    parser.add_argument('--stable-ids', action='store_true')
+    parser.add_argument('--cache-size', type=int, help="enable the query cache with this many entries")
+    parser.add_argument('--ops', type=int, default=20, help="calls per add/edit/delete measurement")
+    parser.add_argument('--repeat', type=int, default=5, help="calls per query measurement")
+    parser.add_argument('--startup-budget', type=float, default=50.0,
+                        help="milliseconds a query-only command may take to start; exit with status 1 if one takes longer")
+    parser.add_argument('--output', help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in (int(size) for size in args.sizes.split(',')):
+            benchmark_size(results, rows, directory, args)
+
+    report = {
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": vars(args),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 1 if any(result.get("over_budget") for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import shlex
+import sys
+
+from spendwise import ExpenseManager
+from storage import LoadReport, iter_csv_records, parse_date
+
+# Non-interactive front-end over ExpenseManager for scripts and scheduled
+# jobs. Each command prints one JSON object:
+#   add CATEGORY AMOUNT [--date D] [--comment C]
+#   edit SERIAL [--category C] [--amount A] [--date D] [--comment C]
+#   delete SERIAL
+#   query [--start D] [--end D] [--category C ...]    records in date order
+#   total [--date D | [--year Y] [--month M]]          one day, month or year
+#   report [--start D] [--end D]                       total/count/min/max per category
+#   import CSV
+#   compact
+#   batch FILE                                         one command per line, '-' for stdin
+# A batch runs every line against one loaded manager and persists all of
+# their changes together at the end (see ExpenseManager.batch), printing a
+# JSON line per command and a summary line. `python spendwise.py <command>`
+# runs the same commands; without arguments spendwise.py keeps its menu.
+# Whatever the manager prints (limit warnings, ...) is returned in
+# "messages" so stdout stays JSON.
+
+
+class CommandError(Exception):
+    pass
+
+
+class CommandParser(argparse.ArgumentParser):
+    # Bad arguments on a batch line fail that line instead of exiting.
+    def error(self, message):
+        raise CommandError(message)
+
+
+def text(value):
+    if '|' in value or '\n' in value:
+        raise argparse.ArgumentTypeError("must not contain '|' or newlines")
+    return value
+
+
+def category(value):
+    if not value.strip():
+        raise argparse.ArgumentTypeError("must not be empty")
+    return text(value)
+
+
+def amount(value):
+    value = float(value)
+    if not math.isfinite(value):
+        raise argparse.ArgumentTypeError("must be a finite number")
+    return value
+
+
+def date(value):
+    parse_date(value)
+    return value
+
+
+def add_commands(subparsers):
+    parser = subparsers.add_parser('add', help="add an expense")
+    parser.add_argument('category', type=category)
+    parser.add_argument('amount', type=amount)
+    parser.add_argument('--date', type=date, help="dd-mm-yyyy, default today")
+    parser.add_argument('--comment', type=text, default='')
+
+    parser = subparsers.add_parser('edit', help="change fields of an expense")
+    parser.add_argument('serial', type=int)
+    parser.add_argument('--category', type=category)
+    parser.add_argument('--amount', type=amount)
+    parser.add_argument('--date', type=date)
+    parser.add_argument('--comment', type=text)
+
+    parser = subparsers.add_parser('delete', help="delete an expense")
+    parser.add_argument('serial', type=int)
+
+    parser = subparsers.add_parser('query', help="list expenses in a date range")
+    parser.add_argument('--start', type=date)
+    parser.add_argument('--end', type=date)
+    parser.add_argument('--category', action='append', help="repeat for several")
+
+    parser = subparsers.add_parser('total', help="total of a day, month or year, by category")
+    parser.add_argument('--date', type=date)
+    parser.add_argument('--year', type=int, help="default this year")
+    parser.add_argument('--month', type=int)
+
+    parser = subparsers.add_parser('report', help="total, count, min and max per category over a date range")
+    parser.add_argument('--start', type=date)
+    parser.add_argument('--end', type=date)
+
+    parser = subparsers.add_parser('import', help="import a CSV file with date, category, amount and comment columns")
+    parser.add_argument('csv')
+
+    subparsers.add_parser('compact', help="rewrite the ledger, folding in the journal")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='spendwise', description="Run SpendWise commands and print JSON.")
+    parser.add_argument('--ledger', default='expense.txt', help="ledger file; .db for SQLite, .swb for a snapshot, a directory (dir/) for one file per month")
+    parser.add_argument('--journal', action='store_true', help="use the journaled storage mode")
+    parser.add_argument('--stable-ids', action='store_true')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    add_commands(subparsers)
+    batch = subparsers.add_parser('batch', help="run a file of commands, saving once at the end")
+    batch.add_argument('file', help="one command per line; blank lines and # comments are skipped")
+    return parser
+
+
+def line_parser():
+    parser = CommandParser(prog='batch', add_help=False)
+    add_commands(parser.add_subparsers(dest='command', required=True))
+    return parser
+
+
+def find(manager, serial_number):
+    manager.ensure_loaded()
+    if manager.slots.get(serial_number) is None:
+        raise CommandError(f"No expense with serial number {serial_number}")
+    return serial_number
+
+
+def add(manager, args):
+    manager.add_expense(args.category, args.amount, args.date, args.comment)
+    return {"expense": dict(manager.expenses[-1])}
+
+
+def edit(manager, args):
+    serial_number = find(manager, args.serial)
+    manager.edit_expense(serial_number, args.category, args.amount, args.date, args.comment)
+    return {"expense": dict(manager.expenses[manager.slots[serial_number]])}
+
+
+def delete(manager, args):
+    manager.delete_expense(find(manager, args.serial))
+    return {"deleted": args.serial}
+
+
+def query(manager, args):
+    return {"expenses": manager.query(args.start, args.end, args.category)}
+
+
+def total(manager, args):
+    return manager.period_totals(args.date, args.year, args.month)
+
+
+def report(manager, args):
+    return {"start": args.start, "end": args.end, "categories": manager.rollup(args.start, args.end)}
+
+
+def import_csv(manager, args):
+    load_report = LoadReport()
+    added = manager.add_expenses_bulk(iter_csv_records(args.csv), load_report)
+    return {"added": added, "skipped": load_report.malformed,
+            "samples": [{"record": number, "reason": reason} for number, reason, record in load_report.samples]}
+
+
+def compact(manager, args):
+    manager.compact()
+    return {"records": len(manager.expenses) - manager.tombstones}
+
+
+COMMANDS = {'add': add, 'edit': edit, 'delete': delete, 'query': query, 'total': total,
+            'report': report, 'import': import_csv, 'compact': compact}
+
+
+def execute(manager, args):
+    # Run one parsed command; failures come back as {"error": ...}.
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        try:
+            result = COMMANDS[args.command](manager, args)
+        except (CommandError, ValueError, KeyError, OSError) as error:
+            result = {"error": str(error)}
+    messages = output.getvalue().splitlines()
+    if messages:
+        result["messages"] = messages
+    return result
+
+
+def run_batch(manager, lines, out=None):
+    # Returns the number of lines that failed.
+    parser = line_parser()
+    commands = failures = 0
+    with manager.batch():
+        for number, line in enumerate(lines, start=1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            commands += 1
+            try:
+                result = execute(manager, parser.parse_args(shlex.split(line)))
+            except (CommandError, ValueError) as error:
+                result = {"error": str(error)}
+            failures += 'error' in result
+            print(json.dumps(dict(result, line=number)), file=out)
+    print(json.dumps({"commands": commands, "errors": failures}), file=out)
+    return failures
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # Lazy, so totals and reports are answered from the saved cube.
+    manager = ExpenseManager(journal=args.journal, stable_ids=args.stable_ids, lazy=True)
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            manager.load_expenses(args.ledger)
+        except FileNotFoundError:
+            # A new ledger; the first change creates it.
+            manager.filename = args.ledger
+    try:
+        if args.command == 'batch':
+            if args.file == '-':
+                failures = run_batch(manager, sys.stdin)
+            else:
+                with open(args.file) as f:
+                    failures = run_batch(manager, f)
+        else:
+            result = execute(manager, args)
+            print(json.dumps(result))
+            failures = 'error' in result
+    finally:
+        if manager.storage is not None:
+            manager.storage.close()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,68 @@
-import random
+import argparse
 import datetime
+import itertools
+import random
+import string
+
+DEFAULT_CATEGORIES = ['food', 'travel', 'education', 'shopping', 'entertainment']
+
+
+def category_names(count):
+    names = DEFAULT_CATEGORIES[:count]
+    names += [f"category{i}" for i in range(len(names) + 1, count + 1)]
+    return names
+
 
 # Function to generate random data
-def generate_random_data():
-    categories = ['food', 'travel', 'education', 'shopping', 'entertainment']
-    start_date = datetime.date(2024, 1, 1)
-    end_date = datetime.date(2024, 12, 31)
-    data = []
-    for i in range(1, 1001):
-        date = start_date + datetime.timedelta(days=random.randint(0, (end_date - start_date).days))
-        category = random.choice(categories)
-        amount = round(random.uniform(10.0, 500.0), 2)
-        data.append(f"{i}|{date.strftime('%d-%m-%Y')}|{category}|{amount}|")
-    return data
-
-# Generate random data
-random_data = generate_random_data()
-
-# Write data to file
-with open('generated_data.txt', 'w') as f:
-    for entry in random_data:
-        f.write(entry + '\n')
-
-print("Generated 1000 data entries with continuous serial numbers, different dates of 2024, different categories, and random prices.")
+def generate_random_data(rows=1000, start_date=datetime.date(2024, 1, 1), end_date=datetime.date(2024, 12, 31),
+                         categories=5, skew=0.0, comment_length=0, seed=None):
+    # Yields ledger lines. skew > 0 makes category i+1 about (i+1)**-skew as
+    # likely as the first one (Zipf-like); 0 picks categories uniformly.
+    rng = random.Random(seed)
+    names = category_names(categories)
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) ** skew for rank in range(len(names))))
+    days = (end_date - start_date).days
+    dates = [(start_date + datetime.timedelta(days=offset)).strftime('%d-%m-%Y') for offset in range(days + 1)]
+    letters = string.ascii_lowercase + ' '
+    for i in range(1, rows + 1):
+        date = dates[rng.randint(0, days)]
+        category = rng.choices(names, cum_weights=cum_weights)[0]
+        amount = round(rng.uniform(10.0, 500.0), 2)
+        comment = ''.join(rng.choices(letters, k=comment_length)).strip() if comment_length else ''
+        yield f"{i}|{date}|{category}|{amount}|{comment}"
+
+
+def write_random_data(filename, **options):
+    with open(filename, 'w') as f:
+        batch = []
+        for entry in generate_random_data(**options):
+            batch.append(entry)
+            if len(batch) == 100000:
+                f.write('\n'.join(batch) + '\n')
+                batch = []
+        if batch:
+            f.write('\n'.join(batch) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a random SpendWise ledger.")
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--start', default='01-01-2024', help="first date, dd-mm-yyyy")
+    parser.add_argument('--end', default='31-12-2024', help="last date, dd-mm-yyyy")
+    parser.add_argument('--categories', type=int, default=5, help="number of distinct categories")
+    parser.add_argument('--skew', type=float, default=0.0, help="Zipf exponent for category popularity")
+    parser.add_argument('--comment-length', type=int, default=0)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--output', default='generated_data.txt')
+    args = parser.parse_args()
+
+    start_date = datetime.datetime.strptime(args.start, '%d-%m-%Y').date()
+    end_date = datetime.datetime.strptime(args.end, '%d-%m-%Y').date()
+    # Write data to file
+    write_random_data(args.output, rows=args.rows, start_date=start_date, end_date=end_date, categories=args.categories,
+                      skew=args.skew, comment_length=args.comment_length, seed=args.seed)
+    print(f"Generated {args.rows} data entries with continuous serial numbers, dates between {args.start} and {args.end}, {args.categories} categories, and random prices.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from array import array
+
+# Opt-in instrumentation for ExpenseManager (see
+# ExpenseManager.enable_instrumentation). Nothing here runs unless it is
+# enabled: the manager's methods are wrapped per instance, so a manager
+# without instrumentation calls its methods directly.
+#
+# Per method it records calls, cumulative and percentile latencies, rows
+# scanned and bytes written. Counts are inclusive: the rows a query scans
+# through rows_between are counted for both. Bytes written are measured
+# from the size of the ledger's files (ledger, journal, cube, SQLite WAL, or
+# every file of a sharded ledger) around each storage write, so they are
+# approximate for SQLite.
+
+# Manager methods that are timed.
+INSTRUMENTED_METHODS = (
+    'load_expenses', 'ensure_loaded', 'save_expenses', 'write_ledger', 'compact', 'persist', 'persist_many',
+    'add_expense', 'add_expenses_bulk', 'import_expenses', 'edit_expense', 'delete_expense',
+    'query', 'rollup', 'analytics', 'burn_rate', 'period_totals', 'records_between', 'records_by_category', 'rows_between', 'group_by_category',
+    'view_expenses', 'view_monthly_expenses', 'view_yearly_expenses',
+    'view_daily_expense_by_category', 'view_monthly_expense_by_category', 'view_yearly_expense_by_category',
+    'total_expenses', 'total_monthly_expense', 'total_yearly_expense',
+    'total_daily_expense_by_category', 'total_monthly_expense_by_category', 'total_yearly_expense_by_category',
+    'visualize_expenses_by_date', 'visualize_expenses_by_month', 'visualize_expenses_by_year', 'visualize_monthexpenses_by_year',
+    'render_charts', 'rebuild_aggregates', 'verify_aggregates', 'compact_rows',
+)
+# Methods that walk every row of the ledger.
+FULL_SCANS = ('rebuild_aggregates', 'verify_aggregates', 'compact_rows')
+# Storage methods that write to disk.
+STORAGE_WRITES = ('write_all', 'record', 'record_many', 'save_cube', 'flush')
+# Files a storage backend may write, relative to its ledger filename.
+STORAGE_SUFFIXES = ('', '.journal', '.cube', '-wal')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, round(p / 100 * (len(values) - 1)))] if values else 0.0
+
+
+def file_state(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size
+
+
+def written_between(before, after):
+    # Bytes written to one file between two file_state()s: a replaced file
+    # counts in full, an appended one by how much it grew.
+    if after is None:
+        return 0
+    if before is None or before[0] != after[0]:
+        return after[1]
+    return max(0, after[1] - before[1])
+
+
+class MethodStats:
+    # Counters for one method. Latencies keep the most recent max_samples
+    # calls in a ring buffer for the percentiles.
+    def __init__(self, max_samples):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.samples = array('d')
+        self.max_samples = max_samples
+
+    def observe(self, seconds):
+        if len(self.samples) < self.max_samples:
+            self.samples.append(seconds)
+        else:
+            self.samples[self.calls % self.max_samples] = seconds
+        self.calls += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def summary(self):
+        return {"calls": self.calls, "seconds": self.seconds,
+                "mean_ms": self.seconds / self.calls * 1000 if self.calls else 0.0,
+                "p50_ms": percentile(self.samples, 50) * 1000, "p90_ms": percentile(self.samples, 90) * 1000,
+                "p99_ms": percentile(self.samples, 99) * 1000, "max_ms": self.max_seconds * 1000,
+                "rows_scanned": self.rows, "bytes_written": self.bytes}
+
+
+class Instrumentation:
+    def __init__(self, max_samples=4096, profile=False, profile_dir=None):
+        self.max_samples = max_samples
+        self.methods = {}
+        self.rows = 0
+        self.bytes = 0
+        # Methods running on each thread, outermost first; rows and bytes
+        # are credited to all of them.
+        self.local = threading.local()
+        # Profile mode runs each outermost call under cProfile and
+        # tracemalloc and prints a report (see capture).
+        self.profile = profile
+        self.profile_dir = profile_dir
+        self.captures = 0
+        self.wrapped = {}
+        self.storages = []
+
+    def method(self, name):
+        stats = self.methods.get(name)
+        if stats is None:
+            stats = self.methods[name] = MethodStats(self.max_samples)
+        return stats
+
+    def active(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def add_rows(self, count):
+        self.rows += count
+        for stats in self.active():
+            stats.rows += count
+
+    def add_bytes(self, count):
+        self.bytes += count
+        for stats in self.active():
+            stats.bytes += count
+
+    def wrap(self, name, function, rows=None):
+        # A timed version of function. rows(result) gives the rows the call
+        # scanned.
+        def wrapper(*args, **kwargs):
+            stack = self.active()
+            if self.profile and not stack:
+                return self.capture(name, function, rows, args, kwargs)
+            stats = self.method(name)
+            stack.append(stats)
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+                if rows is not None:
+                    self.add_rows(rows(result))
+                return result
+            finally:
+                stats.observe(time.perf_counter() - start)
+                stack.pop()
+        return wrapper
+
+    def attach(self, manager):
+        # Replace the manager's methods with timed ones on the instance,
+        # remembering what the instance held before.
+        for name in INSTRUMENTED_METHODS:
+            function = getattr(manager, name)
+            if name in FULL_SCANS:
+                function = self.counting_scan(manager, function)
+            elif name == 'write_ledger':
+                function = self.watching_write(function)
+            self.wrapped[name] = manager.__dict__.get(name)
+            setattr(manager, name, self.wrap(name, function, len if name == 'rows_between' else None))
+        self.wrapped['ledger_storage'] = manager.__dict__.get('ledger_storage')
+        ledger_storage = manager.ledger_storage
+        manager.ledger_storage = lambda: self.watch(ledger_storage())
+        if manager.storage is not None:
+            self.watch(manager.storage)
+
+    def detach(self, manager):
+        for name, previous in self.wrapped.items():
+            if previous is None:
+                manager.__dict__.pop(name, None)
+            else:
+                setattr(manager, name, previous)
+        self.wrapped = {}
+        for storage in self.storages:
+            for name in ('instrumented', 'read') + STORAGE_WRITES:
+                storage.__dict__.pop(name, None)
+        self.storages = []
+
+    def counting_scan(self, manager, function):
+        def scan(*args, **kwargs):
+            self.add_rows(len(manager.columns))
+            return function(*args, **kwargs)
+        return scan
+
+    def watching_write(self, function):
+        # write_ledger may be handed another storage (save_expenses to a new
+        # file); measure that one too.
+        def write_ledger(storage=None):
+            return function(storage if storage is None else self.watch(storage))
+        return write_ledger
+
+    def watch(self, storage):
+        # Wrap a storage backend's reads and writes once.
+        if getattr(storage, 'instrumented', None) is self:
+            return storage
+        storage.instrumented = self
+        self.storages.append(storage)
+        read = storage.read
+        storage.read = lambda *args, **kwargs: self.counting_read(read(*args, **kwargs))
+        # A sharded ledger lists its files itself, as shards come and go.
+        paths = getattr(storage, 'paths', None)
+        if paths is None:
+            paths = lambda: [storage.filename + suffix for suffix in STORAGE_SUFFIXES]
+        for name in STORAGE_WRITES:
+            setattr(storage, name, self.wrap('storage.' + name, self.measuring_write(getattr(storage, name), paths)))
+        return storage
+
+    def counting_read(self, batches):
+        # storage.read yields column batches lazily; time each one as it is
+        # parsed and count its rows.
+        stats = self.method('storage.read')
+        seconds = 0.0
+        while True:
+            start = time.perf_counter()
+            try:
+                columns = next(batches)
+            except StopIteration:
+                stats.observe(seconds)
+                return
+            finally:
+                seconds += time.perf_counter() - start
+            stats.rows += len(columns[0])
+            self.add_rows(len(columns[0]))
+            yield columns
+
+    def measuring_write(self, function, paths):
+        def write(*args, **kwargs):
+            before = {path: file_state(path) for path in paths()}
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add_bytes(sum(written_between(before.get(path), file_state(path)) for path in paths()))
+        return write
+
+    def capture(self, name, function, rows, args, kwargs):
+        # Run one call under cProfile and tracemalloc, then print where the
+        # time and memory went; with profile_dir the raw profile is also
+        # saved there for pstats or snakeviz.
+        self.profile = False
+        profiler = cProfile.Profile()
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        try:
+            profiler.enable()
+            try:
+                return self.wrap(name, function, rows)(*args, **kwargs)
+            finally:
+                profiler.disable()
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics('lineno')[:5]
+            if not tracing:
+                tracemalloc.stop()
+            self.profile = True
+            self.captures += 1
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(10)
+            print(f"--- profile of {name} ---")
+            print(output.getvalue().strip())
+            print(f"Memory: peak {peak / 1024:.1f} KiB, {current / 1024:.1f} KiB still allocated")
+            for statistic in top:
+                print(f"  {statistic}")
+            if self.profile_dir:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                path = os.path.join(self.profile_dir, f"{self.captures:04d}-{name}.prof")
+                profiler.dump_stats(path)
+                print(f"Profile saved to {path}")
+
+    def stats(self):
+        return {"rows_scanned": self.rows, "bytes_written": self.bytes,
+                "methods": {name: stats.summary() for name, stats in sorted(self.methods.items()) if stats.calls}}
+
+    def prometheus(self):
+        # The stats in the Prometheus text exposition format.
+        lines = []
+        methods = self.stats()["methods"]
+        for metric, kind, help_text, field in (
+                ('spendwise_calls_total', 'counter', 'Calls per ExpenseManager method.', 'calls'),
+                ('spendwise_rows_scanned_total', 'counter', 'Ledger rows scanned, including by nested calls.', 'rows_scanned'),
+                ('spendwise_bytes_written_total', 'counter', 'Bytes written to the ledger files, including by nested calls.', 'bytes_written')):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+            lines += [f'{metric}{{method="{name}"}} {summary[field]}' for name, summary in methods.items()]
+        lines += ["# HELP spendwise_latency_seconds Latency per ExpenseManager method over recent calls.",
+                  "# TYPE spendwise_latency_seconds summary"]
+        for name, summary in methods.items():
+            for quantile in (50, 90, 99):
+                lines.append(f'spendwise_latency_seconds{{method="{name}",quantile="{quantile / 100}"}} {summary[f"p{quantile}_ms"] / 1000}')
+            lines.append(f'spendwise_latency_seconds_sum{{method="{name}"}} {summary["seconds"]}')
+            lines.append(f'spendwise_latency_seconds_count{{method="{name}"}} {summary["calls"]}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, filename, format=None):
+        # Write the stats to filename as 'json' or 'prometheus' text; by
+        # default .prom and .txt files get the latter.
+        if format is None:
+            format = 'prometheus' if filename.endswith(('.prom', '.txt')) else 'json'
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            if format == 'prometheus':
+                f.write(self.prometheus())
+            elif format == 'json':
+                json.dump(self.stats(), f, indent=2)
+            else:
+                raise ValueError(f"Unknown stats format {format!r}; expected 'json' or 'prometheus'")
+        os.replace(tmp_filename, filename)
@@ -0,0 +1,133 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from instrument import percentile
+
+
+async def request(reader, writer, method, path, body=None):
+    data = json.dumps(body).encode('utf-8') if body is not None else b''
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: spendwise\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode('latin-1') + data)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    payload = json.loads(await reader.readexactly(length))
+    return status, payload
+
+
+async def client(host, port, deadline, write_ratio, rng, latencies, errors):
+    # One keep-alive connection issuing a mix of reads and writes until the
+    # deadline. Writes are adds and amount edits of the client's own records.
+    reader, writer = await asyncio.open_connection(host, port)
+    own = []
+    try:
+        while time.perf_counter() < deadline:
+            day = f"{rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-2024"
+            if rng.random() < write_ratio:
+                if own and rng.random() < 0.5:
+                    operation, args = 'edit', ('PATCH', f"/expenses/{rng.choice(own)}", {"amount": round(rng.uniform(10, 500), 2)})
+                else:
+                    operation, args = 'add', ('POST', '/expenses', {"category": rng.choice(['food', 'travel', 'shopping']), "amount": round(rng.uniform(10, 500), 2), "date": day, "comment": 'loadtest'})
+            elif rng.random() < 0.5:
+                operation, args = 'query', ('GET', f"/expenses?start={day}&end={day}")
+            else:
+                operation, args = 'totals', ('GET', f"/totals?year=2024&month={rng.randint(1, 12)}")
+            start = time.perf_counter()
+            status, payload = await request(reader, writer, *args)
+            latencies.setdefault(operation, []).append(time.perf_counter() - start)
+            if status >= 400:
+                errors.append((operation, status, payload.get('error')))
+            elif operation == 'add':
+                own.append(payload['expense']['serial_number'])
+    finally:
+        writer.close()
+
+
+async def run(host, port, connections, duration, write_ratio, seed):
+    latencies, errors = {}, []
+    deadline = time.perf_counter() + duration
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, deadline, write_ratio, random.Random(seed + i), latencies, errors) for i in range(connections)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def wait_for_port(host, port, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("service exited during startup")
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"service did not start listening on {host}:{port}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test a SpendWise service and report latency percentiles and throughput.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--ledger', help="start a local service on a copy of this ledger instead of using a running one")
+    parser.add_argument('--service-args', default='', help="extra arguments for the local service, given with '=' since they start with dashes, "
+                                                           "e.g. --service-args='--journal --stable-ids'")
+    parser.add_argument('--connections', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds")
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="also write the report as JSON here")
+    args = parser.parse_args()
+
+    process = directory = None
+    try:
+        if args.ledger:
+            directory = tempfile.mkdtemp()
+            ledger = os.path.join(directory, os.path.basename(args.ledger))
+            shutil.copy(args.ledger, ledger)
+            with socket.socket() as probe:
+                probe.bind((args.host, 0))
+                args.port = probe.getsockname()[1]
+            process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'service.py'), ledger,
+                                        '--host', args.host, '--port', str(args.port), *args.service_args.split()], stdout=subprocess.DEVNULL)
+            wait_for_port(args.host, args.port, process)
+        latencies, errors, seconds = asyncio.run(run(args.host, args.port, args.connections, args.duration, args.write_ratio, args.seed))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if directory is not None:
+            shutil.rmtree(directory)
+
+    total = sum(len(values) for values in latencies.values())
+    report = {"connections": args.connections, "seconds": seconds, "requests": total, "requests_per_second": total / seconds,
+              "errors": len(errors), "operations": {}}
+    print(f"{'operation':<10} {'requests':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for operation, values in sorted(latencies.items()) + [('all', [value for values in latencies.values() for value in values])]:
+        p50, p99 = percentile(values, 50) * 1000, percentile(values, 99) * 1000
+        report["operations"][operation] = {"requests": len(values), "p50_ms": p50, "p99_ms": p99}
+        print(f"{operation:<10} {len(values):>9} {p50:>9.2f} {p99:>9.2f}")
+    print(f"{total / seconds:.0f} requests/sec over {seconds:.1f}s, {len(errors)} errors")
+    for operation, status, error in errors[:5]:
+        print(f"  {operation}: {status} {error}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import argparse
+import calendar
+import datetime
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from storage import DATE_FORMAT, parse_date
+
+# Charts are drawn on plain Agg figures (no pyplot, no GUI backend), so this
+# runs on servers and never blocks on plt.show(). The kinds mirror the
+# ExpenseManager.visualize_* methods:
+#   day     category pie per day           (visualize_expenses_by_date)
+#   month   category pie per month         (visualize_expenses_by_month)
+#   year    category pie per year          (visualize_expenses_by_year)
+#   months  monthly bar chart per year     (visualize_monthexpenses_by_year)
+CHART_KINDS = ('day', 'month', 'year', 'months')
+CACHE_FILENAME = '.render-cache.json'
+
+
+def as_date(value):
+    return value if isinstance(value, datetime.date) else parse_date(value)
+
+
+def chart_specs(aggregates, kind, start, end):
+    # One spec per chart in [start, end] that has data, read straight from
+    # the aggregates, so the ledger itself is never rescanned.
+    start, end = as_date(start), as_date(end)
+    specs = []
+    if kind == 'day':
+        for ordinal in range(start.toordinal(), end.toordinal() + 1):
+            values = aggregates.by_category(('day', ordinal))
+            if values:
+                day = datetime.date.fromordinal(ordinal)
+                specs.append({"name": f"day-{day.isoformat()}", "type": 'pie', "figsize": (10, 6), "title": f"Expense Summary on {day.strftime(DATE_FORMAT)}",
+                              "labels": list(values), "values": list(values.values())})
+    elif kind == 'month':
+        year, month = start.year, start.month
+        while (year, month) <= (end.year, end.month):
+            values = aggregates.by_category(('month', year, month))
+            if values:
+                specs.append({"name": f"month-{year}-{month:02d}", "type": 'pie', "figsize": (10, 6), "title": f"Expense Summary for {calendar.month_name[month]} {year}",
+                              "labels": list(values), "values": list(values.values())})
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    elif kind == 'year':
+        for year in range(start.year, end.year + 1):
+            values = aggregates.by_category(('year', year))
+            if values:
+                specs.append({"name": f"year-{year}", "type": 'pie', "figsize": (10, 6), "title": f"Expense Summary for {year}",
+                              "labels": list(values), "values": list(values.values())})
+    elif kind == 'months':
+        for year in range(start.year, end.year + 1):
+            values = aggregates.by_month(year)
+            if values:
+                specs.append({"name": f"months-{year}", "type": 'bar', "figsize": (12, 6), "title": f"Expense Summary for {year}",
+                              "labels": list(values), "values": list(values.values())})
+    else:
+        raise ValueError(f"Unknown chart kind {kind!r}; expected one of {', '.join(CHART_KINDS)}")
+    return specs
+
+
+def spec_digest(spec, formats):
+    return hashlib.sha1(json.dumps([spec, formats], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def render_batch(jobs):
+    # Draw a batch of charts, reusing one figure per size instead of creating
+    # a new one for every chart.
+    figures = {}
+    for spec, paths in jobs:
+        figsize = tuple(spec['figsize'])
+        figure = figures.get(figsize)
+        if figure is None:
+            figure = figures[figsize] = Figure(figsize=figsize)
+            FigureCanvasAgg(figure)
+        figure.clear()
+        axes = figure.add_subplot()
+        if spec['type'] == 'pie':
+            axes.pie(spec['values'], labels=spec['labels'], autopct='%1.1f%%', startangle=140)
+            axes.axis('equal')
+        else:
+            axes.bar(spec['labels'], spec['values'], color='skyblue')
+            axes.set_xlabel('Month')
+            axes.set_ylabel('Total Expenses')
+            axes.tick_params(axis='x', labelrotation=45)
+        axes.set_title(spec['title'])
+        if spec['type'] == 'bar':
+            figure.tight_layout()
+        for path in paths:
+            figure.savefig(path)
+    return len(jobs)
+
+
+def render_charts(aggregates, kind, start, end, directory, formats=('png',), workers=1):
+    # Render every `kind` chart between start and end into directory as each
+    # of formats (png, svg, ...). Charts whose data and formats match the
+    # previous run, according to the cache manifest in directory, are
+    # skipped. Returns (rendered, skipped) counts.
+    os.makedirs(directory, exist_ok=True)
+    formats = list(formats)
+    cache_path = os.path.join(directory, CACHE_FILENAME)
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+
+    jobs, skipped = [], 0
+    for spec in chart_specs(aggregates, kind, start, end):
+        paths = [os.path.join(directory, f"{spec['name']}.{fmt}") for fmt in formats]
+        digest = spec_digest(spec, formats)
+        if cache.get(spec['name']) == digest and all(os.path.exists(path) for path in paths):
+            skipped += 1
+            continue
+        cache[spec['name']] = digest
+        jobs.append((spec, paths))
+
+    if workers == 1 or len(jobs) < 2:
+        render_batch(jobs)
+    else:
+        batches = [jobs[i::workers] for i in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(render_batch, [batch for batch in batches if batch]))
+
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, cache_path)
+    return len(jobs), skipped
+
+
+def main():
+    from spendwise import aggregate_ledger
+
+    parser = argparse.ArgumentParser(description="Render SpendWise charts for a date range without a display.")
+    parser.add_argument('ledger')
+    parser.add_argument('--kind', choices=CHART_KINDS, default='month')
+    parser.add_argument('--start', required=True, help="dd-mm-yyyy")
+    parser.add_argument('--end', required=True, help="dd-mm-yyyy")
+    parser.add_argument('--output', default='charts')
+    parser.add_argument('--formats', default='png', help="comma separated, e.g. png,svg")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    rendered, skipped = render_charts(aggregate_ledger(args.ledger), args.kind, args.start, args.end, args.output,
+                                      args.formats.split(','), args.workers)
+    print(f"Rendered {rendered} charts, {skipped} unchanged.")
+
+
+if __name__ == "__main__":
+    main()
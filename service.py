@@ -0,0 +1,326 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from spendwise import ExpenseManager
+
+# A small HTTP/JSON front-end over ExpenseManager:
+#   GET    /expenses?start=&end=&category=   records in date order
+#   POST   /expenses                         {category, amount, date, comment}
+#   GET    /expenses/<serial>
+#   PATCH  /expenses/<serial>                any of category, amount, date, comment
+#   DELETE /expenses/<serial>
+#   GET    /totals?date=  |  ?year=&month=  |  ?year=
+#   GET    /stats                            instrumentation (--instrument) and query cache counters
+# Mutations are applied in memory straight away; the disk writes they cause
+# are handed to one writer task, which commits everything queued since its
+# last round in a single batch (group commit) before the requests that
+# queued them are answered. Committing only reads the manager, so it holds
+# the read lock: queries carry on while it writes. Mutations wait for it to
+# finish before they ask for the write lock, so that they don't hold back
+# queries in the meantime.
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ReadWriteLock:
+    # Any number of readers or one writer. A waiting writer holds back new
+    # readers, so a steady stream of queries can't starve the writer task's
+    # commits.
+    def __init__(self):
+        self.readers = 0
+        self.writing = False
+        self.waiting = 0
+        self.condition = asyncio.Condition()
+
+    @contextlib.asynccontextmanager
+    async def read(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: not self.writing and not self.waiting)
+            self.readers += 1
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.readers -= 1
+                self.condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def write(self):
+        async with self.condition:
+            self.waiting += 1
+            try:
+                await self.condition.wait_for(lambda: not self.writing and not self.readers)
+            finally:
+                self.waiting -= 1
+                # Wakes the readers this writer held back if it was cancelled.
+                self.condition.notify_all()
+            self.writing = True
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+
+class ExpenseService:
+    def __init__(self, manager):
+        self.manager = manager
+        self.lock = ReadWriteLock()
+        self.pending = []
+        self.wakeup = asyncio.Event()
+        # One thread, so storage objects (e.g. the SQLite connection) are
+        # only ever used from one place at a time.
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # Clear while a commit is being written.
+        self.idle = asyncio.Event()
+        self.idle.set()
+        # Queries run alongside a commit on the executor thread, so they must
+        # not change the manager: the totals are copied out of a saved cube
+        # now rather than as they are first asked for.
+        manager.aggregates.load_periods()
+        # The manager persists through self.defer instead of writing itself.
+        manager.persist = self.defer
+
+    def defer(self, op, expense):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((op, dict(expense), future))
+        self.wakeup.set()
+
+    def commit(self, batch):
+        # Runs on the executor thread while the writer task holds the read
+        # lock: persisting reads the manager's rows, indexes and totals but
+        # changes nothing queries use, and no mutation runs meanwhile.
+        self.manager.persist_many(batch)
+
+    async def writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            self.idle.clear()
+            try:
+                async with self.lock.read():
+                    batch, self.pending = self.pending, []
+                    if not batch:
+                        continue
+                    try:
+                        await loop.run_in_executor(self.executor, self.commit, [(op, expense) for op, expense, future in batch])
+                    except Exception as error:
+                        for op, expense, future in batch:
+                            if not future.done():
+                                future.set_exception(error)
+                    else:
+                        for op, expense, future in batch:
+                            if not future.done():
+                                future.set_result(None)
+            finally:
+                self.idle.set()
+
+    async def mutate(self, function, *args):
+        # Apply a mutation under the write lock and wait for its group commit.
+        # Returns the result plus anything the manager printed (limit warnings).
+        await self.idle.wait()
+        async with self.lock.write():
+            queued = len(self.pending)
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                result = function(*args)
+            futures = [future for op, expense, future in self.pending[queued:]]
+        if futures:
+            await asyncio.gather(*futures)
+        return result, output.getvalue().splitlines()
+
+    def find(self, serial_number):
+        try:
+            row = self.manager.slots.get(int(serial_number))
+        except ValueError:
+            row = None
+        if row is None:
+            raise RequestError(HTTPStatus.NOT_FOUND, f"No expense with serial number {serial_number}")
+        return row
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+        parts = [part for part in url.path.split('/') if part]
+        manager = self.manager
+        try:
+            fields = json.loads(body) if body else {}
+            if not isinstance(fields, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as error:
+            raise RequestError(HTTPStatus.BAD_REQUEST, f"Invalid JSON body: {error}")
+
+        if parts == ['expenses'] and method == 'GET':
+            async with self.lock.read():
+                return HTTPStatus.OK, {"expenses": manager.query(first(params, 'start'), first(params, 'end'), params.get('category'))}
+
+        if parts == ['expenses'] and method == 'POST':
+            self.check_fields(fields, required=True)
+            row, warnings = await self.mutate(self.add, fields)
+            return HTTPStatus.CREATED, {"expense": row, "warnings": warnings}
+
+        if len(parts) == 2 and parts[0] == 'expenses':
+            if method == 'GET':
+                async with self.lock.read():
+                    return HTTPStatus.OK, {"expense": dict(manager.expenses[self.find(parts[1])])}
+            if method == 'PATCH':
+                self.check_fields(fields, required=False)
+                row, warnings = await self.mutate(self.edit, parts[1], fields)
+                return HTTPStatus.OK, {"expense": row, "warnings": warnings}
+            if method == 'DELETE':
+                serial_number, warnings = await self.mutate(self.delete, parts[1])
+                return HTTPStatus.OK, {"deleted": serial_number}
+
+        if parts == ['totals'] and method == 'GET':
+            async with self.lock.read():
+                return HTTPStatus.OK, self.totals(params)
+
+        if parts == ['stats'] and method == 'GET':
+            return HTTPStatus.OK, dict(manager.stats(), cache=manager.cache_stats())
+
+        raise RequestError(HTTPStatus.NOT_FOUND, f"No route for {method} {url.path}")
+
+    def check_fields(self, fields, required):
+        # Reject bad input before anything is queued. Text fields must not
+        # contain the ledger's field or record separators.
+        category, amount, date = fields.get('category'), fields.get('amount'), fields.get('date')
+        if required or category:
+            if not isinstance(category, str) or not category.strip():
+                raise RequestError(HTTPStatus.BAD_REQUEST, "category must be a non-empty string")
+        if required or amount not in (None, ''):
+            fields['amount'] = checked_amount(amount)
+        if date:
+            self.manager.columns.parse_date(date)
+        for name in ('category', 'date', 'comment'):
+            value = fields.get(name)
+            if value is not None and (not isinstance(value, str) or '|' in value or '\n' in value):
+                raise RequestError(HTTPStatus.BAD_REQUEST, f"{name} must be a string without '|' or newlines")
+
+    # The mutations below run under the write lock.
+    def add(self, fields):
+        self.manager.add_expense(fields['category'], fields['amount'], fields.get('date'), fields.get('comment'))
+        return dict(self.manager.expenses[-1])
+
+    def edit(self, serial_number, fields):
+        manager = self.manager
+        self.find(serial_number)
+        manager.edit_expense(int(serial_number), fields.get('category'), fields.get('amount'), fields.get('date'), fields.get('comment'))
+        return dict(manager.expenses[manager.slots[int(serial_number)]])
+
+    def delete(self, serial_number):
+        self.find(serial_number)
+        self.manager.delete_expense(int(serial_number))
+        return int(serial_number)
+
+    def totals(self, params):
+        return self.manager.period_totals(first(params, 'date'), first(params, 'year'), first(params, 'month'))
+
+    async def handle(self, reader, writer):
+        # HTTP/1.1 with keep-alive; just enough for JSON clients.
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length') or 0))
+                try:
+                    status, payload = await self.dispatch(method, target, body)
+                except RequestError as error:
+                    status, payload = error.status, {"error": str(error)}
+                except (ValueError, KeyError, IndexError) as error:
+                    status, payload = HTTPStatus.BAD_REQUEST, {"error": str(error)}
+                except Exception as error:
+                    status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(error)}
+                data = json.dumps(payload).encode('utf-8')
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8080):
+        writer_task = asyncio.create_task(self.writer())
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving {self.manager.filename} on http://{host}:{port}", flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            writer_task.cancel()
+            self.executor.shutdown()
+            if self.pending:
+                self.commit([(op, expense) for op, expense, future in self.pending])
+            self.manager.ledger_storage().close()
+
+
+def first(params, name):
+    values = params.get(name)
+    return values[0] if values else None
+
+
+def checked_amount(amount):
+    try:
+        amount = float(amount)
+    except (TypeError, ValueError):
+        amount = math.nan
+    if not math.isfinite(amount):
+        raise RequestError(HTTPStatus.BAD_REQUEST, "amount must be a number")
+    return amount
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a SpendWise ledger over HTTP/JSON.")
+    parser.add_argument('ledger')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--journal', action='store_true', help="use the journaled storage mode")
+    parser.add_argument('--stable-ids', action='store_true')
+    parser.add_argument('--instrument', action='store_true', help="record per-method statistics, served at /stats")
+    parser.add_argument('--stats', help="with --instrument, write the statistics here on exit (.json or .prom)")
+    parser.add_argument('--cache-size', type=int, default=256, help="query results to cache (0 disables the cache)")
+    parser.add_argument('--cache-records', type=int, default=100000, help="records the cached results may hold between them")
+    args = parser.parse_args()
+
+    manager = ExpenseManager(journal=args.journal, stable_ids=args.stable_ids, cache_size=args.cache_size, cache_records=args.cache_records)
+    manager.load_expenses(args.ledger)
+    service = ExpenseService(manager)
+    if args.instrument:
+        # After the service has routed persist through its writer, so the
+        # deferred version is the one timed.
+        manager.enable_instrumentation()
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.instrument and args.stats:
+            manager.dump_stats(args.stats)
+
+
+if __name__ == "__main__":
+    main()
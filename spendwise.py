@@ -1,9 +1,907 @@
 import datetime
-import matplotlib.pyplot as plt
+import gc
+import itertools
+import math
+import os
+import sys
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping, MutableMapping, Sequence
+from bisect import bisect_left, bisect_right, insort
+from storage import (DATE_FORMAT, LoadReport, is_sharded, iter_csv_records, iter_ledger_columns, ledger_signature, merge_cell, month_bounds,
+                     open_storage, parse_date, read_cube, shard_files)
+
+# calendar.month_name, built the same way; importing calendar (and with it
+# locale and re) would take most of this module's import time.
+MONTH_NAMES = [''] + [datetime.date(2000, month, 1).strftime('%B') for month in range(1, 13)]
+
+
+def pyplot():
+    # matplotlib.pyplot, imported the first time a chart is shown: it takes
+    # far longer to import than the rest of the program put together.
+    import matplotlib.pyplot
+    return matplotlib.pyplot
+
+
+class ExpenseColumns:
+    # The ledger as parallel columns, one entry per row, instead of a dict per
+    # record. Dates and categories are interned and stored as small codes,
+    # amounts as integer cents, and deleted rows (tombstones) are flagged in
+    # `live`. Dates are also kept parsed, so queries compare small integers
+    # instead of running strptime over every record.
+    def __init__(self):
+        self.serials = array('q')
+        self.date_codes = array('I')
+        self.ordinals = array('l')
+        self.years = array('H')
+        self.months = array('B')
+        self.days = array('B')
+        self.category_codes = array('I')
+        self.cents = array('q')
+        self.comments = []
+        self.live = bytearray()
+        self.category_names = []
+        self.category_lookup = {}
+        self.date_names = []
+        self.date_lookup = {}
+        self.date_cache = {}
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def parse_date(self, date):
+        parsed = self.date_cache.get(date)
+        if parsed is None:
+            parsed = parse_date(date)
+            self.date_cache[date] = parsed
+        return parsed
+
+    def category_code(self, category):
+        code = self.category_lookup.get(category)
+        if code is None:
+            code = len(self.category_names)
+            self.category_names.append(category)
+            self.category_lookup[category] = code
+        return code
+
+    def date_code(self, date):
+        code = self.date_lookup.get(date)
+        if code is None:
+            code = len(self.date_names)
+            self.date_names.append(date)
+            self.date_lookup[date] = code
+        return code
+
+    def intern(self, category):
+        return self.category_names[self.category_code(category)]
+
+    def extend(self, serials, dates, parsed, categories, amounts, comments):
+        # Bulk append of already parsed dates. Returns the interned categories
+        # and the amounts as stored (rounded to the cent).
+        info = {}
+        rows = [info[date] if date in info else info.setdefault(date, (date.toordinal(), date.year, date.month, date.day)) for date in parsed]
+        lookup = self.category_lookup
+        codes = [lookup[category] if category in lookup else self.category_code(category) for category in categories]
+        date_lookup = self.date_lookup
+        self.serials.extend(serials)
+        self.date_codes.extend([date_lookup[date] if date in date_lookup else self.date_code(date) for date in dates])
+        self.ordinals.extend([row[0] for row in rows])
+        self.years.extend([row[1] for row in rows])
+        self.months.extend([row[2] for row in rows])
+        self.days.extend([row[3] for row in rows])
+        self.category_codes.extend(codes)
+        cents = [round(amount * 100) for amount in amounts]
+        self.cents.extend(cents)
+        self.comments.extend(comments)
+        self.live.extend(b'\x01' * len(cents))
+        names = self.category_names
+        return [names[code] for code in codes], [amount / 100 for amount in cents]
+
+    def append(self, serial_number, date, category, amount, comment):
+        parsed = self.parse_date(date)
+        self.serials.append(serial_number)
+        self.date_codes.append(self.date_code(date))
+        self.ordinals.append(parsed.toordinal())
+        self.years.append(parsed.year)
+        self.months.append(parsed.month)
+        self.days.append(parsed.day)
+        self.category_codes.append(self.category_code(category))
+        self.cents.append(round(amount * 100))
+        self.comments.append(comment)
+        self.live.append(1)
+
+    def update(self, row, date, category, amount, comment):
+        parsed = self.parse_date(date)
+        self.date_codes[row] = self.date_code(date)
+        self.ordinals[row] = parsed.toordinal()
+        self.years[row] = parsed.year
+        self.months[row] = parsed.month
+        self.days[row] = parsed.day
+        self.category_codes[row] = self.category_code(category)
+        self.cents[row] = round(amount * 100)
+        self.comments[row] = comment
+
+    def delete(self, row):
+        for column in (self.serials, self.date_codes, self.ordinals, self.years, self.months, self.days, self.category_codes, self.cents, self.comments, self.live):
+            del column[row]
+
+    def clear(self):
+        self.__init__()
+
+    def key(self, row):
+        return self.ordinals[row], self.years[row], self.months[row], self.category_names[self.category_codes[row]], self.cents[row] / 100
+
+    def field(self, row, name):
+        if name == 'serial_number':
+            return self.serials[row]
+        if name == 'date':
+            return self.date_names[self.date_codes[row]]
+        if name == 'category':
+            return self.category_names[self.category_codes[row]]
+        if name == 'amount':
+            return self.cents[row] / 100
+        if name == 'comment':
+            return self.comments[row]
+        raise KeyError(name)
+
+
+EXPENSE_FIELDS = ('serial_number', 'date', 'category', 'amount', 'comment')
+
+
+class ExpenseRecord(Mapping):
+    # Read-only dict-like view of one row of ExpenseColumns. It reads the row
+    # when indexed, so hold on to dict(record) rather than the view if rows
+    # may be deleted in between.
+    __slots__ = ('columns', 'row')
+
+    def __init__(self, columns, row):
+        self.columns = columns
+        self.row = row
+
+    def __getitem__(self, name):
+        return self.columns.field(self.row, name)
+
+    def __iter__(self):
+        return iter(EXPENSE_FIELDS)
+
+    def __len__(self):
+        return len(EXPENSE_FIELDS)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class ExpenseRecords(Sequence):
+    # ExpenseManager.expenses: a read-only list of ExpenseRecord views over
+    # the columns, with None in place of deleted rows.
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            start, stop, step = row.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return list(self.records(start, stop))
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError('expense row out of range')
+        return ExpenseRecord(self.columns, row) if self.columns.live[row] else None
+
+    def __iter__(self):
+        return self.records()
+
+    def take(self, rows):
+        # Dict copies of the given live rows.
+        columns = self.columns
+        serials, date_codes, category_codes, cents, comments = columns.serials, columns.date_codes, columns.category_codes, columns.cents, columns.comments
+        dates, categories = columns.date_names, columns.category_names
+        return [{"serial_number": serials[row], "date": dates[date_codes[row]], "category": categories[category_codes[row]], "amount": cents[row] / 100, "comment": comments[row]}
+                for row in rows]
+
+    def records(self, start=0, stop=None):
+        # Plain dict copies of a run of rows, built column by column; far
+        # cheaper than going through a view per row when saving a ledger.
+        columns = self.columns
+        if stop is None:
+            stop = len(columns)
+        dates, categories = columns.date_names, columns.category_names
+        for lo in range(start, stop, 1 << 16):
+            hi = min(lo + (1 << 16), stop)
+            for alive, serial_number, date, category, cents, comment in zip(columns.live[lo:hi], columns.serials[lo:hi], columns.date_codes[lo:hi],
+                                                                            columns.category_codes[lo:hi], columns.cents[lo:hi], columns.comments[lo:hi]):
+                yield {"serial_number": serial_number, "date": dates[date], "category": categories[category], "amount": cents / 100, "comment": comment} if alive else None
+
+
+class SerialIndex(MutableMapping):
+    # ExpenseManager.slots: serial number -> row. While every row's serial
+    # number is its row + 1 (always so in legacy mode once anything has been
+    # deleted, and for ledgers numbered 1..n) the mapping is implicit and
+    # costs nothing; the first record that breaks the pattern switches it to
+    # a dict.
+    def __init__(self, columns):
+        self.columns = columns
+        self.rows = None
+
+    def __getitem__(self, serial_number):
+        if self.rows is not None:
+            return self.rows[serial_number]
+        row = serial_number - 1 if isinstance(serial_number, int) else -1
+        if 0 <= row < len(self.columns) and self.columns.live[row]:
+            return row
+        raise KeyError(serial_number)
+
+    def __setitem__(self, serial_number, row):
+        # The row's serial number column is expected to be set already.
+        if self.rows is None:
+            if serial_number == row + 1:
+                return
+            self.materialize()
+        self.rows[serial_number] = row
 
-class ExpenseManager:
+    def __delitem__(self, serial_number):
+        if self.rows is None:
+            # The row itself is dropped or flagged dead by the caller.
+            self[serial_number]
+        else:
+            del self.rows[serial_number]
+
+    def __iter__(self):
+        if self.rows is not None:
+            return iter(self.rows)
+        live = self.columns.live
+        return (row + 1 for row in range(len(live)) if live[row])
+
+    def __len__(self):
+        return len(self.rows) if self.rows is not None else self.columns.live.count(1)
+
+    def materialize(self):
+        columns = self.columns
+        self.rows = {columns.serials[row]: row for row in range(len(columns)) if columns.live[row]}
+
+    def extend(self, start):
+        # Rows start.. were just appended to the columns.
+        serials = self.columns.serials
+        if self.rows is None:
+            if serials[start:] != array('q', range(start + 1, len(serials) + 1)):
+                self.materialize()
+        else:
+            self.rows.update(zip(serials[start:], range(start, len(serials))))
+
+    def reset(self):
+        # Called when the serial numbers changed wholesale; the mapping goes
+        # back to implicit if they are 1..n in row order.
+        self.rows = None
+        serials = self.columns.serials
+        if serials != array('q', range(1, len(serials) + 1)):
+            self.materialize()
+
+
+class DateIndex:
+    # Row numbers by date: a bucket of rows (ascending) per day, and the days
+    # that have rows in order. Adding, moving or removing a row touches only
+    # its day's bucket, and a range lookup bisects the days and joins their
+    # buckets, so backdated adds and date edits cost no more than in-order
+    # ones.
     def __init__(self):
-        self.expenses = []
+        self.days = array('l')
+        self.buckets = {}
+        self.size = 0
+        self.unmerged = array('q')
+
+    def __len__(self):
+        return self.size + len(self.unmerged)
+
+    def insert(self, ordinal, row):
+        self.merge()
+        bucket = self.buckets.get(ordinal)
+        if bucket is None:
+            self.buckets[ordinal] = array('l', [row])
+            insort(self.days, ordinal)
+        elif row > bucket[-1]:
+            bucket.append(row)
+        else:
+            insort(bucket, row)
+        self.size += 1
+
+    def extend(self, ordinals, rows):
+        self.unmerged.extend([ordinal << 32 | row for ordinal, row in zip(ordinals, rows)])
+
+    def merge(self):
+        # Bucket the rows added by extend: new rows of a load or import, all
+        # after the rows already indexed, packed as ordinal << 32 | row.
+        # They are bucketed together on the next lookup or change, so a
+        # ledger read in batches is sorted once; packed ints sort far faster
+        # than (ordinal, row) tuples.
+        if not self.unmerged:
+            return
+        keys = sorted(self.unmerged)
+        self.size += len(keys)
+        self.unmerged = array('q')
+        ordinals = array('l', [key >> 32 for key in keys])
+        rows = array('l', [key & 0xFFFFFFFF for key in keys])
+        buckets, new_days = self.buckets, array('l')
+        lo = 0
+        while lo < len(ordinals):
+            day = ordinals[lo]
+            hi = bisect_right(ordinals, day, lo)
+            bucket = buckets.get(day)
+            if bucket is None:
+                buckets[day] = rows[lo:hi]
+                new_days.append(day)
+            else:
+                bucket.extend(rows[lo:hi])
+            lo = hi
+        if new_days:
+            if self.days and new_days[0] < self.days[-1]:
+                new_days = array('l', sorted(self.days + new_days))
+                self.days = array('l')
+            self.days.extend(new_days)
+
+    def remove(self, ordinal, row):
+        self.merge()
+        bucket = self.buckets[ordinal]
+        bucket.remove(row)
+        if not bucket:
+            del self.buckets[ordinal]
+            del self.days[bisect_left(self.days, ordinal)]
+        self.size -= 1
+
+    def shift(self, row):
+        # Every row after `row` moved up by one when it was deleted.
+        self.merge()
+        for day, bucket in self.buckets.items():
+            if bucket[-1] > row:
+                self.buckets[day] = array('l', [r - 1 if r > row else r for r in bucket])
+
+    def span(self, start, end):
+        # Positions in self.days of the days start..end.
+        self.merge()
+        lo = bisect_left(self.days, start) if start is not None else 0
+        hi = bisect_right(self.days, end) if end is not None else len(self.days)
+        return lo, hi
+
+    def range(self, start, end):
+        lo, hi = self.span(start, end)
+        rows, buckets = array('l'), self.buckets
+        for day in self.days[lo:hi]:
+            rows.extend(buckets[day])
+        return rows
+
+    def pairs(self, start, end):
+        # (ordinal, row) of the rows in start..end, in that order.
+        lo, hi = self.span(start, end)
+        buckets = self.buckets
+        return [(day, row) for day in self.days[lo:hi] for row in buckets[day]]
+
+
+class ExpenseIndex:
+    # A date index over all rows plus one posting list (itself date ordered)
+    # per category, so period and category filters cost O(log n + k).
+    def __init__(self):
+        self.dates = DateIndex()
+        self.categories = {}
+
+    def insert(self, row, ordinal, category):
+        self.dates.insert(ordinal, row)
+        postings = self.categories.get(category)
+        if postings is None:
+            postings = self.categories[category] = DateIndex()
+        postings.insert(ordinal, row)
+
+    def extend(self, start, ordinals, categories):
+        self.dates.extend(ordinals, range(start, start + len(ordinals)))
+        for row, (ordinal, category) in enumerate(zip(ordinals, categories), start):
+            postings = self.categories.get(category)
+            if postings is None:
+                postings = self.categories[category] = DateIndex()
+            postings.unmerged.append(ordinal << 32 | row)
+
+    def remove(self, row, ordinal, category):
+        self.dates.remove(ordinal, row)
+        postings = self.categories[category]
+        postings.remove(ordinal, row)
+        if not postings:
+            del self.categories[category]
+
+    def shift(self, row):
+        self.dates.shift(row)
+        for postings in self.categories.values():
+            postings.shift(row)
+
+    def merge(self):
+        # Bucket every row added by extend now, rather than on the next
+        # lookup, so that lookups only read (see service.py).
+        self.dates.merge()
+        for postings in self.categories.values():
+            postings.merge()
+
+    def rows_between(self, start, end, categories=None):
+        if categories is None:
+            return self.dates.range(start, end)
+        pairs = []
+        for category in set(categories):
+            postings = self.categories.get(category)
+            if postings is not None:
+                pairs.extend(postings.pairs(start, end))
+        pairs.sort()
+        return [row for ordinal, row in pairs]
+
+
+def year_bounds(year):
+    return datetime.date(year, 1, 1).toordinal(), datetime.date(year, 12, 31).toordinal()
+
+
+def period_keys(ordinal, year, month):
+    return ('day', ordinal), ('month', year, month), ('year', year), ('all',)
+
+
+class ExpenseAggregates:
+    # A rollup cube of [total, count, min, max] cells per period, and per
+    # category within each period. Periods are ('day', ordinal),
+    # ('month', year, month), ('year', year) and ('all',). Sums and counts
+    # are maintained incrementally at every level. Entries disappear once
+    # their count drops to zero, so removed rows leave no floating point
+    # residue behind. When a removed amount was a cell's min or max, the
+    # caller supplies the remaining amounts of its (day, category) cell to
+    # refresh_extremes, and the coarser extremes are derived from the finer
+    # cells. Loaded from a saved cube, the periods are copied out of it as
+    # they are first used (see load_periods).
+    def __init__(self):
+        self.totals = {}
+        self.category_totals = {}
+        self.saved = None
+        self.loaded_periods = set()
+
+    def add(self, ordinal, year, month, category, amount, count=1, low=None, high=None):
+        if low is None:
+            low = high = amount
+        self.load_periods(period_keys(ordinal, year, month))
+        for key in period_keys(ordinal, year, month):
+            add_to_cell(self.totals, key, amount, count, low, high)
+            categories = self.category_totals.get(key)
+            if categories is None:
+                categories = self.category_totals[key] = {}
+            add_to_cell(categories, category, amount, count, low, high)
+
+    def add_many(self, dates, categories, amounts):
+        self.add_cells(collect_cells(dates, categories, amounts))
+
+    def add_cells(self, cells):
+        for (date, category), (amount, count, low, high) in cells.items():
+            self.add(date.toordinal(), date.year, date.month, category, amount, count, low, high)
+
+    def cells(self):
+        # Every cell of the cube keyed by (period, category), with category
+        # None for the period's total; the form storage.write_cube saves.
+        self.load_periods()
+        cells = {}
+        for key, categories in self.category_totals.items():
+            cells[(key, None)] = self.totals[key]
+            for category, cell in categories.items():
+                cells[(key, category)] = cell
+        return cells
+
+    def load_cells(self, cells):
+        # Replace the cube with cells from cells(), without rolling anything
+        # up again. A storage.SavedCube is kept and read a period at a time.
+        self.totals, self.category_totals = {}, {}
+        self.saved, self.loaded_periods = None, set()
+        if hasattr(cells, 'period'):
+            self.saved = cells
+            return
+        for (key, category), cell in cells.items():
+            if category is None:
+                self.totals[key] = cell
+            else:
+                categories = self.category_totals.get(key)
+                if categories is None:
+                    categories = self.category_totals[key] = {}
+                categories[category] = cell
+
+    def load_periods(self, keys=None):
+        # Copy the cells of the periods keys (every period if None) out of
+        # the saved cube, if there is one. Methods that use a period, or the
+        # dicts as a whole, call this first.
+        saved = self.saved
+        if saved is None:
+            return
+        loaded = self.loaded_periods
+        if keys is not None:
+            for key in keys:
+                if key not in loaded:
+                    loaded.add(key)
+                    cells = saved.period(key)
+                    if cells is not None:
+                        self.totals[key], self.category_totals[key] = cells
+            return
+        self.saved, self.loaded_periods = None, set()
+        for (key, category), cell in saved.items():
+            if key in loaded:
+                continue
+            if category is None:
+                self.totals[key] = cell
+            else:
+                categories = self.category_totals.get(key)
+                if categories is None:
+                    categories = self.category_totals[key] = {}
+                categories[category] = cell
+
+    def remove(self, ordinal, year, month, category, amount):
+        # Returns True when amount was an extreme of a remaining cell, in
+        # which case refresh_extremes must follow.
+        self.load_periods(period_keys(ordinal, year, month))
+        stale = False
+        for key in period_keys(ordinal, year, month):
+            categories = self.category_totals[key]
+            for table, name in ((self.totals, key), (categories, category)):
+                cell = table[name]
+                cell[0] -= amount
+                cell[1] -= 1
+                if cell[1] == 0:
+                    del table[name]
+                elif amount <= cell[2] or amount >= cell[3]:
+                    stale = True
+            if not categories:
+                del self.category_totals[key]
+        return stale
+
+    def refresh_extremes(self, ordinal, year, month, category, amounts):
+        # amounts: everything left in the (day, category) cell. Each coarser
+        # category cell is derived from the level below it, and each period
+        # total from its category cells.
+        self.load_periods()
+        day_key, month_key, year_key, all_key = period_keys(ordinal, year, month)
+        cube = self.category_totals
+        cell = cube.get(day_key, {}).get(category)
+        if cell is not None:
+            cell[2], cell[3] = min(amounts), max(amounts)
+        first, last = month_bounds(year, month)
+        for key, children in ((month_key, [('day', day) for day in range(first, last + 1)]),
+                              (year_key, [('month', year, month) for month in range(1, 13)]),
+                              (all_key, [key for key in self.totals if key[0] == 'year'])):
+            cell = cube.get(key, {}).get(category)
+            if cell is not None:
+                set_extremes(cell, [cube[child][category] for child in children if category in cube.get(child, ())])
+        for key in (day_key, month_key, year_key, all_key):
+            cell = self.totals.get(key)
+            if cell is not None:
+                set_extremes(cell, cube[key].values())
+
+    def total(self, key):
+        self.load_periods((key,))
+        cell = self.totals.get(key)
+        return cell[0] if cell else 0
+
+    def stats(self, key, category=None):
+        # {"total", "count", "min", "max"} of a period, or of one category in
+        # it; None when there is nothing recorded.
+        self.load_periods((key,))
+        cell = self.totals.get(key) if category is None else self.category_totals.get(key, {}).get(category)
+        return cell_stats(cell) if cell else None
+
+    def by_category(self, key):
+        self.load_periods((key,))
+        return {category: cell[0] for category, cell in self.category_totals.get(key, {}).items()}
+
+    def by_month(self, year):
+        self.load_periods([('month', year, month) for month in range(1, 13)])
+        return {MONTH_NAMES[month]: self.totals[('month', year, month)][0] for month in range(1, 13) if ('month', year, month) in self.totals}
+
+    def range_cells(self, start=None, end=None):
+        # [total, count, min, max] per category over the days start..end
+        # (ordinals, inclusive; None for open ends). The range is covered by
+        # whole years, then whole months, then single days, so the cost
+        # follows the number of cells read rather than the rows behind them.
+        self.load_periods()
+        years = sorted(key[1] for key in self.totals if key[0] == 'year')
+        if not years:
+            return {}
+        start = max(start if start is not None else 0, year_bounds(years[0])[0])
+        end = min(end if end is not None else math.inf, year_bounds(years[-1])[1])
+        cells = {}
+        ordinal = start
+        while ordinal <= end:
+            day = datetime.date.fromordinal(ordinal)
+            year_end = year_bounds(day.year)[1]
+            month_end = month_bounds(day.year, day.month)[1]
+            if (day.month, day.day) == (1, 1) and year_end <= end:
+                key, ordinal = ('year', day.year), year_end + 1
+            elif day.day == 1 and month_end <= end:
+                key, ordinal = ('month', day.year, day.month), month_end + 1
+            else:
+                key, ordinal = ('day', ordinal), ordinal + 1
+            for category, cell in self.category_totals.get(key, {}).items():
+                merge_cell(cells, category, cell)
+        return cells
+
+    def diff(self, other):
+        self.load_periods()
+        other.load_periods()
+        mismatches = []
+        for mine, theirs in ((self.totals, other.totals), (self.category_totals, other.category_totals)):
+            for key in mine.keys() | theirs.keys():
+                a, b = mine.get(key), theirs.get(key)
+                if isinstance(a, dict) or isinstance(b, dict):
+                    a, b = a or {}, b or {}
+                    for category in a.keys() | b.keys():
+                        if not cells_match(a.get(category), b.get(category)):
+                            mismatches.append((key, category, a.get(category), b.get(category)))
+                elif not cells_match(a, b):
+                    mismatches.append((key, None, a, b))
+        return mismatches
+
+
+def add_to_cell(table, key, amount, count, low, high):
+    cell = table.get(key)
+    if cell is None:
+        table[key] = [amount, count, low, high]
+        return
+    cell[0] += amount
+    cell[1] += count
+    if cell[1] == 0:
+        del table[key]
+        return
+    if low < cell[2]:
+        cell[2] = low
+    if high > cell[3]:
+        cell[3] = high
+
+
+def set_extremes(cell, children):
+    children = list(children)
+    cell[2] = min(child[2] for child in children)
+    cell[3] = max(child[3] for child in children)
+
+
+def cell_stats(cell):
+    return {"total": cell[0], "count": cell[1], "min": cell[2], "max": cell[3]}
+
+
+def collect_cells(dates, categories, amounts, cells=None):
+    # Bulk adds sum rows into (date, category) cells first, so each cell is
+    # folded into the period tables once instead of once per row.
+    if cells is None:
+        cells = {}
+    for key, amount in zip(zip(dates, categories), amounts):
+        cell = cells.get(key)
+        if cell is None:
+            cells[key] = [amount, 1, amount, amount]
+        else:
+            cell[0] += amount
+            cell[1] += 1
+            if amount < cell[2]:
+                cell[2] = amount
+            elif amount > cell[3]:
+                cell[3] = amount
+    return cells
+
+
+def cells_match(a, b):
+    if a is None or b is None:
+        return a is b
+    return a[1] == b[1] and all(math.isclose(x, y, abs_tol=1e-6) for x, y in ((a[0], b[0]), (a[2], b[2]), (a[3], b[3])))
+
+
+def merge_cells(cells, other):
+    for key, cell in other.items():
+        merge_cell(cells, key, cell)
+    return cells
+
+
+def ledger_cells(filename, report=None, start=0, end=None):
+    cells = {}
+    for serials, dates, parsed, categories, amounts, comments in iter_ledger_columns(filename, report, start=start, end=end):
+        collect_cells(parsed, categories, amounts, cells)
+    return cells
+
+
+def saved_cube(filename):
+    # The ledger's saved rollup cube, if it is still current.
+    return read_cube(filename + '.cube', ledger_signature(filename))
+
+
+def saved_cells(filename):
+    # The (date, category) cells of the saved cube, in collect_cells form.
+    cube = saved_cube(filename)
+    if cube is None:
+        return None
+    fromordinal = datetime.date.fromordinal
+    return {(fromordinal(key[1]), category): cell for (key, category), cell in cube.items() if key[0] == 'day' and category is not None}
+
+
+def aggregate_ledger(filename, report=None):
+    # Daily, monthly, yearly and per-category totals of a ledger file, read
+    # from its saved cube or computed while streaming the file, so no records
+    # are kept in memory.
+    if is_sharded(filename):
+        return aggregate_ledgers(filename, workers=1, report=report)
+    cube = saved_cube(filename)
+    aggregates = ExpenseAggregates()
+    if cube is not None:
+        aggregates.load_cells(cube)
+    else:
+        aggregates.add_cells(ledger_cells(filename, report))
+    return aggregates
+
+
+def aggregate_ledger_range(task):
+    filename, start, end = task
+    report = LoadReport()
+    return ledger_cells(filename, report, start, end), report
+
+
+def aggregate_ledgers(filenames, workers=None, chunk_size=None, report=None):
+    # Same totals as aggregate_ledger over many ledgers, or one large one,
+    # computed in parallel. The input is cut into byte ranges, each worker
+    # process sums its ranges into (date, category) cells, and the cells are
+    # merged here before being rolled up into days, months and years. Files
+    # with a current saved cube are not read at all.
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    # A sharded ledger is its shard files, each with its own cube.
+    filenames = [name for filename in filenames for name in (shard_files(filename) if is_sharded(filename) else [filename])]
+    workers = workers or os.cpu_count() or 1
+    cells, sizes = {}, {}
+    for filename in filenames:
+        cube = saved_cells(filename)
+        if cube is not None:
+            merge_cells(cells, cube)
+        else:
+            sizes[filename] = os.path.getsize(filename)
+    if chunk_size is None:
+        # A few ranges per worker keeps them busy when files differ in size.
+        chunk_size = max(1 << 20, sum(sizes.values()) // (workers * 4) + 1)
+    tasks = [(filename, start, min(start + chunk_size, size)) for filename, size in sizes.items() for start in range(0, size, chunk_size)]
+
+    if workers == 1 or len(tasks) <= 1:
+        results = map(aggregate_ledger_range, tasks)
+        for partial, partial_report in results:
+            merge_cells(cells, partial)
+            if report is not None:
+                report.merge(partial_report)
+    else:
+        # Imported here: multiprocessing is slow to import and most commands
+        # never need it.
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for partial, partial_report in pool.map(aggregate_ledger_range, tasks):
+                merge_cells(cells, partial)
+                if report is not None:
+                    report.merge(partial_report)
+    aggregates = ExpenseAggregates()
+    aggregates.add_cells(cells)
+    return aggregates
+
+
+def deep_getsizeof(obj, seen=None):
+    # Bytes held by obj and everything reachable from it through containers
+    # and instance attributes, counting shared objects once.
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            stack.append(vars(obj))
+    return size
+
+
+class ExpenseBatch:
+    # The context manager ExpenseManager.batch returns; a nested block joins
+    # the outermost one. Written out rather than with contextlib, which
+    # every start of the program would otherwise import for it alone.
+    def __init__(self, manager):
+        self.manager = manager
+        self.outermost = False
+
+    def __enter__(self):
+        if self.manager.batched is None:
+            self.manager.batched = []
+            self.outermost = True
+
+    def __exit__(self, *exc_info):
+        if self.outermost:
+            batch, self.manager.batched = self.manager.batched, None
+            if batch:
+                self.manager.persist_many(batch)
+
+
+class QueryCache:
+    # LRU cache of query results. Keys are (method, start, end, categories)
+    # with start..end the ordinals of the days the result covers (None for
+    # an open end), so a mutation evicts only the entries covering a day it
+    # touched. Holds at most max_entries results and max_records records
+    # between them; a larger result isn't kept at all.
+    def __init__(self, max_entries=256, max_records=100000):
+        self.max_entries = max_entries
+        self.max_records = max_records
+        # key -> (records, result), least recently used first
+        self.entries = OrderedDict()
+        self.records = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, result, records):
+        if records > self.max_records:
+            return
+        self.entries[key] = (records, result)
+        self.records += records
+        while len(self.entries) > self.max_entries or self.records > self.max_records:
+            self.discard(next(iter(self.entries)))
+            self.evictions += 1
+
+    def discard(self, key):
+        self.records -= self.entries.pop(key)[0]
+
+    def invalidate(self, ordinals):
+        # Evict the entries covering any of the days in ordinals (sorted).
+        if not self.entries:
+            return
+        stale = []
+        for key in self.entries:
+            start, end = key[1], key[2]
+            i = bisect_left(ordinals, start) if start is not None else 0
+            if i < len(ordinals) and (end is None or ordinals[i] <= end):
+                stale.append(key)
+        for key in stale:
+            self.discard(key)
+        self.invalidations += len(stale)
+
+    def clear(self):
+        self.invalidations += len(self.entries)
+        self.entries.clear()
+        self.records = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"entries": len(self.entries), "records": self.records, "max_entries": self.max_entries, "max_records": self.max_records,
+                "hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions, "invalidations": self.invalidations}
+
+
+class ExpenseManager:
+    def __init__(self, journal=False, fsync_every=None, compact_every=10000, verify=False, stable_ids=False, instrument=False, lazy=False,
+                 cache_size=None, cache_records=100000):
+        self.columns = ExpenseColumns()
+        self.expenses = ExpenseRecords(self.columns)
+        self.aggregates = ExpenseAggregates()
+        self.index = ExpenseIndex()
+        # serial number -> row in self.expenses
+        self.slots = SerialIndex(self.columns)
+        # With stable IDs serial numbers are never renumbered or reused, and a
+        # deleted row is left as a tombstone (None in self.expenses) until
+        # enough of them pile up to be worth compacting away (see compact_rows).
+        self.stable_ids = stable_ids
+        self.tombstones = 0
+        # Verification mode cross-checks the running totals against a full
+        # recompute after every mutation. Slow; meant for debugging.
+        self.verify = verify
         self.categories = set()
         self.currency_symbol = '₹'
         self.daily_limit = None
@@ -11,55 +909,573 @@ class ExpenseManager:
         self.yearly_limit = None
         self.serial_counter = 1
         self.filename = None
+        # Journaled mode appends each mutation to <filename>.journal instead of
+        # rewriting a text or snapshot ledger; the log is folded back into the
+        # ledger once it holds compact_every records (None disables
+        # auto-compaction). SQLite ledgers apply each mutation in place.
+        self.journal_enabled = journal
+        self.fsync_every = fsync_every
+        self.compact_every = compact_every
+        self.storage = None
+        self.load_report = None
+        # Lazy mode answers totals from a current saved cube and leaves the
+        # records unparsed until something needs them (see ensure_loaded).
+        self.lazy = lazy
+        self.pending_cube = None
+        # Mutations held back by batch(), as (op, expense) pairs.
+        self.batched = None
+        # Days (ordinals) changed in memory since the ledger's storage last
+        # held every record, or None for all of them. A sharded ledger
+        # rewrites just the months they fall in (see write_ledger).
+        self.changed_days = set()
+        # With cache_size, the record lists behind query and the view_*
+        # methods, and rollup results, are kept in an LRU cache of that many
+        # entries (see QueryCache). Totals come straight from the cube.
+        self.cache = QueryCache(cache_size, cache_records) if cache_size else None
+        # Opt-in timing and profiling (see instrument.py); while it is off
+        # the methods run unwrapped.
+        self.instrumentation = None
+        if instrument:
+            self.enable_instrumentation()
+
+    def enable_instrumentation(self, profile=False, profile_dir=None):
+        # Start recording per-method calls, latencies, rows scanned and bytes
+        # written. With profile, each outermost call is also run under
+        # cProfile and tracemalloc and reported (saved to profile_dir if given).
+        if self.instrumentation is None:
+            import instrument
+            self.instrumentation = instrument.Instrumentation()
+            self.instrumentation.attach(self)
+        self.instrumentation.profile = profile
+        self.instrumentation.profile_dir = profile_dir
+        return self.instrumentation
+
+    def disable_instrumentation(self):
+        if self.instrumentation is not None:
+            self.instrumentation.detach(self)
+            self.instrumentation = None
+
+    def stats(self):
+        # What instrumentation has recorded so far ({} while it is off).
+        return self.instrumentation.stats() if self.instrumentation else {}
+
+    def cache_stats(self):
+        # Hit and miss counters and current size of the query cache ({} with
+        # no cache).
+        return self.cache.stats() if self.cache else {}
+
+    def dump_stats(self, filename, format=None):
+        # Write stats() to filename as JSON, or as Prometheus text for .prom
+        # and .txt files (or format='prometheus').
+        if self.instrumentation is None:
+            raise ValueError("Instrumentation is not enabled")
+        self.instrumentation.dump(filename, format)
+
+    def resolve_date(self, date):
+        if not date:
+            date = datetime.date.today().strftime(DATE_FORMAT)
+        return date, self.columns.parse_date(date).toordinal()
+
+    def resolve_year(self, year):
+        if not year:
+            return datetime.date.today().year
+        return int(year)
+
+    def resolve_month(self, month):
+        if not month:
+            return datetime.date.today().month
+        if isinstance(month, int) or month.isdigit():
+            return int(month)
+        name = month.strip().capitalize()
+        if name not in MONTH_NAMES[1:]:
+            raise ValueError(f"Unknown month {month!r}")
+        return MONTH_NAMES.index(name)
+
+    def append_expense(self, expense):
+        self.columns.append(expense['serial_number'], expense['date'], expense['category'], expense['amount'], expense.get('comment'))
+        row = len(self.columns) - 1
+        key = self.columns.key(row)
+        self.aggregates.add(*key)
+        self.index.insert(row, key[0], key[3])
+        self.slots[expense['serial_number']] = row
+        self.categories.add(key[3])
+        self.mark_changed(key[0])
+        if self.cache is not None:
+            self.cache.invalidate([key[0]])
+
+    def extend_rows(self, serials, dates, parsed, categories, amounts, comments, cells=None, aggregate=True):
+        # Bulk version of append_expense over parallel columns as produced by
+        # iter_ledger_columns: one pass per column instead of a round of
+        # bookkeeping per record. Callers feeding several batches can pass a
+        # cells dict and fold it into the aggregates once they are done, or
+        # skip the aggregates when they already have them (a saved cube).
+        if not serials:
+            return
+        start = len(self.expenses)
+        categories, amounts = self.columns.extend(serials, dates, parsed, categories, amounts, comments)
+        if aggregate and cells is None:
+            self.aggregates.add_many(parsed, categories, amounts)
+        elif aggregate:
+            collect_cells(parsed, categories, amounts, cells)
+        self.index.extend(start, self.columns.ordinals[start:], categories)
+        self.slots.extend(start)
+        self.categories.update(self.columns.category_names)
+        if self.cache is not None and self.cache.entries:
+            self.cache.invalidate(sorted(set(self.columns.ordinals[start:])))
+
+    def update_expense_at(self, row, date, category, amount, comment):
+        # Replace the fields of a row; returns the row now holding the record.
+        ordinal, year, month, old_category, old_amount = self.columns.key(row)
+        category = self.columns.intern(category)
+        self.categories.add(category)
+        if self.stable_ids and (category != old_category or ordinal != self.columns.parse_date(date).toordinal()):
+            # Moving a row within the indexes is an array insert; retiring
+            # the old row and appending the record as a new one is O(1).
+            serial_number = self.columns.serials[row]
+            self.remove_expense_at(row)
+            self.append_expense({"serial_number": serial_number, "date": date, "category": category, "amount": amount, "comment": comment})
+            return self.slots[serial_number]
+        self.remove_aggregates(row)
+        self.index.remove(row, ordinal, old_category)
+        self.columns.update(row, date, category, amount, comment)
+        key = self.columns.key(row)
+        self.aggregates.add(*key)
+        self.index.insert(row, key[0], category)
+        self.mark_changed(ordinal, key[0])
+        if self.cache is not None:
+            self.cache.invalidate(sorted({ordinal, key[0]}))
+        return row
+
+    def mark_changed(self, *ordinals):
+        if self.changed_days is not None:
+            self.changed_days.update(ordinals)
+
+    def rebuild_aggregates(self):
+        # Recompute the cube from the live rows.
+        columns = self.columns
+        rows = [row for row in range(len(columns)) if columns.live[row]]
+        fromordinal = datetime.date.fromordinal
+        self.aggregates = ExpenseAggregates()
+        self.aggregates.add_many([fromordinal(columns.ordinals[row]) for row in rows],
+                                 [columns.category_names[columns.category_codes[row]] for row in rows],
+                                 [columns.cents[row] / 100 for row in rows])
+
+    def remove_aggregates(self, row):
+        # Take a row out of the cube; if it held a min or max, rescan the
+        # rest of its (day, category) cell through the category index.
+        ordinal, year, month, category, amount = self.columns.key(row)
+        if self.aggregates.remove(ordinal, year, month, category, amount):
+            live, cents = self.columns.live, self.columns.cents
+            rows = self.index.categories[category].range(ordinal, ordinal)
+            amounts = [cents[other] / 100 for other in rows if other != row and live[other]]
+            self.aggregates.refresh_extremes(ordinal, year, month, category, amounts)
+
+    def verify_aggregates(self):
+        self.ensure_loaded()
+        expected = ExpenseAggregates()
+        for row in range(len(self.columns)):
+            if self.columns.live[row]:
+                expected.add(*self.columns.key(row))
+        mismatches = self.aggregates.diff(expected)
+        for key, category, actual, wanted in mismatches:
+            print(f"Aggregate mismatch for {key} {category or ''}: have {actual}, expected {wanted}")
+        return not mismatches
+
+    def resolve_ordinal(self, date):
+        if date is None:
+            return None
+        if isinstance(date, datetime.date):
+            return date.toordinal()
+        return self.columns.parse_date(date).toordinal()
+
+    def query(self, start=None, end=None, categories=None):
+        # Records dated start..end inclusive (either end may be open), in date
+        # order, optionally limited to the given categories.
+        if isinstance(categories, str):
+            categories = [categories]
+        records = self.records_between(self.resolve_ordinal(start), self.resolve_ordinal(end), categories)
+        # Cached lists are shared; callers get their own copies.
+        return records if self.cache is None else [dict(record) for record in records]
+
+    def rollup(self, start=None, end=None):
+        # {"total", "count", "min", "max"} per category over the dates start..
+        # end (inclusive, either end may be open), read from the rollup cube.
+        start, end = self.resolve_ordinal(start), self.resolve_ordinal(end)
+        stats = self.cached('rollup', start, end, None, lambda: {category: cell_stats(cell) for category, cell in self.aggregates.range_cells(start, end).items()})
+        return stats if self.cache is None else {category: dict(cell) for category, cell in stats.items()}
+
+    def cached(self, method, start, end, categories, compute, records=len):
+        # compute() through the query cache when there is one. start..end
+        # are the days the result depends on; records(result) its size.
+        if self.cache is None:
+            return compute()
+        key = (method, start, end, categories)
+        result = self.cache.get(key)
+        if result is None:
+            result = compute()
+            self.cache.put(key, result, records(result))
+        return result
+
+    def records_between(self, start, end, categories=None):
+        # Dict copies of the live records dated start..end (ordinals), in
+        # date order; shared with the cache, so not to be modified.
+        if categories is not None:
+            categories = tuple(sorted(set(categories)))
+        return self.cached('records', start, end, categories, lambda: self.expenses.take(self.rows_between(start, end, categories)))
+
+    def records_by_category(self, start, end):
+        # records_between grouped by category.
+        return self.cached('by_category', start, end, None, lambda: self.group_by_category(self.records_between(start, end)),
+                           records=lambda groups: sum(map(len, groups.values())))
+
+    def analytics(self):
+        # Rolling sums, moving averages and burn rates over the current
+        # totals (see analytics.SpendingSeries); a snapshot, not kept up to
+        # date by later changes.
+        import analytics
+        return analytics.SpendingSeries(self.aggregates)
+
+    def burn_rate(self, date=None):
+        # Month- and year-to-date spending on date (default today) and where
+        # it is heading, against the monthly and yearly limits.
+        date, ordinal = self.resolve_date(date)
+        return self.analytics().burn_rate(ordinal, self.monthly_limit, self.yearly_limit)
+
+    def period_totals(self, date=None, year=None, month=None):
+        # The total of one day (date), month (month, and year) or year, split
+        # by category, and for a year also by month.
+        if date:
+            date, ordinal = self.resolve_date(date)
+            key, result = ('day', ordinal), {"date": date}
+        elif month:
+            year, month = self.resolve_year(year), self.resolve_month(month)
+            key, result = ('month', year, month), {"year": year, "month": month}
+        else:
+            year = self.resolve_year(year)
+            key, result = ('year', year), {"year": year}
+        result.update(total=self.aggregates.total(key), by_category=self.aggregates.by_category(key))
+        if key[0] == 'year':
+            result['by_month'] = self.aggregates.by_month(year)
+        return result
+
+    def rows_between(self, start, end, categories=None):
+        self.ensure_loaded(start, end)
+        rows = self.index.rows_between(start, end, categories)
+        if self.tombstones:
+            live = self.columns.live
+            rows = [row for row in rows if live[row]]
+        return rows
 
     def add_expense(self, category, amount, date=None, comment=None):
         if not date:
-            date = datetime.date.today().strftime('%d-%m-%Y')
+            date = datetime.date.today().strftime(DATE_FORMAT)
+        parsed = self.columns.parse_date(date)
+        if self.stable_ids:
+            # The next serial number was loaded with the ledger, so a lazily
+            # loaded one needs only the day's rows (its shard, if sharded).
+            self.ensure_loaded(parsed.toordinal(), parsed.toordinal())
+        else:
+            self.ensure_loaded()
 
-        serial_number = len(self.expenses) + 1
+        if self.stable_ids:
+            serial_number = self.serial_counter
+        else:
+            serial_number = len(self.expenses) + 1
+        self.serial_counter = max(self.serial_counter, serial_number + 1)
 
-        self.expenses.append({"serial_number": serial_number, "date": date, "category": category, "amount": amount, "comment": comment})
-        self.categories.add(category)
+        self.append_expense({"serial_number": serial_number, "date": date, "category": category, "amount": float(amount), "comment": comment})
 
         if self.daily_limit is not None:
-            today_expenses = sum(expense['amount'] for expense in self.expenses if expense['date'] == date)
-            if today_expenses + amount > self.daily_limit:
+            daily_expense = self.aggregates.total(('day', parsed.toordinal()))
+            if daily_expense > self.daily_limit:
                 print("Warning: You have exceeded your daily spending limit!")
 
         if self.monthly_limit is not None:
-            current_month = datetime.datetime.strptime(date, '%d-%m-%Y').strftime('%B')
-            monthly_expense = sum(expense['amount'] for expense in self.expenses if datetime.datetime.strptime(expense['date'], '%d-%m-%Y').strftime('%B') == current_month)
+            monthly_expense = self.aggregates.total(('month', parsed.year, parsed.month))
             if monthly_expense > self.monthly_limit:
                 print("Warning: You have exceeded your monthly spending limit!")
 
         if self.yearly_limit is not None:
-            current_year = datetime.datetime.strptime(date, '%d-%m-%Y').year
-            yearly_expense = sum(expense['amount'] for expense in self.expenses if datetime.datetime.strptime(expense['date'], '%d-%m-%Y').year == current_year)
+            yearly_expense = self.aggregates.total(('year', parsed.year))
             if yearly_expense > self.yearly_limit:
                 print("Warning: You have exceeded your yearly spending limit!")
 
-        self.save_expenses(self.filename)
+        if self.verify:
+            self.verify_aggregates()
+        self.persist('A', self.expenses[-1])
+
+    def add_expenses_bulk(self, records, report=None):
+        # Add many records in one go. Records are dicts with date, category,
+        # amount and optional comment keys (as yielded by iter_csv_records) or
+        # (category, amount, date, comment) tuples in add_expense order.
+        # Invalid records are skipped and noted in report. Serials, indexes
+        # and totals are updated once for the whole batch, limits are checked
+        # once per affected day, month and year, and the batch is persisted
+        # with a single write. Returns the number of records added.
+        self.ensure_loaded()
+        if report is None:
+            report = LoadReport()
+        today = datetime.date.today().strftime(DATE_FORMAT)
+        # Dates and categories repeat heavily, so each distinct value is
+        # checked once per batch.
+        known_dates = self.columns.date_cache
+        known_categories = set(self.columns.category_lookup)
+        isfinite = math.isfinite
+        dates, parsed, categories, amounts, comments = [], [], [], [], []
+        for number, record in enumerate(records, start=1):
+            if isinstance(record, dict):
+                date, category, amount, comment = record.get('date'), record.get('category'), record.get('amount'), record.get('comment')
+            else:
+                category, amount, date, comment = (tuple(record) + (None, None))[:4]
+            date = date or today
+            try:
+                day = known_dates.get(date) or self.columns.parse_date(date)
+            except (ValueError, TypeError, AttributeError):
+                report.record(number, 'bad date', record)
+                continue
+            try:
+                amount = float(amount)
+            except (ValueError, TypeError):
+                amount = math.nan
+            if not isfinite(amount):
+                report.record(number, 'bad amount', record)
+                continue
+            if category not in known_categories:
+                if not isinstance(category, str) or not category.strip() or '|' in category or '\n' in category:
+                    report.record(number, 'bad category', record)
+                    continue
+                known_categories.add(category)
+            if comment is not None and (not isinstance(comment, str) or '|' in comment or '\n' in comment):
+                report.record(number, 'bad comment', record)
+                continue
+            dates.append(date)
+            parsed.append(day)
+            categories.append(category)
+            amounts.append(amount)
+            comments.append(comment)
+        if not amounts:
+            return 0
+
+        start = len(self.expenses)
+        first = self.serial_counter if self.stable_ids else start + 1
+        self.serial_counter = max(self.serial_counter, first + len(amounts))
+        self.extend_rows(range(first, first + len(amounts)), dates, parsed, categories, amounts, comments)
+        self.index.merge()
+        report.loaded += len(amounts)
+
+        days = set(parsed)
+        self.mark_changed(*(day.toordinal() for day in days))
+        for limit, name, unit, keys in ((self.daily_limit, 'daily', 'days', {('day', day.toordinal()) for day in days}),
+                                        (self.monthly_limit, 'monthly', 'months', {('month', day.year, day.month) for day in days}),
+                                        (self.yearly_limit, 'yearly', 'years', {('year', day.year) for day in days})):
+            if limit is not None:
+                exceeded = sum(1 for key in keys if self.aggregates.total(key) > limit)
+                if exceeded:
+                    print(f"Warning: You have exceeded your {name} spending limit! ({exceeded} of {len(keys)} {unit} in this import)")
+
+        if self.verify:
+            self.verify_aggregates()
+        if self.batched is not None:
+            self.batched.extend(('A', expense) for expense in self.expenses[start:])
+            return len(amounts)
+        storage = self.ledger_storage()
+        if not storage.record_many('A', self.expenses[start:]):
+            self.write_ledger()
+        elif not self.journal_enabled:
+            # The rows were appended to the ledger file itself.
+            self.changed_days = set()
+            self.save_cube(storage)
+        return len(amounts)
+
+    def import_expenses(self, filename):
+        # CSV import through add_expenses_bulk. Skipped records are reported
+        # by their position after the header row.
+        report = LoadReport()
+        added = self.add_expenses_bulk(iter_csv_records(filename), report)
+        print(report.summary())
+        return added
 
     def delete_expense(self, serial_number):
-        for idx, expense in enumerate(self.expenses):
-            if expense['serial_number'] == serial_number:
-                del self.expenses[idx]
-                print("Expense deleted successfully.")
-                for idx, expense in enumerate(self.expenses, start=1):
-                    expense['serial_number'] = idx
-                self.save_expenses(self.filename)
-                return
-        print("Expense not found.")
+        self.ensure_loaded()
+        row = self.slots.get(serial_number)
+        if row is None:
+            print("Expense not found.")
+            return
+        # Copied first: after the delete the row may hold another record.
+        expense = dict(self.expenses[row])
+        self.remove_expense_at(row)
+        print("Expense deleted successfully.")
+        if self.verify:
+            self.verify_aggregates()
+        self.persist('D', expense)
+
+    def remove_expense_at(self, idx):
+        ordinal, year, month, category, amount = self.columns.key(idx)
+        self.remove_aggregates(idx)
+        del self.slots[self.columns.serials[idx]]
+        if self.stable_ids:
+            self.mark_changed(ordinal)
+            if self.cache is not None:
+                self.cache.invalidate([ordinal])
+        else:
+            # Every later record is renumbered, whatever its date.
+            self.changed_days = None
+            if self.cache is not None:
+                self.cache.clear()
+        if self.stable_ids:
+            self.columns.live[idx] = 0
+            self.tombstones += 1
+            if self.tombstones > len(self.expenses) // 2:
+                self.compact_rows()
+            return
+        self.index.remove(idx, ordinal, category)
+        self.index.shift(idx)
+        self.columns.delete(idx)
+        # Serial numbers become 1..n again, in the order of the old numbers.
+        # That is the row order unless rows were read back in date order
+        # (snapshots, sharded ledgers), where journal replay must still
+        # renumber exactly as the original deletes did. Every later serial
+        # and row changes, so without stable IDs a delete is O(n).
+        serials = self.columns.serials
+        if self.slots.rows is None:
+            self.columns.serials = array('q', range(1, len(serials) + 1))
+        else:
+            numbers = array('q', bytes(8 * len(serials)))
+            for number, row in enumerate(sorted(range(len(serials)), key=serials.__getitem__), start=1):
+                numbers[row] = number
+            self.columns.serials = numbers
+        self.slots.reset()
+
+    def memory_usage(self):
+        # Measured size of the in-memory ledger by structure, and per live
+        # record. Walks every object, so it takes a moment on large ledgers.
+        self.ensure_loaded()
+        seen = set()
+        usage = {name: deep_getsizeof(structure, seen) for name, structure in
+                 (('records', self.columns), ('indexes', self.index), ('slots', self.slots), ('aggregates', self.aggregates))}
+        records = len(self.columns) - self.tombstones
+        usage['total'] = sum(usage.values())
+        usage['records_count'] = records
+        usage['bytes_per_record'] = usage['total'] / records if records else 0.0
+        return usage
+
+    def clear_rows(self):
+        self.columns.clear()
+        self.aggregates = ExpenseAggregates()
+        self.index = ExpenseIndex()
+        self.slots.reset()
+        self.tombstones = 0
+        if self.cache is not None:
+            self.cache.clear()
+
+    def compact_rows(self):
+        # Drop tombstones and rebuild the row-addressed structures. Runs once
+        # deleted rows outnumber live ones, so its cost is amortised over the
+        # deletes that created them.
+        columns = self.columns
+        rows = [row for row in range(len(columns)) if columns.live[row]]
+        serials = [columns.serials[row] for row in rows]
+        dates = [columns.date_names[columns.date_codes[row]] for row in rows]
+        categories = [columns.category_names[columns.category_codes[row]] for row in rows]
+        amounts = [columns.cents[row] / 100 for row in rows]
+        comments = [columns.comments[row] for row in rows]
+        self.clear_rows()
+        self.extend_rows(serials, dates, [self.columns.parse_date(date) for date in dates], categories, amounts, comments)
+        self.index.merge()
+
+    def ledger_storage(self):
+        if self.storage is None:
+            self.storage = open_storage(self.filename, journal=self.journal_enabled, fsync_every=self.fsync_every, compact_every=self.compact_every)
+        return self.storage
+
+    def persist(self, op, expense):
+        if self.batched is not None:
+            self.batched.append((op, dict(expense)))
+            return
+        storage = self.ledger_storage()
+        if not storage.record(op, expense, renumber=op == 'D' and not self.stable_ids):
+            self.write_ledger()
+
+    def persist_many(self, batch):
+        # Persist (op, expense) mutations, already applied in memory, in one
+        # go: each run of the same op is a single record_many, and the first
+        # one the backend can't take that way is replaced by a full rewrite,
+        # which covers the rest of the batch too.
+        storage = self.ledger_storage()
+        for op, group in itertools.groupby(batch, key=lambda item: item[0]):
+            expenses = [expense for op, expense in group]
+            if (op == 'D' and not self.stable_ids) or not storage.record_many(op, expenses):
+                self.write_ledger(storage)
+                break
+        else:
+            if batch and not self.journal_enabled:
+                # Only appends, made to the ledger file itself.
+                self.changed_days = set()
+                self.save_cube(storage)
+        storage.flush()
+
+    def batch(self):
+        # Apply mutations in memory as usual, but persist them all together
+        # when the block ends (see persist_many).
+        return ExpenseBatch(self)
+
+    def save_cube(self, storage):
+        # Save the cube next to the ledger, once storage holds every row.
+        # Each period lists its categories in the order reading the rows back
+        # would (first appearance in storage.cube_order), which after edits
+        # and deletes isn't the order in memory, so the levels are rolled up
+        # again from the day cells in that order.
+        if storage.cube_order is None:
+            return
+        columns = self.columns
+        if hasattr(storage, 'stale_cubes'):
+            # A sharded ledger only saves the cubes of the shards written
+            # since their last one, so only their months are rolled up.
+            rows = [row for month in storage.stale_cubes for row in self.rows_between(*month_bounds(month // 12, month % 12 + 1))]
+            keys = dict.fromkeys(zip([columns.ordinals[row] for row in rows], [columns.category_codes[row] for row in rows]))
+        else:
+            keys = dict.fromkeys(itertools.compress(zip(columns.ordinals, columns.category_codes), columns.live))
+            if storage.cube_order == 'date':
+                keys = sorted(keys, key=lambda key: key[0])
+        self.aggregates.load_periods({('day', ordinal) for ordinal, code in keys})
+        days, names, fromordinal = self.aggregates.category_totals, columns.category_names, datetime.date.fromordinal
+        ordered = ExpenseAggregates()
+        ordered.add_cells({(fromordinal(ordinal), names[code]): days[('day', ordinal)][names[code]] for ordinal, code in keys})
+        storage.save_cube(ordered.cells(), self.serial_counter)
+
+    def write_ledger(self, storage=None):
+        # Rewrite the whole ledger, and the rollup cube next to it. A sharded
+        # ledger rewrites only the months with changed days, reading just
+        # those if it was loaded lazily.
+        storage = storage or self.ledger_storage()
+        if storage is self.storage and self.changed_days is not None and hasattr(storage, 'write_changed'):
+            storage.write_changed(self.changed_days, lambda start, end: self.expenses.take(self.rows_between(start, end)))
+        else:
+            self.ensure_loaded()
+            storage.write_all(self.expenses)
+        if storage is self.storage:
+            self.changed_days = set()
+        self.save_cube(storage)
+        if self.batched and storage is self.storage:
+            # The rewrite already holds everything batch() was holding back.
+            self.batched.clear()
+
+    def compact(self):
+        self.write_ledger()
 
     def save_expenses(self, filename):
-        with open(filename, 'w') as f:
-            for expense in self.expenses:
-                f.write(f"{expense['serial_number']}|{expense['date']}|{expense['category']}|{expense['amount']}|{expense.get('comment', '')}\n")
+        if filename == self.filename:
+            self.write_ledger()
+            return
+        storage = open_storage(filename)
+        try:
+            self.write_ledger(storage)
+        finally:
+            storage.close()
 
     def view_expenses(self, date=None):
-        if not date:
-            date = datetime.date.today().strftime('%d-%m-%Y')
-        expenses_on_date = [expense for expense in self.expenses if expense['date'] == date]
+        date, ordinal = self.resolve_date(date)
+        expenses_on_date = self.records_between(ordinal, ordinal)
         if expenses_on_date:
             print(f"Expenses on {date}:")
             for expense in expenses_on_date:
@@ -67,23 +1483,20 @@ class ExpenseManager:
         else:
             print("No expenses recorded for this date.")
 
-    def view_monthly_expenses(self, year=None,month=None):
-        if not month:
-            month = datetime.date.today().strftime('%B')
-        if not year:
-            year = datetime.date.today().year           
-        expenses_on_month = [expense for expense in self.expenses if datetime.datetime.strptime(expense['date'], '%d-%m-%Y').strftime('%B') == month and datetime.datetime.strptime(expense['date'], '%d-%m-%Y').year == year]
+    def view_monthly_expenses(self, year=None, month=None):
+        year = self.resolve_year(year)
+        month = self.resolve_month(month)
+        expenses_on_month = self.records_between(*month_bounds(year, month))
         if expenses_on_month:
-            print(f"Expenses for {month}:")
+            print(f"Expenses for {MONTH_NAMES[month]}:")
             for expense in expenses_on_month:
                 print(f"Serial Number: {expense['serial_number']} | Category: {expense['category']} | Amount: {self.currency_symbol}{expense['amount']:.2f} | Comment: {expense.get('comment', '')}")
         else:
             print("No expenses recorded for this month.")
 
     def view_yearly_expenses(self, year=None):
-        if not year:
-            year = datetime.date.today().year
-        expenses_on_year = [expense for expense in self.expenses if datetime.datetime.strptime(expense['date'], '%d-%m-%Y').year == year]
+        year = self.resolve_year(year)
+        expenses_on_year = self.records_between(*year_bounds(year))
         if expenses_on_year:
             print(f"Expenses for {year}:")
             for expense in expenses_on_year:
@@ -92,26 +1505,18 @@ class ExpenseManager:
             print("No expenses recorded for this year.")
 
     def total_expenses(self, date=None):
-        if not date:
-            date = datetime.date.today().strftime('%d-%m-%Y')
-        total = sum(expense['amount'] for expense in self.expenses if expense['date'] == date)
+        date, ordinal = self.resolve_date(date)
+        total = self.aggregates.total(('day', ordinal))
         print(f"Total Expenses on {date}: {self.currency_symbol}{total:.2f}")
 
     def visualize_expenses_by_date(self, date=None):
-        if not date:
-            date = datetime.date.today().strftime('%d-%m-%Y')
-        expenses_on_date = [expense for expense in self.expenses if expense['date'] == date]
-        if expenses_on_date:
-            category_expenses = {}
-            for expense in expenses_on_date:
-                category = expense['category']
-                if category not in category_expenses:
-                    category_expenses[category] = 0
-                category_expenses[category] += expense['amount']
-
+        date, ordinal = self.resolve_date(date)
+        category_expenses = self.aggregates.by_category(('day', ordinal))
+        if category_expenses:
             labels = list(category_expenses.keys())
             values = list(category_expenses.values())
 
+            plt = pyplot()
             plt.figure(figsize=(10, 6))
             plt.pie(values, labels=labels, autopct='%1.1f%%', startangle=140)
             plt.axis('equal')
@@ -121,46 +1526,30 @@ class ExpenseManager:
             print("No expenses recorded for this date.")
 
     def visualize_expenses_by_month(self, year=None, month=None):
-        if not month:
-            month = datetime.date.today().strftime('%B')
-        if not year:
-            year = datetime.date.today().year
-        expenses_on_month = [expense for expense in self.expenses if datetime.datetime.strptime(expense['date'], '%d-%m-%Y').strftime('%B') == month and datetime.datetime.strptime(expense['date'], '%d-%m-%Y').year == year]
-        if expenses_on_month:
-            category_expenses = {}
-            for expense in expenses_on_month:
-                category = expense['category']
-                if category not in category_expenses:
-                    category_expenses[category] = 0
-                category_expenses[category] += expense['amount']
-    
+        year = self.resolve_year(year)
+        month = self.resolve_month(month)
+        category_expenses = self.aggregates.by_category(('month', year, month))
+        if category_expenses:
             labels = list(category_expenses.keys())
             values = list(category_expenses.values())
-    
+
+            plt = pyplot()
             plt.figure(figsize=(10, 6))
             plt.pie(values, labels=labels, autopct='%1.1f%%', startangle=140)
             plt.axis('equal')
-            plt.title(f"Expense Summary for {month}")
+            plt.title(f"Expense Summary for {MONTH_NAMES[month]}")
             plt.show()
         else:
             print("No expenses recorded for this month.")
 
- 
     def visualize_expenses_by_year(self, year=None):
-        if not year:
-            year = datetime.date.today().year
-        expenses_on_year = [expense for expense in self.expenses if datetime.datetime.strptime(expense['date'], '%d-%m-%Y').year == year]
-        if expenses_on_year:
-            category_expenses = {}
-            for expense in expenses_on_year:
-                category = expense['category']
-                if category not in category_expenses:
-                    category_expenses[category] = 0
-                category_expenses[category] += expense['amount']
-
+        year = self.resolve_year(year)
+        category_expenses = self.aggregates.by_category(('year', year))
+        if category_expenses:
             labels = list(category_expenses.keys())
             values = list(category_expenses.values())
 
+            plt = pyplot()
             plt.figure(figsize=(10, 6))
             plt.pie(values, labels=labels, autopct='%1.1f%%', startangle=140)
             plt.axis('equal')
@@ -170,20 +1559,13 @@ class ExpenseManager:
             print("No expenses recorded for this year.")
 
     def visualize_monthexpenses_by_year(self, year=None):
-        if not year:
-            year = datetime.date.today().year
-        expenses_on_year = [expense for expense in self.expenses if datetime.datetime.strptime(expense['date'], '%d-%m-%Y').year == int(year)]
-        if expenses_on_year:
-            month_expenses = {}
-            for expense in expenses_on_year:
-                month = datetime.datetime.strptime(expense['date'], '%d-%m-%Y').strftime('%B')
-                if month not in month_expenses:
-                    month_expenses[month] = 0
-                month_expenses[month] += expense['amount']
-
+        year = self.resolve_year(year)
+        month_expenses = self.aggregates.by_month(year)
+        if month_expenses:
             months = list(month_expenses.keys())
             expenses = list(month_expenses.values())
 
+            plt = pyplot()
             plt.figure(figsize=(12, 6))
             plt.bar(months, expenses, color='skyblue')
             plt.xlabel('Month')
@@ -195,6 +1577,11 @@ class ExpenseManager:
         else:
             print("No expenses recorded for this year.")
 
+    def render_charts(self, kind, start, end, directory, formats=('png',), workers=1):
+        # Headless batch version of the visualize_* methods; see render.py.
+        import render
+        return render.render_charts(self.aggregates, kind, start, end, directory, formats, workers)
+
     def set_monthly_limit(self, limit):
         self.monthly_limit = limit
 
@@ -204,72 +1591,175 @@ class ExpenseManager:
     def set_daily_limit(self, limit):
         self.daily_limit = limit
 
-    def total_monthly_expense(self, year=None ,month=None):
-        if not month:
-            month = datetime.date.today().strftime('%B')
-        if not year:
-            year = datetime.date.today().year
-        expenses_on_month = [expense['amount'] for expense in self.expenses if datetime.datetime.strptime(expense['date'], '%d-%m-%Y').strftime('%B') == month and datetime.datetime.strptime(expense['date'], '%d-%m-%Y').year == year]
-        total = sum(expenses_on_month)
-        print(f"Total Expenses for {month}: {self.currency_symbol}{total:.2f}")
+    def total_monthly_expense(self, year=None, month=None):
+        year = self.resolve_year(year)
+        month = self.resolve_month(month)
+        total = self.aggregates.total(('month', year, month))
+        print(f"Total Expenses for {MONTH_NAMES[month]}: {self.currency_symbol}{total:.2f}")
         if self.monthly_limit is not None:
             if total > self.monthly_limit:
                 print("You have exceeded your monthly spending limit!")
 
     def total_yearly_expense(self, year=None):
-        if not year:
-            year = datetime.date.today().year
-        expenses_on_year = [expense['amount'] for expense in self.expenses if datetime.datetime.strptime(expense['date'], '%d-%m-%Y').year == year]
-        total = sum(expenses_on_year)
+        year = self.resolve_year(year)
+        total = self.aggregates.total(('year', year))
         print(f"Total Expenses for {year}: {self.currency_symbol}{total:.2f}")
         if self.yearly_limit is not None:
             if total > self.yearly_limit:
                 print("You have exceeded your yearly spending limit!")
 
     def edit_expense(self, serial_number, new_category=None, new_amount=None, new_date=None, new_comment=None):
-        for expense in self.expenses:
-            if expense['serial_number'] == serial_number:
-                if new_category:
-                    expense['category'] = new_category
-                if new_amount is not None:
-                    expense['amount'] = float(new_amount)
-                if new_date:
-                    expense['date'] = new_date
-                if new_comment:
-                    expense['comment'] = new_comment
-                print("Expense edited successfully.")
-                self.save_expenses(self.filename)
-                return
-        print("Expense not found.")
+        self.ensure_loaded()
+        row = self.slots.get(serial_number)
+        if row is None:
+            print("Expense not found.")
+            return
+        expense = dict(self.expenses[row])
+        if new_date:
+            self.columns.parse_date(new_date)
+        if new_category:
+            expense['category'] = new_category
+        if new_amount not in (None, ''):
+            expense['amount'] = float(new_amount)
+        if new_date:
+            expense['date'] = new_date
+        if new_comment:
+            expense['comment'] = new_comment
+        row = self.update_expense_at(row, expense['date'], expense['category'], expense['amount'], expense['comment'])
+        print("Expense edited successfully.")
+        if self.verify:
+            self.verify_aggregates()
+        self.persist('E', self.expenses[row])
 
     def load_expenses(self, filename):
-        self.expenses = []
-        self.serial_counter = 1
+        if self.batched:
+            # Mutations batch() held back belong to the ledger being left.
+            self.persist_many(self.batched)
+            self.batched.clear()
+        if self.storage is not None:
+            self.storage.close()
+            self.storage = None
+        self.clear_rows()
+        self.changed_days = set()
         self.filename = filename
-        with open(filename, 'r') as f:
-            for line in f:
-                fields = line.strip().split('|')
-                if len(fields) == 5:
-                    serial_number, date, category, amount, comment = fields
-                    amount = float(amount)
-                    self.expenses.append({"serial_number": int(serial_number), "date": date, "category": category, "amount": amount, "comment": comment})
-                    self.serial_counter = max(self.serial_counter, int(serial_number) + 1)
-                else:
-                    print(f"Issue loading line: {line}")
+        self.pending_cube = None
+        storage = self.ledger_storage()
+        # Past any serial number deleted since, as well as every row read.
+        self.serial_counter = max(1, storage.next_serial())
+        self.load_report = LoadReport()
+        # A saved cube that still matches the ledger file spares summing the
+        # rows into cells. Like the rows in read_ledger, its cells are many
+        # small objects without cycles, so collection waits until they exist.
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            # Without a saved cube (cube_order None: SQLite) load_cube sums
+            # every row in the database, which pays off only when they are
+            # not about to be read anyway.
+            cube = storage.load_cube() if self.lazy or storage.cube_order is not None else None
+            replay = storage.replay()
+            if self.lazy and cube is not None:
+                # With nothing in the journal the cube is the whole ledger, so
+                # the records can wait.
+                first = next(replay, None)
+                if first is None:
+                    self.aggregates.load_cells(cube)
+                    self.categories.update(self.aggregates.by_category(('all',)))
+                    self.pending_cube = cube
+                    return
+                replay = itertools.chain([first], replay)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        self.read_ledger(storage, cube)
+
+        replayed = False
+        for op, serial_number, fields in replay:
+            self.replay_journal_record(op, serial_number, fields)
+            replayed = True
+        if replayed and not self.journal_enabled:
+            # Not journaling any more: fold the log into the ledger right away.
+            self.write_ledger()
+
+    def ensure_loaded(self, start=None, end=None):
+        # Parse the records of a lazily loaded ledger. Every method that
+        # needs rows calls this first; totals don't. Methods that only need
+        # the days start..end (ordinals) say so, and a sharded or snapshot
+        # ledger then reads just the shards or rows covering them.
+        if self.pending_cube is None:
+            return
+        storage = self.ledger_storage()
+        if (start is not None or end is not None) and hasattr(storage, 'read_range'):
+            self.read_rows(storage.read_range(start, end, self.load_report), None, aggregate=False)
+            return
+        # The aggregates hold the saved cube plus any records added since.
+        self.pending_cube = None
+        self.read_ledger(storage, self.aggregates.cells())
+
+    def read_rows(self, batches, cells, aggregate=True):
+        # Millions of new objects would otherwise trigger repeated full
+        # garbage collections while loading; nothing built here forms cycles.
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for columns in batches:
+                self.extend_rows(*columns, cells=cells, aggregate=aggregate)
+                if columns[0]:
+                    self.serial_counter = max(self.serial_counter, max(columns[0]) + 1)
+            self.index.merge()
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def read_ledger(self, storage, cube):
+        cells = {}
+        self.read_rows(storage.read(self.load_report), cells, aggregate=cube is None)
+        if cube is None:
+            # Summed in the order the rows were read, so these are the cube
+            # save_cube would write.
+            self.aggregates.add_cells(cells)
+            if storage.cube_order is not None:
+                storage.save_cube(self.aggregates.cells(), self.serial_counter)
+        elif cube.get((('all',), None), [0, 0])[1] != len(self.columns):
+            self.rebuild_aggregates()
+            self.save_cube(storage)
+        else:
+            self.aggregates.load_cells(cube)
+        if self.load_report.malformed:
+            print(self.load_report.summary())
+
+    def replay_journal_record(self, op, serial_number, fields):
+        if op == 'A':
+            if serial_number in self.slots:
+                # Already in the ledger: a compaction folded it in.
+                print(f"Journal adds serial number {serial_number} again; skipped")
+                return
+            self.append_expense({"serial_number": serial_number, **fields})
+            self.serial_counter = max(self.serial_counter, serial_number + 1)
+            return
+        row = self.slots.get(serial_number)
+        if row is None:
+            print(f"Journal refers to unknown serial number {serial_number}")
+        elif op == 'E':
+            self.update_expense_at(row, fields['date'], fields['category'], fields['amount'], fields['comment'])
+        else:
+            self.remove_expense_at(row)
+            self.serial_counter = max(self.serial_counter, serial_number + 1)
+
+    def group_by_category(self, expenses):
+        category_expenses = {}
+        for expense in expenses:
+            category = expense['category']
+            if category not in category_expenses:
+                category_expenses[category] = []
+            category_expenses[category].append(expense)
+        return category_expenses
 
     def view_daily_expense_by_category(self, date=""):
-        if not date:
-            date = datetime.date.today().strftime('%d-%m-%Y')
-        filtered_expenses = [expense for expense in self.expenses if expense['date'] == date]
-    
-        if filtered_expenses:
-            category_expenses = {}
-            for expense in filtered_expenses:
-                category = expense['category']
-                if category not in category_expenses:
-                    category_expenses[category] = []
-                category_expenses[category].append(expense)
-    
+        date, ordinal = self.resolve_date(date)
+        category_expenses = self.records_by_category(ordinal, ordinal)
+
+        if category_expenses:
             print(f"Daily Expenses for {date}:")
             for category, expenses in category_expenses.items():
                 print(f"\nCategory: {category}")
@@ -278,65 +1768,36 @@ class ExpenseManager:
         else:
             print("No expenses recorded for this date.")
 
-
     def total_daily_expense_by_category(self, date=None):
-        if not date:
-            date = datetime.date.today().strftime('%d-%m-%Y')
-        categories = set(expense['category'] for expense in self.expenses if expense['date'] == date)
-        for category in categories:
-            total_expense = sum(expense['amount'] for expense in self.expenses if expense['date'] == date and expense['category'] == category)
+        date, ordinal = self.resolve_date(date)
+        for category, total_expense in self.aggregates.by_category(('day', ordinal)).items():
             print(f"Total expense in {category} on {date}: {self.currency_symbol}{total_expense:.2f}")
 
-    
     def view_monthly_expense_by_category(self, year=None, month=None):
-        if not year:
-            year = datetime.date.today().year
-        if not month:
-            month = datetime.date.today().month
-        filtered_expenses = [expense for expense in self.expenses if datetime.datetime.strptime(expense['date'], '%d-%m-%Y').year == year and datetime.datetime.strptime(expense['date'], '%d-%m-%Y').month == month]
-    
-        if filtered_expenses:
-            category_expenses = {}
-            for expense in filtered_expenses:
-                category = expense['category']
-                if category not in category_expenses:
-                    category_expenses[category] = []
-                category_expenses[category].append(expense)
-    
-            print(f"Monthly Expenses for {datetime.date(year, month, 1).strftime('%B')} {year}:")
+        year = self.resolve_year(year)
+        month = self.resolve_month(month)
+        category_expenses = self.records_by_category(*month_bounds(year, month))
+
+        if category_expenses:
+            print(f"Monthly Expenses for {MONTH_NAMES[month]} {year}:")
             for category, expenses in category_expenses.items():
                 print(f"\nCategory: {category}")
                 for idx, exp in enumerate(expenses, start=1):
                     print(f"{idx}. Date: {exp['date']} | Amount: {self.currency_symbol}{exp['amount']:.2f} | Comment: {exp.get('comment', '')}")
         else:
             print("No expenses recorded for this month.")
-    
-    def total_monthly_expense_by_category(self, year=None, month=None):
-        if not year:
-            year = datetime.date.today().year
 
-        if not month:
-            month = datetime.date.today().strftime('%B')
+    def total_monthly_expense_by_category(self, year=None, month=None):
+        year = self.resolve_year(year)
+        month = self.resolve_month(month)
+        for category, total_expense in self.aggregates.by_category(('month', year, month)).items():
+            print(f"Total expense in {category} for {MONTH_NAMES[month]} {year}: {self.currency_symbol}{total_expense:.2f}")
 
-        categories = set(expense['category'] for expense in self.expenses if datetime.datetime.strptime(expense['date'], '%d-%m-%Y').strftime('%B') == month and datetime.datetime.strptime(expense['date'], '%d-%m-%Y').year == int(year))
-        for category in categories:
-            total_expense = sum(expense['amount'] for expense in self.expenses if datetime.datetime.strptime(expense['date'], '%d-%m-%Y').strftime('%B') == month and datetime.datetime.strptime(expense['date'], '%d-%m-%Y').year == int(year) and expense['category'] == category)
-            print(f"Total expense in {category} for {month} {year}: {self.currency_symbol}{total_expense:.2f}")
-    
     def view_yearly_expense_by_category(self, year=None):
-        if not year:
-            year = datetime.date.today().year
-            # Filter expenses for the given year
-            filtered_expenses = [expense for expense in self.expenses if datetime.datetime.strptime(expense['date'], '%d-%m-%Y').year == year]
-
-        if filtered_expenses:
-            category_expenses = {}
-            for expense in filtered_expenses:
-                category = expense['category']
-                if category not in category_expenses:
-                    category_expenses[category] = []
-                category_expenses[category].append(expense)
+        year = self.resolve_year(year)
+        category_expenses = self.records_by_category(*year_bounds(year))
 
+        if category_expenses:
             print(f"Expenses for {year}:")
             for category, expenses in category_expenses.items():
                 print(f"\nCategory: {category}")
@@ -345,20 +1806,30 @@ class ExpenseManager:
         else:
             print("No expenses recorded for this year.")
 
-    
     def total_yearly_expense_by_category(self, year=None):
-        if not year:
-            year = datetime.date.today().year
-        categories = set(expense['category'] for expense in self.expenses if datetime.datetime.strptime(expense['date'], '%d-%m-%Y').year == year)
-        for category in categories:
-            total_expense = sum(expense['amount'] for expense in self.expenses if datetime.datetime.strptime(expense['date'], '%d-%m-%Y').year == year and expense['category'] == category)
+        year = self.resolve_year(year)
+        for category, total_expense in self.aggregates.by_category(('year', year)).items():
             print(f"Total expense in {category} for {year}: {self.currency_symbol}{total_expense:.2f}")
 
 
 def main():
+    if len(sys.argv) > 1:
+        # Subcommands with JSON output (see cli.py) instead of the menu.
+        import cli
+        sys.exit(cli.main(sys.argv[1:]))
     manager = ExpenseManager()
     manager.filename = "expense.txt"
+    while True:
+        # A mistyped date, month, number or file name is reported and the
+        # menu shown again.
+        try:
+            menu(manager)
+            return
+        except (ValueError, OSError) as error:
+            print(f"Invalid input: {error}")
 
+
+def menu(manager):
     while True:
         print("\n1. Add Expense")
         print("2. Edit Expense")
@@ -385,6 +1856,9 @@ def main():
         print("23. Save Expenses")
         print("24. Load Expenses")
         print("25. Exit")
+        print("26. Import Expenses from CSV")
+        print("27. Toggle Profiling")
+        print("28. Show Statistics")
 
         choice = input("Enter your choice: ")
 
@@ -500,6 +1974,32 @@ def main():
             print("Exiting...")
             break
 
+        elif choice == '26':
+            filename = input("Enter CSV filename to import (columns: date, category, amount, comment): ")
+            manager.import_expenses(filename)
+
+        elif choice == '27':
+            if manager.instrumentation is not None and manager.instrumentation.profile:
+                manager.enable_instrumentation(profile=False)
+                print("Profiling off.")
+            else:
+                profile_dir = input("Enter directory to save profiles (press Enter to only print them): ")
+                manager.enable_instrumentation(profile=True, profile_dir=profile_dir or None)
+                print("Profiling on: each following action is profiled.")
+
+        elif choice == '28':
+            if manager.instrumentation is None:
+                manager.enable_instrumentation()
+                print("Statistics are collected from now on.")
+            else:
+                stats = manager.stats()
+                for name, method in stats['methods'].items():
+                    print(f"{name}: {method['calls']} calls, {method['seconds'] * 1000:.1f} ms total, p50 {method['p50_ms']:.2f} ms, "
+                          f"p99 {method['p99_ms']:.2f} ms, {method['rows_scanned']} rows scanned, {method['bytes_written']} bytes written")
+                filename = input("Enter filename to save statistics (.json or .prom, press Enter to skip): ")
+                if filename:
+                    manager.dump_stats(filename)
+
         else:
             print("Invalid choice. Please try again.")
 
@@ -0,0 +1,1288 @@
+import datetime
+import errno
+import math
+import operator
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Mapping
+from itertools import repeat
+
+DATE_FORMAT = '%d-%m-%Y'
+SNAPSHOT_EXTENSION = '.swb'
+
+
+def month_bounds(year, month):
+    # First and last day (ordinals) of a month.
+    following = datetime.date(year + 1, 1, 1) if month == 12 else datetime.date(year, month + 1, 1)
+    return datetime.date(year, month, 1).toordinal(), following.toordinal() - 1
+
+
+def parse_date(text):
+    # Same dd-mm-yyyy layout as DATE_FORMAT, without the cost of strptime.
+    day, month, year = text.split('-')
+    return datetime.date(int(year), int(month), int(day))
+
+
+def format_record(expense):
+    comment = expense.get('comment') or ''
+    return f"{expense['serial_number']}|{expense['date']}|{expense['category']}|{expense['amount']}|{comment}\n"
+
+
+class LoadReport:
+    # Summary of a ledger read: how many lines were loaded and which ones were
+    # skipped, keeping only the first few malformed lines as samples.
+    def __init__(self, max_samples=20):
+        self.max_samples = max_samples
+        self.loaded = 0
+        self.malformed = 0
+        self.samples = []
+
+    def record(self, line_number, reason, line):
+        self.malformed += 1
+        if len(self.samples) < self.max_samples:
+            self.samples.append((line_number, reason, line))
+
+    def merge(self, other):
+        self.loaded += other.loaded
+        self.malformed += other.malformed
+        self.samples.extend(other.samples[:self.max_samples - len(self.samples)])
+
+    def summary(self):
+        text = f"Loaded {self.loaded} expenses, skipped {self.malformed} malformed lines."
+        for line_number, reason, line in self.samples:
+            text += f"\n  line {line_number}: {reason}: {line!r}"
+        if self.malformed > len(self.samples):
+            text += f"\n  ... and {self.malformed - len(self.samples)} more"
+        return text
+
+
+def parse_block(text, first_line_number, report, dates):
+    # Parse a block of complete lines into six parallel columns: serials, date
+    # strings, parsed dates, categories, amounts and comments. When every line
+    # has exactly five fields the whole block is split in one go and each
+    # column converted with map(); anything unusual falls back to checking
+    # the block line by line. The fields are counted per line: a line with
+    # one field too many next to one with one too few would otherwise add
+    # up to the right total and shift a phantom record into the columns.
+    # Both paths strip each line, so trailing blanks never reach a comment.
+    lines = text.split('\n')
+    if set(map(str.count, lines, repeat('|'))) == {4}:
+        parts = '|'.join(map(str.strip, lines)).split('|')
+        try:
+            serials = list(map(int, parts[0::5]))
+            amounts = list(map(float, parts[3::5]))
+            date_strings = parts[1::5]
+            parsed = [dates[date] if date in dates else dates.setdefault(date, parse_date(date)) for date in date_strings]
+        except ValueError:
+            pass
+        else:
+            report.loaded += len(lines)
+            return serials, date_strings, parsed, parts[2::5], amounts, parts[4::5]
+
+    columns = ([], [], [], [], [], [])
+    for line_number, line in enumerate(lines, start=first_line_number):
+        fields = line.strip().split('|')
+        if len(fields) != 5:
+            if line.strip():
+                report.record(line_number, f"expected 5 fields, got {len(fields)}", line)
+            continue
+        serial_number, date, category, amount, comment = fields
+        try:
+            record = (int(serial_number), date, dates.get(date) or dates.setdefault(date, parse_date(date)), category, float(amount), comment)
+        except ValueError as e:
+            report.record(line_number, str(e), line)
+            continue
+        for column, value in zip(columns, record):
+            column.append(value)
+        report.loaded += 1
+    return columns
+
+
+def iter_ledger(filename, report=None, block_size=1 << 20):
+    # Stream (serial, date, parsed date, category, amount, comment) tuples from
+    # a pipe-delimited ledger.
+    for columns in iter_ledger_columns(filename, report, block_size):
+        yield from zip(*columns)
+
+
+def iter_ledger_columns(filename, report=None, block_size=1 << 20, start=0, end=None):
+    # Read a ledger in large blocks, yielding the parse_block columns of each.
+    # With a byte range, only lines that begin inside [start, end) are read,
+    # so adjacent ranges cover a file exactly once between them.
+    if report is None:
+        report = LoadReport()
+    dates = {}
+    line_number = 1
+    remainder = b''
+    with open(filename, 'rb') as f:
+        if start:
+            f.seek(start - 1)
+            f.readline()
+        position = f.tell()
+        while end is None or position < end:
+            size = block_size if end is None else min(block_size, end - position)
+            block = f.read(size)
+            if not block:
+                break
+            position += len(block)
+            if end is not None and position >= end and not block.endswith(b'\n'):
+                # Finish the line that straddles the end of the range.
+                block += f.readline()
+            block = remainder + block
+            cut = block.rfind(b'\n')
+            if cut < 0:
+                remainder = block
+                continue
+            remainder = block[cut + 1:]
+            text = block[:cut].decode('utf-8').replace('\r', '')
+            yield parse_block(text, line_number, report, dates)
+            line_number += text.count('\n') + 1
+    if remainder.strip():
+        yield parse_block(remainder.decode('utf-8').replace('\r', ''), line_number, report, dates)
+
+
+def iter_csv_records(filename):
+    # Records from a CSV export with a header row naming (in any case and
+    # order) date, category, amount and optionally comment columns; other
+    # columns are ignored. Dates use DATE_FORMAT.
+    import csv
+    with open(filename, newline='') as f:
+        reader = csv.reader(f)
+        header = [name.strip().lower() for name in next(reader, [])]
+        missing = {'date', 'category', 'amount'} - set(header)
+        if missing:
+            raise ValueError(f"{filename} has no {', '.join(sorted(missing))} column")
+        date, category, amount = header.index('date'), header.index('category'), header.index('amount')
+        comment = header.index('comment') if 'comment' in header else None
+        for row in reader:
+            if row:
+                row += [''] * (len(header) - len(row))
+                yield {"date": row[date], "category": row[category], "amount": row[amount], "comment": row[comment] if comment is not None else ''}
+
+
+# Binary snapshot layout, all little-endian, every section 8-byte aligned:
+#   header            magic, version, rows, categories, category bytes, comment bytes
+#   serials           int64   x rows
+#   ordinals          int32   x rows      (date.toordinal(), rows sorted by it)
+#   category_ids      uint32  x rows      (index into the category table)
+#   cents             int64   x rows      (amount in cents)
+#   comment_offsets   uint64  x rows + 1  (into the comment blob)
+#   category_offsets  uint64  x categories + 1
+#   category blob, comment blob           (UTF-8)
+SNAPSHOT_MAGIC = b'SWB1'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('<4sIQQQQ')
+
+
+def snapshot_layout(rows, categories, category_bytes, comment_bytes):
+    sections = (('serials', 'q', rows), ('ordinals', 'i', rows), ('category_ids', 'I', rows), ('cents', 'q', rows),
+                ('comment_offsets', 'Q', rows + 1), ('category_offsets', 'Q', categories + 1),
+                ('category_blob', 'B', category_bytes), ('comment_blob', 'B', comment_bytes))
+    layout = []
+    offset = SNAPSHOT_HEADER.size
+    for name, code, count in sections:
+        offset = (offset + 7) & ~7
+        layout.append((name, code, offset, count))
+        offset += count * struct.calcsize(code)
+    return layout
+
+
+def write_snapshot(filename, serials, ordinals, categories, amounts, comments):
+    # Rows are stored in date order so that readers can bisect the ordinals.
+    order = sorted(range(len(ordinals)), key=ordinals.__getitem__)
+    category_lookup = {}
+    category_ids = array('I')
+    for row in order:
+        category_ids.append(category_lookup.setdefault(categories[row], len(category_lookup)))
+    category_blob, category_offsets = b'', array('Q', [0])
+    for name in category_lookup:
+        category_blob += name.encode('utf-8')
+        category_offsets.append(len(category_blob))
+    encoded = [(comments[row] or '').encode('utf-8') for row in order]
+    comment_offsets = array('Q', [0])
+    total = 0
+    for comment in encoded:
+        total += len(comment)
+        comment_offsets.append(total)
+
+    sections = {
+        'serials': array('q', [serials[row] for row in order]),
+        'ordinals': array('i', [ordinals[row] for row in order]),
+        'category_ids': category_ids,
+        'cents': array('q', [round(amounts[row] * 100) for row in order]),
+        'comment_offsets': comment_offsets,
+        'category_offsets': category_offsets,
+        'category_blob': category_blob,
+        'comment_blob': b''.join(encoded),
+    }
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(order), len(category_lookup), len(category_blob), total))
+        for name, code, offset, count in snapshot_layout(len(order), len(category_lookup), len(category_blob), total):
+            f.write(b'\0' * (offset - f.tell()))
+            data = sections[name]
+            if isinstance(data, array) and sys.byteorder == 'big':
+                data = array(data.typecode, data)
+                data.byteswap()
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+
+class Snapshot:
+    # A binary snapshot opened with mmap. The columns are memoryviews straight
+    # onto the mapped file, so opening costs nothing per row: span bisects
+    # the ordinals in place and columns copies out only the rows asked for.
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        # Imported here so text ledgers don't pay for it.
+        import mmap
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, rows, categories, category_bytes, comment_bytes = SNAPSHOT_HEADER.unpack_from(self.map)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            self.close()
+            raise ValueError(f"{filename} is not a SpendWise snapshot")
+        self.rows = rows
+        self.view = memoryview(self.map)
+        for name, code, offset, count in snapshot_layout(rows, categories, category_bytes, comment_bytes):
+            column = self.view[offset:offset + count * struct.calcsize(code)].cast(code)
+            if sys.byteorder == 'big' and code != 'B':
+                column = array(code, column)
+                column.byteswap()
+            setattr(self, name, column)
+        blob, offsets = bytes(self.category_blob), self.category_offsets
+        self.category_names = [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(categories)]
+        self.category_lookup = {name: code for code, name in enumerate(self.category_names)}
+
+    def __len__(self):
+        return self.rows
+
+    def close(self):
+        for name in ('serials', 'ordinals', 'category_ids', 'cents', 'comment_offsets', 'category_offsets', 'category_blob', 'comment_blob', 'view'):
+            column = self.__dict__.pop(name, None)
+            if isinstance(column, memoryview):
+                column.release()
+        self.map.close()
+        self.file.close()
+
+    def span(self, start=None, end=None):
+        lo = bisect_left(self.ordinals, start) if start is not None else 0
+        hi = bisect_right(self.ordinals, end) if end is not None else self.rows
+        return lo, hi
+
+    def comments(self, lo=0, hi=None):
+        hi = self.rows if hi is None else hi
+        offsets = self.comment_offsets
+        blob = bytes(self.comment_blob[offsets[lo]:offsets[hi]])
+        base = offsets[lo]
+        return [blob[offsets[row] - base:offsets[row + 1] - base].decode('utf-8') for row in range(lo, hi)]
+
+    def columns(self, lo=0, hi=None):
+        # The rows lo..hi as iter_ledger_columns style columns.
+        hi = self.rows if hi is None else hi
+        dates = {}
+        for ordinal in set(self.ordinals[lo:hi]):
+            parsed = datetime.date.fromordinal(ordinal)
+            dates[ordinal] = (parsed.strftime(DATE_FORMAT), parsed)
+        ordinals = self.ordinals[lo:hi]
+        names = self.category_names
+        return (self.serials[lo:hi].tolist(), [dates[ordinal][0] for ordinal in ordinals], [dates[ordinal][1] for ordinal in ordinals],
+                [names[code] for code in self.category_ids[lo:hi]], [cents / 100 for cents in self.cents[lo:hi]], self.comments(lo, hi))
+
+
+def text_to_snapshot(source, target, report=None):
+    serials, ordinals, categories, amounts, comments = [], [], [], [], []
+    for columns in iter_ledger_columns(source, report):
+        serials.extend(columns[0])
+        ordinals.extend(parsed.toordinal() for parsed in columns[2])
+        categories.extend(columns[3])
+        amounts.extend(columns[4])
+        comments.extend(columns[5])
+    write_snapshot(target, serials, ordinals, categories, amounts, comments)
+
+
+def snapshot_to_text(source, target):
+    snapshot = Snapshot(source)
+    try:
+        with open(target, 'w') as f:
+            for serial_number, date, parsed, category, amount, comment in zip(*snapshot.columns()):
+                f.write(format_record({"serial_number": serial_number, "date": date, "category": category, "amount": amount, "comment": comment}))
+    finally:
+        snapshot.close()
+
+
+# Rollup cube kept next to a text or snapshot ledger as <ledger>.cube: every
+# cell of ExpenseAggregates, (period, category) -> [total, count, min, max],
+# tagged with the size and mtime of the ledger they summarise so a stale
+# cube is ignored. The header also keeps the ledger's next serial number,
+# which outlives deleting the newest records; it holds even in a stale cube.
+# Layout, little-endian:
+#   header           magic, version, ledger size, ledger mtime_ns, cells,
+#                    category blob bytes, next serial number
+#   category blob    category names joined by '\n'
+#   cells            period kinds B, period fields q and q, category ids i
+#                    (-1 for a period's total), counts q, totals d, mins d,
+#                    maxes d; one array after another
+# Cells are sorted by period kind and fields, each period's total before its
+# categories, so a reader can binary search for the periods it needs.
+CUBE_MAGIC = b'SWC1'
+CUBE_VERSION = 4
+CUBE_HEADER = struct.Struct('<4sIQqQQq')
+CUBE_PERIODS = ('day', 'month', 'year', 'all')
+# Fields of each kind of period: ('day', ordinal), ('month', year, month),
+# ('year', year), ('all',).
+CUBE_PERIOD_LENGTHS = (2, 3, 2, 1)
+CUBE_COLUMNS = 'Bqqiqddd'
+CUBE_CELL_SIZE = sum(map(struct.calcsize, CUBE_COLUMNS))
+
+
+def ledger_signature(filename):
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def write_cube(filename, cells, signature, next_serial=0):
+    # cells: {(period, category): [amount, count, low, high]} at every level
+    # of the cube, with category None for a period's total. Stored as
+    # columns in period order; a period's categories keep the given order.
+    category_lookup = {}
+    columns = [array('B'), array('q'), array('q'), array('i'), array('q'), array('d'), array('d'), array('d')]
+    for (key, category), (amount, count, low, high) in sorted(cells.items(), key=lambda item: cube_row_key(item[0][0], item[0][1] is not None)):
+        a, b = (key[1:] + (0, 0))[:2]
+        category_id = -1 if category is None else category_lookup.setdefault(category, len(category_lookup))
+        for column, value in zip(columns, (CUBE_PERIODS.index(key[0]), a, b, category_id, count, amount, low, high)):
+            column.append(value)
+    category_blob = '\n'.join(category_lookup).encode('utf-8')
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        f.write(CUBE_HEADER.pack(CUBE_MAGIC, CUBE_VERSION, signature[0], signature[1], len(cells), len(category_blob), next_serial))
+        f.write(category_blob)
+        for column in columns:
+            if sys.byteorder == 'big':
+                column.byteswap()
+            f.write(column)
+    os.replace(tmp_filename, filename)
+
+
+def read_cube_serial(filename):
+    # The next serial number saved in a cube, stale or not; 0 without one.
+    try:
+        with open(filename, 'rb') as f:
+            data = f.read(CUBE_HEADER.size)
+    except OSError:
+        return 0
+    if len(data) < CUBE_HEADER.size:
+        return 0
+    magic, version, size, mtime_ns, count, blob_size, next_serial = CUBE_HEADER.unpack(data)
+    return next_serial if magic == CUBE_MAGIC and version == CUBE_VERSION else 0
+
+
+def cube_row_key(key, is_category):
+    # Where a cell of period key sits in a cube file.
+    return (CUBE_PERIODS.index(key[0]),) + (key[1:] + (0, 0))[:2] + (is_category,)
+
+
+def read_cube(filename, signature):
+    # The cells as passed to write_cube, as a SavedCube, or None if there is
+    # no cube or it doesn't match signature.
+    try:
+        with open(filename, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) < CUBE_HEADER.size:
+        return None
+    magic, version, size, mtime_ns, count, blob_size, next_serial = CUBE_HEADER.unpack_from(data)
+    if magic != CUBE_MAGIC or version != CUBE_VERSION or (size, mtime_ns) != signature:
+        return None
+    offset = CUBE_HEADER.size
+    if len(data) != offset + blob_size + count * CUBE_CELL_SIZE:
+        return None
+    names = data[offset:offset + blob_size].decode('utf-8').split('\n') if blob_size else []
+    offset += blob_size
+    # Views of the file's bytes, not copies, unless they need byte swapping.
+    view = memoryview(data)
+    columns = []
+    for typecode in CUBE_COLUMNS:
+        end = offset + count * struct.calcsize(typecode)
+        column = view[offset:end].cast(typecode)
+        if sys.byteorder == 'big':
+            column = array(typecode, column.tobytes())
+            column.byteswap()
+        offset = end
+        columns.append(column)
+    return SavedCube(names, columns)
+
+
+class SavedCube(Mapping):
+    # The cells of a cube file, decoded only when asked for: period() binary
+    # searches the columns for one period's cells, so a query that needs a
+    # few periods doesn't turn every cell of the ledger into Python objects.
+    # Iterating decodes them all, once.
+    def __init__(self, names, columns):
+        self.names = names
+        self.columns = columns
+        self.decoded = None
+
+    def row_key(self, row):
+        kinds, firsts, seconds, categories = self.columns[:4]
+        return kinds[row], firsts[row], seconds[row], categories[row] >= 0
+
+    def find(self, target, low=0):
+        # The first row whose row_key is not below target.
+        high = len(self.columns[0])
+        while low < high:
+            middle = (low + high) // 2
+            if self.row_key(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def period(self, key):
+        # The total of a period and {category: cell} within it, or None if
+        # the cube has nothing for it.
+        total = cube_row_key(key, False)
+        row = self.find(total)
+        if row == len(self.columns[0]) or self.row_key(row) != total:
+            return None
+        # Past the period's last category: True < 2.
+        end = self.find(cube_row_key(key, 2), row + 1)
+        kinds, firsts, seconds, categories, counts, amounts, lows, highs = self.columns
+        names = self.names
+        return ([amounts[row], counts[row], lows[row], highs[row]],
+                {names[categories[i]]: [amounts[i], counts[i], lows[i], highs[i]] for i in range(row + 1, end)})
+
+    def cells(self):
+        if self.decoded is None:
+            names = self.names
+            self.decoded = {((CUBE_PERIODS[kind], a, b)[:CUBE_PERIOD_LENGTHS[kind]], None if category < 0 else names[category]): [amount, count, low, high]
+                            for kind, a, b, category, count, amount, low, high in zip(*self.columns)}
+        return self.decoded
+
+    def __getitem__(self, item):
+        key, category = item
+        cells = self.period(key)
+        if cells is not None:
+            if category is None:
+                return cells[0]
+            if category in cells[1]:
+                return cells[1][category]
+        raise KeyError(item)
+
+    def __iter__(self):
+        return iter(self.cells())
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def items(self):
+        return self.cells().items()
+
+
+class ExpenseJournal:
+    # Append-only log of mutations kept next to the ledger file. Each line is
+    # an operation code followed by the record in the usual ledger layout:
+    #   A|serial|date|category|amount|comment   (add)
+    #   E|serial|date|category|amount|comment   (edit, full new state)
+    #   D|serial                                (delete)
+    #   C|{"file": [size, mtime_ns], ...}       (checkpoint, see compact)
+    def __init__(self, filename, fsync_every=None):
+        self.filename = filename + '.journal'
+        self.fsync_every = fsync_every
+        self.pending = 0
+        self.records = 0
+        self.file = None
+
+    def open(self):
+        if self.file is None:
+            self.file = open(self.filename, 'a')
+        return self.file
+
+    def append(self, op, expense):
+        f = self.open()
+        if op == 'D':
+            f.write(f"D|{expense['serial_number']}\n")
+        else:
+            f.write(op + '|' + format_record(expense))
+        f.flush()
+        self.records += 1
+        self.pending += 1
+        if self.fsync_every and self.pending >= self.fsync_every:
+            self.sync()
+
+    def append_many(self, op, expenses):
+        # A batch of records of the same kind as one write and one sync.
+        if op == 'D':
+            lines = [f"D|{expense['serial_number']}\n" for expense in expenses]
+        else:
+            lines = [op + '|' + format_record(expense) for expense in expenses]
+        f = self.open()
+        f.write(''.join(lines))
+        self.records += len(lines)
+        self.pending += len(lines)
+        if self.fsync_every:
+            self.sync()
+        else:
+            f.flush()
+
+    def sync(self):
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def replay(self):
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, 'r') as f:
+            for line in f:
+                fields = line.rstrip('\n').split('|')
+                if fields[0] == 'C':
+                    continue
+                if fields[0] == 'D' and len(fields) == 2:
+                    self.records += 1
+                    yield 'D', int(fields[1]), None
+                elif fields[0] in ('A', 'E') and len(fields) == 6:
+                    self.records += 1
+                    serial_number, date, category, amount, comment = fields[1:]
+                    yield fields[0], int(serial_number), {"date": date, "category": category, "amount": float(amount), "comment": comment}
+                else:
+                    print(f"Issue replaying journal line: {line}")
+
+    def reset(self):
+        self.close()
+        with open(self.filename, 'w'):
+            pass
+        self.records = 0
+
+    def compact(self, files, keep=True):
+        # Move the files of a compaction into place and empty the journal
+        # (or remove it unless keep). files maps each ledger file to the
+        # fsynced file replacing it, or to None if it goes. While the journal
+        # holds entries, the new files are first logged as a checkpoint, so
+        # a crash part way through leaves a journal that recover() finishes
+        # the moves from, instead of one replayed over a ledger that already
+        # holds it.
+        self.close()
+        if os.path.exists(self.filename) and os.path.getsize(self.filename):
+            # Imported here, as in finish_compaction, so json and re stay off
+            # the startup path.
+            import json
+            signatures = {os.path.basename(path): None if tmp is None else ledger_signature(tmp) for path, tmp in files.items()}
+            with open(self.filename, 'a') as f:
+                f.write('C|' + json.dumps(signatures) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        for path, tmp in files.items():
+            if tmp is not None:
+                os.replace(tmp, path)
+            elif os.path.exists(path):
+                os.remove(path)
+        if os.path.exists(self.filename):
+            if keep:
+                self.reset()
+            else:
+                os.remove(self.filename)
+        self.records = 0
+
+    def recover(self):
+        # Finish a compaction that crashed after logging its checkpoint, and
+        # drop the entries it folded into the ledger. A checkpoint whose new
+        # files are neither in place nor waiting as .tmp files never took
+        # effect, and the entries before it stay. A last line without its
+        # newline is an append torn by a crash; it goes too, so the next
+        # append starts a line of its own.
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, 'r') as f:
+            lines = f.readlines()
+        torn = bool(lines) and not lines[-1].endswith('\n')
+        if torn:
+            lines.pop()
+        checkpoints = [number for number, line in enumerate(lines) if line.startswith('C|')]
+        if not checkpoints and not torn:
+            return
+        kept = lines
+        if checkpoints:
+            kept = self.finish_compaction(lines, checkpoints[-1])
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            f.write(''.join(kept))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, self.filename)
+
+    def finish_compaction(self, lines, last):
+        # The journal lines still to replay once the compaction checkpointed
+        # at lines[last] is either finished or known never to have started.
+        import json
+        directory = os.path.dirname(self.filename)
+        signatures = json.loads(lines[last][2:])
+        moves = {}
+        for name, signature in signatures.items():
+            path = os.path.join(directory, name)
+            if signature is None:
+                moves[path] = None
+            elif ledger_signature(path) == tuple(signature):
+                continue
+            elif ledger_signature(path + '.tmp') == tuple(signature):
+                moves[path] = path + '.tmp'
+            else:
+                moves = None
+                break
+        if moves is None:
+            return [line for line in lines if not line.startswith('C|')]
+        for path, tmp in moves.items():
+            if tmp is not None:
+                os.replace(tmp, path)
+            elif os.path.exists(path):
+                os.remove(path)
+        return [line for line in lines[last + 1:] if not line.startswith('C|')]
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+
+class TextStorage:
+    # The pipe-delimited ledger, optionally with an append-only journal of
+    # mutations so that single changes don't rewrite the whole file. Every
+    # backend offers the same methods: read, replay, record, write_all,
+    # flush and close.
+    # The order read() returns the rows in, relative to write_all: the
+    # cube saved next to the ledger lists categories in the same order.
+    cube_order = 'rows'
+
+    def __init__(self, filename, journal=False, fsync_every=None, compact_every=10000):
+        self.filename = filename
+        self.journal_enabled = journal
+        self.compact_every = compact_every
+        self.journal = ExpenseJournal(filename, fsync_every)
+        self.journal.recover()
+
+    def read(self, report=None):
+        if self.journal_only():
+            return iter(())
+        return iter_ledger_columns(self.filename, report)
+
+    def journal_only(self):
+        # A journaled ledger that hasn't been compacted yet has no file of
+        # its own; everything is still in the journal.
+        return not os.path.exists(self.filename) and os.path.exists(self.journal.filename)
+
+    def replay(self):
+        return self.journal.replay()
+
+    def record(self, op, expense, renumber=False):
+        # Persist one mutation on its own. False means the backend can't, and
+        # the caller should write_all instead.
+        if not self.journal_enabled:
+            return False
+        self.journal.append(op, expense)
+        return not (self.compact_every and self.journal.records >= self.compact_every)
+
+    def record_many(self, op, expenses):
+        # Persist a batch of mutations with a single write. New records only
+        # ever go at the end of the ledger, so without a journal an add can be
+        # appended to the file itself.
+        if self.journal_enabled:
+            self.journal.append_many(op, expenses)
+            return not (self.compact_every and self.journal.records >= self.compact_every)
+        return op == 'A' and self.append_file(expenses)
+
+    def write_all(self, expenses):
+        # The ledger now holds every logged mutation, so the journal can go.
+        tmp_filename = self.filename + '.tmp'
+        self.write_file((expense for expense in expenses if expense is not None), tmp_filename)
+        self.journal.compact({self.filename: tmp_filename}, keep=self.journal_enabled)
+
+    def write_file(self, expenses, filename):
+        # Write and fsync the ledger to filename, for the caller to move
+        # into place.
+        with open(filename, 'w') as f:
+            for expense in expenses:
+                f.write(format_record(expense))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def append_file(self, expenses):
+        with open(self.filename, 'a') as f:
+            f.write(''.join(format_record(expense) for expense in expenses))
+            f.flush()
+            os.fsync(f.fileno())
+        return True
+
+    def load_cube(self):
+        return read_cube(self.filename + '.cube', ledger_signature(self.filename))
+
+    def next_serial(self):
+        # The lowest serial number the ledger may hand out next, as of the
+        # last save_cube: deleted serial numbers are never reused.
+        return read_cube_serial(self.filename + '.cube')
+
+    def save_cube(self, cells, next_serial=0):
+        # Only valid while the ledger file itself matches cells.
+        signature = ledger_signature(self.filename)
+        if signature is not None:
+            write_cube(self.filename + '.cube', cells, signature, next_serial)
+
+    def flush(self):
+        self.journal.sync()
+
+    def close(self):
+        self.journal.close()
+
+
+class SnapshotStorage(TextStorage):
+    # A binary snapshot, journaled the same way as the text ledger.
+    #
+    # read_range bisects the mapped ordinals for a span of days and copies
+    # just those rows out of the file, so a lazily loaded ledger can be read
+    # piecewise, like a sharded one. Once it has been, read() returns only
+    # the rows not read yet.
+    cube_order = 'date'
+
+    def __init__(self, filename, **options):
+        super().__init__(filename, **options)
+        # Row spans [lo, hi) of the file not read yet, or None while nothing
+        # has been read by range.
+        self.unread = None
+
+    def read(self, report=None, batch_size=1 << 16):
+        return self.read_spans(None, None, report, batch_size)
+
+    def read_range(self, start=None, end=None, report=None, batch_size=1 << 16):
+        # The unread rows dated start..end (ordinals, inclusive; None for
+        # open ends).
+        return self.read_spans(start, end, report, batch_size, partial=True)
+
+    def read_spans(self, start, end, report, batch_size, partial=False):
+        if self.journal_only():
+            return
+        snapshot = Snapshot(self.filename)
+        try:
+            if self.unread is None:
+                if not partial:
+                    spans = [(0, len(snapshot))]
+                else:
+                    self.unread = [(0, len(snapshot))]
+            if self.unread is not None:
+                first, last = snapshot.span(start, end)
+                spans = [(max(lo, first), min(hi, last)) for lo, hi in self.unread if lo < last and hi > first]
+                self.unread = [(lo, hi) for span_lo, span_hi in self.unread
+                               for lo, hi in ((span_lo, min(span_hi, first)), (max(span_lo, last), span_hi)) if lo < hi]
+            for span_lo, span_hi in spans:
+                for lo in range(span_lo, span_hi, batch_size):
+                    columns = snapshot.columns(lo, min(lo + batch_size, span_hi))
+                    if report is not None:
+                        report.loaded += len(columns[0])
+                    yield columns
+        finally:
+            snapshot.close()
+
+    def write_file(self, expenses, filename):
+        dates = {}
+        serials, ordinals, categories, amounts, comments = [], [], [], [], []
+        for expense in expenses:
+            date = expense['date']
+            if date not in dates:
+                dates[date] = parse_date(date).toordinal()
+            serials.append(expense['serial_number'])
+            ordinals.append(dates[date])
+            categories.append(expense['category'])
+            amounts.append(expense['amount'])
+            comments.append(expense.get('comment'))
+        write_snapshot(filename, serials, ordinals, categories, amounts, comments)
+
+    def write_all(self, expenses):
+        super().write_all(expenses)
+        # The rows now sit at different positions in the file.
+        self.unread = None
+
+    def append_file(self, expenses):
+        # Snapshot rows are sorted by date in fixed-size sections, so there
+        # is no appending; the caller rewrites the whole file instead.
+        return False
+
+
+# A sharded ledger is a directory holding one text ledger per month, named
+# like 2024-03.txt, each with its own rollup cube.
+SHARD_SUFFIX = '.txt'
+
+
+def is_sharded(filename):
+    return filename.endswith(('/', os.sep)) or os.path.isdir(filename)
+
+
+def shard_month(name):
+    # 2024-03.txt -> 2024 * 12 + 2, or None for other files.
+    stem = name[:-len(SHARD_SUFFIX)]
+    if not name.endswith(SHARD_SUFFIX) or len(stem) != 7 or stem[4] != '-' or not (stem[:4] + stem[5:]).isdigit():
+        return None
+    return int(stem[:4]) * 12 + int(stem[5:]) - 1
+
+
+def shard_name(month):
+    return f"{month // 12:04d}-{month % 12 + 1:02d}{SHARD_SUFFIX}"
+
+
+def shard_files(directory):
+    # The shard files of a sharded ledger, oldest month first.
+    months = sorted(month for month in map(shard_month, os.listdir(directory)) if month is not None)
+    return [os.path.join(directory, shard_name(month)) for month in months]
+
+
+def merge_cell(cells, key, cell):
+    # Fold a [total, count, min, max] cell into cells[key].
+    mine = cells.get(key)
+    if mine is None:
+        cells[key] = list(cell)
+        return
+    mine[0] += cell[0]
+    mine[1] += cell[1]
+    mine[2] = min(mine[2], cell[2])
+    mine[3] = max(mine[3], cell[3])
+
+
+class ShardedStorage:
+    # A directory of monthly text ledgers (see shard_files) with one journal,
+    # <directory>/ledger.journal, for all of them. write_changed rewrites just
+    # the shards of the days the manager changed; write_all rewrites them all.
+    # Appends go to the end of their shard's file.
+    #
+    # Each shard's cube is its summary: load_cube merges them, so totals of
+    # the whole ledger need no records, and read_range reads just the shards
+    # covering a span of days. A shard is read at most once, so a lazily
+    # loaded ledger can be read piecewise; read() returns the shards not
+    # read yet. Rows come back sorted by date within each shard, and the
+    # shards in order.
+    #
+    # The ledger's next serial number is kept in <directory>/ledger.serial,
+    # since the shard holding the newest record may be gone.
+    cube_order = 'date'
+
+    def __init__(self, directory, journal=False, fsync_every=None, compact_every=10000):
+        self.filename = directory
+        self.journal_enabled = journal
+        self.compact_every = compact_every
+        self.journal = ExpenseJournal(os.path.join(directory, 'ledger'), fsync_every)
+        self.journal.recover()
+        paths = shard_files(directory) if os.path.isdir(directory) else []
+        self.shards = {shard_month(os.path.basename(path)): TextStorage(path) for path in paths}
+        self.unread = set(self.shards)
+        # Shards whose file changed since their cube was saved.
+        self.stale_cubes = set()
+        self.dates = {}
+
+    def parse(self, date):
+        parsed = self.dates.get(date)
+        if parsed is None:
+            parsed = self.dates[date] = parse_date(date)
+        return parsed
+
+    def month_of(self, date):
+        parsed = self.parse(date)
+        return parsed.year * 12 + parsed.month - 1
+
+    def month_of_ordinal(self, ordinal):
+        day = datetime.date.fromordinal(ordinal)
+        return day.year * 12 + day.month - 1
+
+    def shard(self, month):
+        storage = self.shards.get(month)
+        if storage is None:
+            storage = self.shards[month] = TextStorage(os.path.join(self.filename, shard_name(month)))
+        return storage
+
+    def paths(self):
+        # Every file the ledger may have written.
+        if not os.path.isdir(self.filename):
+            return []
+        return [os.path.join(self.filename, name) for name in os.listdir(self.filename)]
+
+    def read(self, report=None):
+        if not os.path.isdir(self.filename):
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), self.filename)
+        return self.read_shards(sorted(self.unread), report)
+
+    def read_range(self, start=None, end=None, report=None):
+        # The unread shards overlapping the days start..end (ordinals,
+        # inclusive; None for open ends).
+        first = -1 if start is None else self.month_of_ordinal(start)
+        last = math.inf if end is None else self.month_of_ordinal(end)
+        return self.read_shards(sorted(month for month in self.unread if first <= month <= last), report)
+
+    def read_shards(self, months, report):
+        for month in months:
+            if month not in self.unread:
+                continue
+            columns = ([], [], [], [], [], [])
+            for batch in iter_ledger_columns(self.shards[month].filename, report):
+                for column, values in zip(columns, batch):
+                    column.extend(values)
+            parsed = columns[2]
+            if any(map(operator.gt, parsed, parsed[1:])):
+                # Appended out of date order; sorted (stably) here so the rows
+                # match the cube's date order.
+                order = sorted(range(len(parsed)), key=parsed.__getitem__)
+                columns = tuple([column[row] for row in order] for column in columns)
+            self.unread.discard(month)
+            yield columns
+
+    def replay(self):
+        return self.journal.replay()
+
+    def open_journal(self):
+        os.makedirs(self.filename, exist_ok=True)
+        return self.journal
+
+    def record(self, op, expense, renumber=False):
+        # Without a journal the caller rewrites the shards it changed.
+        if not self.journal_enabled:
+            return False
+        self.open_journal().append(op, expense)
+        return not (self.compact_every and self.journal.records >= self.compact_every)
+
+    def record_many(self, op, expenses):
+        if self.journal_enabled:
+            self.open_journal().append_many(op, expenses)
+            return not (self.compact_every and self.journal.records >= self.compact_every)
+        if op != 'A' or self.unread:
+            return False
+        groups = {}
+        for expense in expenses:
+            groups.setdefault(self.month_of(expense['date']), []).append(expense)
+        os.makedirs(self.filename, exist_ok=True)
+        for month, group in groups.items():
+            self.shard(month).append_file(group)
+            self.stale_cubes.add(month)
+        return True
+
+    def write_all(self, expenses):
+        groups = {}
+        for expense in expenses:
+            if expense is not None:
+                groups.setdefault(self.month_of(expense['date']), []).append(expense)
+        os.makedirs(self.filename, exist_ok=True)
+        files = {self.remove_shard(month): None for month in self.shards.keys() - groups.keys()}
+        for month, group in groups.items():
+            group.sort(key=lambda expense: self.parse(expense['date']))
+            files.update(self.write_shard(month, group))
+        self.written(files)
+
+    def write_changed(self, days, records_between):
+        # Rewrite only the shards holding the given days (ordinals), taking
+        # each one's records, in date order, from records_between(first, last).
+        os.makedirs(self.filename, exist_ok=True)
+        files = {}
+        for month in {self.month_of_ordinal(day) for day in days}:
+            group = records_between(*month_bounds(month // 12, month % 12 + 1))
+            if group:
+                files.update(self.write_shard(month, group))
+            elif month in self.shards:
+                files[self.remove_shard(month)] = None
+        self.written(files)
+
+    def write_shard(self, month, group):
+        storage = self.shard(month)
+        storage.write_file(group, storage.filename + '.tmp')
+        self.unread.discard(month)
+        self.stale_cubes.add(month)
+        return {storage.filename: storage.filename + '.tmp'}
+
+    def written(self, files):
+        # Move the new shard files into place; the shards then hold every
+        # record, so the journal is spent.
+        self.journal.compact(files, keep=self.journal_enabled)
+
+    def remove_shard(self, month):
+        # Forget a shard and drop its cube; returns its file, which the
+        # caller removes along with the journal's compaction.
+        storage = self.shards.pop(month)
+        self.unread.discard(month)
+        if os.path.exists(storage.filename + '.cube'):
+            os.remove(storage.filename + '.cube')
+        self.stale_cubes.discard(month)
+        return storage.filename
+
+    def load_cube(self):
+        # The shards' cubes merged into one for the whole ledger, or None if
+        # any of them is missing or stale.
+        if not os.path.isdir(self.filename):
+            return None
+        cube, complete = {}, True
+        for month in sorted(self.shards):
+            cells = self.shards[month].load_cube()
+            if cells is None:
+                self.stale_cubes.add(month)
+                complete = False
+                continue
+            for (key, category), cell in cells.items():
+                if key[0] in ('day', 'month'):
+                    cube[(key, category)] = cell
+                else:
+                    merge_cell(cube, (key, category), cell)
+        return cube if complete else None
+
+    def next_serial(self):
+        try:
+            with open(os.path.join(self.filename, 'ledger.serial')) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return 0
+
+    def save_cube(self, cells, next_serial=0):
+        # Split the ledger's cube into the cubes of the shards written since
+        # their last one. A shard's year and whole-ledger cells are its month.
+        # The serial number goes first: a current cube implies a current one.
+        if next_serial > self.next_serial() and os.path.isdir(self.filename):
+            filename = os.path.join(self.filename, 'ledger.serial')
+            with open(filename + '.tmp', 'w') as f:
+                f.write(str(next_serial))
+            os.replace(filename + '.tmp', filename)
+        if not self.stale_cubes:
+            return
+        shard_cells = {month: {} for month in self.stale_cubes}
+        for (key, category), cell in cells.items():
+            if key[0] == 'day':
+                month = self.month_of_ordinal(key[1])
+            elif key[0] == 'month':
+                month = key[1] * 12 + key[2] - 1
+            else:
+                continue
+            target = shard_cells.get(month)
+            if target is not None:
+                target[(key, category)] = cell
+        for month, target in shard_cells.items():
+            for (key, category), cell in list(target.items()):
+                if key[0] == 'month':
+                    target[(('year', key[1]), category)] = cell
+                    target[(('all',), category)] = cell
+            if month in self.shards:
+                self.shards[month].save_cube(target, next_serial)
+        self.stale_cubes.clear()
+
+    def flush(self):
+        self.journal.sync()
+
+    def close(self):
+        self.journal.close()
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS expenses (
+    serial_number INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    ordinal INTEGER NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    amount REAL NOT NULL,
+    comment TEXT
+);
+CREATE TABLE IF NOT EXISTS ledger_meta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+SQLITE_INDEXES = {
+    'expenses_by_date': 'CREATE INDEX IF NOT EXISTS expenses_by_date ON expenses (ordinal)',
+    'expenses_by_category': 'CREATE INDEX IF NOT EXISTS expenses_by_category ON expenses (category, ordinal)',
+}
+# Inserting this many rows, or at least a fifth of the table, goes faster by
+# dropping the indexes and building them again afterwards.
+SQLITE_REINDEX_ROWS = 10000
+
+
+class SQLiteStorage:
+    # A SQLite database in WAL mode. Each mutation is its own transaction,
+    # and load_cube computes the rollup cube with one GROUP BY, so a lazily
+    # loaded ledger's totals need no rows read into Python. Deletes raise
+    # the next serial number kept in ledger_meta past the deleted ones.
+    cube_order = None
+
+    def __init__(self, filename, **options):
+        # Imported here so text and snapshot ledgers don't pay for it.
+        import sqlite3
+        self.filename = filename
+        # Callers may hand the storage to a worker thread (see service.py);
+        # they are responsible for using it from one thread at a time.
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SQLITE_SCHEMA)
+        self.create_indexes()
+        self.dates = {}
+
+    def drop_indexes(self):
+        for name in SQLITE_INDEXES:
+            self.connection.execute(f'DROP INDEX IF EXISTS {name}')
+
+    def create_indexes(self):
+        for statement in SQLITE_INDEXES.values():
+            self.connection.execute(statement)
+
+    def row(self, serial_number, date, category, amount, comment):
+        parsed = self.dates.get(date)
+        if parsed is None:
+            parsed = self.dates[date] = parse_date(date)
+        return serial_number, date, parsed.toordinal(), parsed.year, parsed.month, category, amount, comment or ''
+
+    def read(self, report=None, batch_size=1 << 16):
+        cursor = self.connection.execute('SELECT serial_number, date, category, amount, comment FROM expenses ORDER BY serial_number')
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            serials, dates, categories, amounts, comments = map(list, zip(*rows))
+            parsed = [self.dates[date] if date in self.dates else self.dates.setdefault(date, parse_date(date)) for date in dates]
+            if report is not None:
+                report.loaded += len(rows)
+            yield serials, dates, parsed, categories, amounts, comments
+
+    def replay(self):
+        return iter(())
+
+    def load_cube(self):
+        # The cube of the rows in the database, never stale, so there is no
+        # cube file. The days are summed by SQLite and rolled up here; each
+        # period lists its categories in order of first appearance by serial
+        # number, as reading the rows back would. A plain scan of the table
+        # beats walking it through the category index.
+        cells = {}
+        rows = self.connection.execute('SELECT ordinal, year, month, category, SUM(amount), COUNT(*), MIN(amount), MAX(amount) FROM expenses NOT INDEXED '
+                                       'GROUP BY ordinal, category ORDER BY MIN(serial_number)')
+        for ordinal, year, month, category, amount, count, low, high in rows:
+            cell = (amount, count, low, high)
+            for key in (('day', ordinal), ('month', year, month), ('year', year), ('all',)):
+                merge_cell(cells, (key, None), cell)
+                merge_cell(cells, (key, category), cell)
+        return cells
+
+    def save_cube(self, cells, next_serial=0):
+        pass
+
+    def next_serial(self):
+        row = self.connection.execute("SELECT MAX(COALESCE((SELECT value FROM ledger_meta WHERE name = 'next_serial'), 0), "
+                                      "COALESCE((SELECT MAX(serial_number) FROM expenses), 0) + 1)").fetchone()
+        return row[0]
+
+    def raise_next_serial(self, next_serial):
+        self.connection.execute("INSERT INTO ledger_meta VALUES ('next_serial', ?) ON CONFLICT (name) DO UPDATE SET value = MAX(value, excluded.value)", (next_serial,))
+
+    def record(self, op, expense, renumber=False):
+        if renumber:
+            return False
+        with self.connection:
+            if op == 'A':
+                self.connection.execute('INSERT INTO expenses VALUES (?, ?, ?, ?, ?, ?, ?, ?)', self.expense_row(expense))
+            elif op == 'E':
+                row = self.expense_row(expense)
+                self.connection.execute('UPDATE expenses SET date = ?, ordinal = ?, year = ?, month = ?, category = ?, amount = ?, comment = ? WHERE serial_number = ?', row[1:] + row[:1])
+            else:
+                self.connection.execute('DELETE FROM expenses WHERE serial_number = ?', (expense['serial_number'],))
+                self.raise_next_serial(expense['serial_number'] + 1)
+        return True
+
+    def record_many(self, op, expenses):
+        with self.connection:
+            if op == 'A':
+                reindex = len(expenses) >= SQLITE_REINDEX_ROWS and len(expenses) * 5 >= self.connection.execute('SELECT COALESCE(MAX(serial_number), 0) FROM expenses').fetchone()[0]
+                if reindex:
+                    self.drop_indexes()
+                self.connection.executemany('INSERT INTO expenses VALUES (?, ?, ?, ?, ?, ?, ?, ?)', map(self.expense_row, expenses))
+                if reindex:
+                    self.create_indexes()
+            elif op == 'E':
+                self.connection.executemany('UPDATE expenses SET date = ?, ordinal = ?, year = ?, month = ?, category = ?, amount = ?, comment = ? WHERE serial_number = ?',
+                                            (row[1:] + row[:1] for row in map(self.expense_row, expenses)))
+            else:
+                self.connection.executemany('DELETE FROM expenses WHERE serial_number = ?', ((expense['serial_number'],) for expense in expenses))
+                self.raise_next_serial(max(expense['serial_number'] for expense in expenses) + 1)
+        return True
+
+    def expense_row(self, expense):
+        return self.row(expense['serial_number'], expense['date'], expense['category'], expense['amount'], expense.get('comment'))
+
+    def write_all(self, expenses):
+        with self.connection:
+            self.connection.execute('DELETE FROM expenses')
+            self.drop_indexes()
+            self.connection.executemany('INSERT INTO expenses VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (self.expense_row(expense) for expense in expenses if expense is not None))
+            self.create_indexes()
+
+    def import_columns(self, batches, replace=False):
+        # Bulk import of iter_ledger_columns style batches in one transaction.
+        with self.connection:
+            if replace:
+                self.connection.execute('DELETE FROM expenses')
+                self.drop_indexes()
+            for serials, dates, parsed, categories, amounts, comments in batches:
+                self.connection.executemany('INSERT INTO expenses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                            [(serial_number, date, day.toordinal(), day.year, day.month, category, amount, comment)
+                                             for serial_number, date, day, category, amount, comment in zip(serials, dates, parsed, categories, amounts, comments)])
+            self.create_indexes()
+
+    def flush(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+
+
+def open_storage(filename, **options):
+    # Pick the backend from the file extension; a directory (or a path
+    # ending in a separator) is a sharded ledger.
+    if is_sharded(filename):
+        return ShardedStorage(filename, **options)
+    if filename.endswith(SQLITE_EXTENSIONS):
+        return SQLiteStorage(filename, **options)
+    if filename.endswith(SNAPSHOT_EXTENSION):
+        return SnapshotStorage(filename, **options)
+    return TextStorage(filename, **options)
+
+
+def migrate(source, target, report=None):
+    # Copy a ledger between formats, e.g. expense.txt -> expense.db.
+    reader, writer = open_storage(source), open_storage(target)
+    journal = getattr(reader, 'journal', None)
+    if journal is not None and os.path.exists(journal.filename) and os.path.getsize(journal.filename):
+        print(f"Warning: {journal.filename} has changes not yet compacted into {source}; they will not be migrated.")
+    try:
+        if isinstance(writer, SQLiteStorage):
+            writer.import_columns(reader.read(report), replace=True)
+        else:
+            writer.write_all({"serial_number": serial_number, "date": date, "category": category, "amount": amount, "comment": comment}
+                             for columns in reader.read(report)
+                             for serial_number, date, parsed, category, amount, comment in zip(*columns))
+    finally:
+        reader.close()
+        writer.close()
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Convert a SpendWise ledger between text, binary snapshot (.swb), SQLite (.db) and sharded (directory/) formats.")
+    parser.add_argument('source')
+    parser.add_argument('target')
+    args = parser.parse_args()
+    report = LoadReport()
+    migrate(args.source, args.target, report)
+    print(report.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spendwise import ExpenseManager
+
+# Cached query results never go stale: an edit or delete evicts the entries
+# covering the days it touched, and only those, so the cached manager answers
+# as an uncached one fed the same mutations does.
+
+SPANS = (('01-03-2024', '31-03-2024'), ('01-04-2024', '30-04-2024'), ('15-03-2024', '15-04-2024'), (None, '10-03-2024'), ('20-04-2024', None))
+
+
+class QueryCacheInvalidationTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        output = contextlib.redirect_stdout(io.StringIO())
+        output.__enter__()
+        self.addCleanup(output.__exit__, None, None, None)
+
+    def managers(self, stable_ids):
+        managers = []
+        for name, cache_size in (('cached.txt', 64), ('plain.txt', None)):
+            manager = ExpenseManager(stable_ids=stable_ids, cache_size=cache_size)
+            manager.filename = os.path.join(self.directory.name, f"{stable_ids}-{name}")
+            for day in range(1, 31):
+                manager.add_expense(('food', 'rent')[day % 2], float(day), f"{day:02d}-0{3 + day % 2}-2024")
+            managers.append(manager)
+        return managers
+
+    def warm(self, cached):
+        for start, end in SPANS:
+            cached.query(start, end)
+            cached.query(start, end, 'food')
+            cached.rollup(start, end)
+
+    def check(self, cached, plain):
+        for start, end in SPANS:
+            self.assertEqual(cached.query(start, end), plain.query(start, end))
+            self.assertEqual(cached.query(start, end, 'food'), plain.query(start, end, 'food'))
+            self.assertEqual(cached.rollup(start, end), plain.rollup(start, end))
+
+    def test_edits_evict_only_the_days_they_touch(self):
+        cached, plain = self.managers(stable_ids=True)
+        self.warm(cached)
+        entries = cached.cache.stats()['entries']
+        # 05-04-2024 is in the April and mid-March to mid-April entries.
+        for manager in (cached, plain):
+            manager.edit_expense(5, new_amount=50.0)
+        self.assertEqual(cached.cache.stats()['invalidations'], 6)
+        self.assertEqual(cached.cache.stats()['entries'], entries - 6)
+        self.check(cached, plain)
+        # Moving a record from 02-03-2024 to 25-04-2024 touches both days.
+        self.warm(cached)
+        invalidations = cached.cache.stats()['invalidations']
+        for manager in (cached, plain):
+            manager.edit_expense(2, new_category='food', new_date='25-04-2024')
+        self.assertEqual(cached.cache.stats()['invalidations'] - invalidations, 12)
+        self.check(cached, plain)
+
+    def test_deletes_evict_the_days_they_touch(self):
+        cached, plain = self.managers(stable_ids=True)
+        self.warm(cached)
+        hits = cached.cache.stats()['hits']
+        # 20-03-2024 is in the March and mid-March to mid-April entries.
+        for manager in (cached, plain):
+            manager.delete_expense(20)
+        self.assertEqual(cached.cache.stats()['invalidations'], 6)
+        self.check(cached, plain)
+        # The entries for the other three spans were still good.
+        self.assertEqual(cached.cache.stats()['hits'] - hits, 9)
+
+    def test_renumbering_delete_clears_the_cache(self):
+        cached, plain = self.managers(stable_ids=False)
+        self.warm(cached)
+        for manager in (cached, plain):
+            manager.delete_expense(20)
+        self.assertEqual(cached.cache.stats()['entries'], 0)
+        self.check(cached, plain)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import datetime
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spendwise import ExpenseAggregates
+from storage import read_cube, write_cube
+
+FIRST_DAY = datetime.date(2023, 11, 1).toordinal()
+
+
+def random_aggregates(rng, rows):
+    aggregates = ExpenseAggregates()
+    for _ in range(rows):
+        day = datetime.date.fromordinal(FIRST_DAY + rng.randint(0, 120))
+        aggregates.add(day.toordinal(), day.year, day.month, rng.choice('abcd'), round(rng.uniform(1, 100), 2))
+    return aggregates
+
+
+class SavedCubeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.filename = os.path.join(self.directory.name, 'ledger.cube')
+
+    def test_periods_match_the_cells_saved(self):
+        rng = random.Random(5)
+        cells = random_aggregates(rng, 400).cells()
+        write_cube(self.filename, cells, (1, 2))
+        self.assertIsNone(read_cube(self.filename, (1, 3)))
+        cube = read_cube(self.filename, (1, 2))
+        self.assertEqual(dict(cube.items()), cells)
+        for key in {key for key, category in cells}:
+            total, categories = cube.period(key)
+            self.assertEqual(total, cells[(key, None)])
+            # In the order the categories were saved in.
+            self.assertEqual(list(categories.items()), [(category, cell) for (period, category), cell in cells.items() if period == key and category is not None])
+        self.assertIsNone(cube.period(('day', FIRST_DAY - 1)))
+        self.assertIsNone(cube.period(('year', 2030)))
+
+    def test_aggregates_read_periods_as_used(self):
+        rng = random.Random(6)
+        aggregates = random_aggregates(rng, 300)
+        write_cube(self.filename, aggregates.cells(), (1, 2))
+        lazy = ExpenseAggregates()
+        lazy.load_cells(read_cube(self.filename, (1, 2)))
+        self.assertEqual(lazy.total(('month', 2024, 1)), aggregates.total(('month', 2024, 1)))
+        self.assertEqual(lazy.by_category(('year', 2023)), aggregates.by_category(('year', 2023)))
+        self.assertEqual(len(lazy.totals), 2)
+        # Adds land on top of the saved cells, also in periods not read yet.
+        for target in (aggregates, lazy):
+            target.add(FIRST_DAY + 3, 2023, 11, 'e', 7.5)
+            target.add(FIRST_DAY + 200, 2024, 5, 'a', 2.5)
+        self.assertEqual(lazy.diff(aggregates), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spendwise import ExpenseManager
+from storage import LoadReport, iter_csv_records
+
+# A CSV import adds the good records in one write and reports the rest by
+# their position after the header row.
+
+CSV = """Amount,Date,Ignored,Category,Comment
+12.5,01-02-2024,x,food,lunch
+3,02-02-2024,x,rent,
+oops,03-02-2024,x,food,bad amount
+4,31-02-2024,x,food,bad date
+5,04-02-2024,x,,no category
+6,05-02-2024,x,fun,pipe | here
+nan,06-02-2024,x,food,not finite
+7.25,,x,food
+8,07-02-2024,x,fun,last
+"""
+
+
+class CsvImportTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.output = io.StringIO()
+        output = contextlib.redirect_stdout(self.output)
+        output.__enter__()
+        self.addCleanup(output.__exit__, None, None, None)
+        self.csv = os.path.join(self.directory.name, 'export.csv')
+        with open(self.csv, 'w', newline='') as f:
+            f.write(CSV)
+
+    def manager(self, name):
+        manager = ExpenseManager(stable_ids=True)
+        path = os.path.join(self.directory.name, name)
+        if os.path.exists(path):
+            manager.load_expenses(path)
+        else:
+            manager.filename = path
+        self.addCleanup(manager.ledger_storage().close)
+        return manager
+
+    def test_malformed_rows_are_reported(self):
+        manager = self.manager('ledger.txt')
+        manager.add_expense('food', 1.0, '01-01-2024')
+        report = LoadReport()
+        self.assertEqual(manager.add_expenses_bulk(iter_csv_records(self.csv), report), 4)
+        self.assertEqual(report.loaded, 4)
+        self.assertEqual(report.malformed, 5)
+        self.assertEqual([(number, reason) for number, reason, record in report.samples],
+                         [(3, 'bad amount'), (4, 'bad date'), (5, 'bad category'), (6, 'bad comment'), (7, 'bad amount')])
+        self.assertEqual(report.samples[0][2]['amount'], 'oops')
+
+    def test_imported_records_are_saved(self):
+        for ledger in ('ledger.txt', 'ledger.db', 'shards/'):
+            with self.subTest(ledger=ledger):
+                manager = self.manager(ledger)
+                manager.add_expense('food', 1.0, '01-01-2024')
+                self.assertEqual(manager.import_expenses(self.csv), 4)
+                self.assertIn("Loaded 4 expenses, skipped 5 malformed lines.", self.output.getvalue())
+                manager.ledger_storage().close()
+                reloaded = self.manager(ledger)
+                self.assertEqual(sorted((expense['serial_number'], expense['category'], expense['amount'], expense['comment'] or '')
+                                        for expense in reloaded.expenses if expense is not None),
+                                 [(1, 'food', 1.0, ''), (2, 'food', 12.5, 'lunch'), (3, 'rent', 3.0, ''), (4, 'food', 7.25, ''), (5, 'fun', 8.0, 'last')])
+                # The record without a date was dated today, outside February.
+                self.assertEqual(reloaded.aggregates.total(('month', 2024, 2)), 23.5)
+                self.assertEqual(reloaded.aggregates.cells(), manager.aggregates.cells())
+
+
+if __name__ == '__main__':
+    unittest.main()
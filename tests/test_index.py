@@ -0,0 +1,167 @@
+import contextlib
+import datetime
+import io
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spendwise import DateIndex, ExpenseManager
+
+# Differential tests of the date and category indexes: random adds, edits
+# and deletes whose dates cross month and year boundaries, checked after
+# every step against the list scans the manager used before it had indexes.
+
+FIRST_DAY = datetime.date(2023, 11, 25)
+CATEGORIES = ('food', 'travel', 'rent', 'fun')
+
+
+def day_string(offset):
+    return (FIRST_DAY + datetime.timedelta(days=offset)).strftime('%d-%m-%Y')
+
+
+def ordinal_of(date):
+    return datetime.datetime.strptime(date, '%d-%m-%Y').toordinal()
+
+
+class ListLedger:
+    # The original ExpenseManager's records: a list of dicts, searched by
+    # scanning. Without stable IDs a delete renumbers the records 1..n; with
+    # them, a record whose date or category changes is re-added at the end,
+    # as ExpenseManager does.
+    def __init__(self, stable_ids):
+        self.expenses = []
+        self.stable_ids = stable_ids
+        self.counter = 1
+
+    def add(self, category, amount, date, comment):
+        serial_number = self.counter if self.stable_ids else len(self.expenses) + 1
+        self.counter = serial_number + 1
+        self.expenses.append({"serial_number": serial_number, "date": date, "category": category, "amount": amount, "comment": comment})
+
+    def find(self, serial_number):
+        return next(idx for idx, expense in enumerate(self.expenses) if expense['serial_number'] == serial_number)
+
+    def edit(self, serial_number, category=None, amount=None, date=None):
+        idx = self.find(serial_number)
+        expense = self.expenses[idx]
+        moved = (category and category != expense['category']) or (date and date != expense['date'])
+        if category:
+            expense['category'] = category
+        if amount is not None:
+            expense['amount'] = amount
+        if date:
+            expense['date'] = date
+        if self.stable_ids and moved:
+            self.expenses.append(self.expenses.pop(idx))
+
+    def delete(self, serial_number):
+        del self.expenses[self.find(serial_number)]
+        if not self.stable_ids:
+            for idx, expense in enumerate(self.expenses, start=1):
+                expense['serial_number'] = idx
+
+    def query(self, start, end, categories=None):
+        found = [expense for expense in self.expenses
+                 if start <= ordinal_of(expense['date']) <= end and (categories is None or expense['category'] in categories)]
+        return sorted(found, key=lambda expense: ordinal_of(expense['date']))
+
+    def totals(self, start, end):
+        totals = {}
+        for expense in self.query(start, end):
+            totals[expense['category']] = totals.get(expense['category'], 0) + expense['amount']
+        return totals
+
+
+class IndexDifferentialTest(unittest.TestCase):
+    def run_steps(self, seed, stable_ids, steps=300):
+        rng = random.Random(seed)
+        reference = ListLedger(stable_ids)
+        with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+            manager = ExpenseManager(stable_ids=stable_ids)
+            manager.filename = os.path.join(directory, 'ledger.txt')
+            for step in range(steps):
+                serials = [expense['serial_number'] for expense in reference.expenses]
+                action = rng.random()
+                if action < 0.45 or not serials:
+                    # Dates are random, so most adds are backdated.
+                    args = (rng.choice(CATEGORIES), float(rng.randint(1, 9999)) / 100, day_string(rng.randint(0, 80)), f"note {step}")
+                    manager.add_expense(*args)
+                    reference.add(*args)
+                elif action < 0.75:
+                    serial_number = rng.choice(serials)
+                    change = rng.choice(('date', 'category', 'amount', 'all'))
+                    category = rng.choice(CATEGORIES) if change in ('category', 'all') else None
+                    amount = float(rng.randint(1, 9999)) / 100 if change in ('amount', 'all') else None
+                    date = day_string(rng.randint(0, 80)) if change in ('date', 'all') else None
+                    manager.edit_expense(serial_number, category, amount, date)
+                    reference.edit(serial_number, category, amount, date)
+                else:
+                    serial_number = rng.choice(serials)
+                    manager.delete_expense(serial_number)
+                    reference.delete(serial_number)
+                self.check(manager, reference, rng)
+
+    def check(self, manager, reference, rng):
+        first, last = FIRST_DAY.toordinal(), FIRST_DAY.toordinal() + 80
+        spans = [(first, last), (datetime.date(2023, 12, 1).toordinal(), datetime.date(2023, 12, 31).toordinal()),
+                 (datetime.date(2023, 12, 31).toordinal(), datetime.date(2024, 1, 1).toordinal())]
+        start = rng.randint(first, last)
+        spans.append((start, rng.randint(start, last)))
+        for start, end in spans:
+            days = datetime.date.fromordinal(start), datetime.date.fromordinal(end)
+            self.assertEqual(manager.query(*days), reference.query(start, end))
+            categories = rng.sample(CATEGORIES, 2)
+            self.assertEqual(manager.query(*days, categories), reference.query(start, end, categories))
+            totals = {category: stats['total'] for category, stats in manager.rollup(*days).items() if stats['count']}
+            expected = reference.totals(start, end)
+            self.assertEqual(totals.keys(), expected.keys())
+            for category, total in expected.items():
+                self.assertAlmostEqual(totals[category], total, places=6)
+
+    def test_positional_serials_match_list_scans(self):
+        for seed in range(3):
+            self.run_steps(seed, stable_ids=False)
+
+    def test_stable_serials_match_list_scans(self):
+        for seed in range(3):
+            self.run_steps(seed, stable_ids=True)
+
+
+class DateIndexTest(unittest.TestCase):
+    def test_out_of_order_inserts_and_removes(self):
+        rng = random.Random(7)
+        index = DateIndex()
+        ordinals = [rng.randint(0, 50) for _ in range(200)]
+        index.extend(ordinals, range(200))
+        entries = sorted(zip(ordinals, range(200)))
+        self.assertEqual(index.pairs(None, None), entries)
+        next_row = 200
+        for step in range(2000):
+            if rng.random() < 0.5 or not entries:
+                ordinal = rng.randint(0, 60)
+                # Mostly new rows at the end, sometimes an earlier row number,
+                # as an edit that changes a record's date re-inserts it.
+                row = next_row if rng.random() < 0.7 else rng.randint(0, next_row)
+                if (ordinal, row) in entries:
+                    continue
+                next_row += row == next_row
+                index.insert(ordinal, row)
+                entries.append((ordinal, row))
+            else:
+                ordinal, row = entries.pop(rng.randrange(len(entries)))
+                index.remove(ordinal, row)
+            entries.sort()
+            self.assertEqual(len(index), len(entries))
+            start = rng.randint(0, 60)
+            end = rng.randint(start, 60)
+            expected = [pair for pair in entries if start <= pair[0] <= end]
+            self.assertEqual(index.pairs(start, end), expected)
+            self.assertEqual(list(index.range(start, end)), [row for ordinal, row in expected])
+
+
+if __name__ == '__main__':
+    unittest.main()
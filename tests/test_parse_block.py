@@ -0,0 +1,37 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import LoadReport, parse_block
+
+
+class ParseBlockTest(unittest.TestCase):
+    def test_well_formed_block(self):
+        report = LoadReport()
+        columns = parse_block('1|01-01-2024|food|10.0|a\n2|02-01-2024|rent|5.5|', 1, report, {})
+        self.assertEqual(columns[0], [1, 2])
+        self.assertEqual(columns[3], ['food', 'rent'])
+        self.assertEqual(columns[4], [10.0, 5.5])
+        self.assertEqual((report.loaded, report.malformed), (2, 0))
+
+    def test_extra_and_missing_fields_do_not_cancel_out(self):
+        # The block has the right number of separators in total, but the
+        # first line has a field too many and the second one too few.
+        report = LoadReport()
+        columns = parse_block('1|01-01-2024|food|10.0|a|5\n01-01-2024|travel|20.0|b\n3|02-01-2024|rent|5.0|c', 1, report, {})
+        self.assertEqual(columns[0], [3])
+        self.assertEqual((report.loaded, report.malformed), (1, 2))
+        self.assertEqual([line_number for line_number, reason, line in report.samples], [1, 2])
+
+    def test_lines_are_stripped_on_both_paths(self):
+        # Trailing blanks and a carriage return stay out of the comments,
+        # whether the block takes the fast path or falls back line by line.
+        for text in ('1|01-01-2024|food|10.0|a  \r\n2|02-01-2024|rent|5.5|b\t', '1|01-01-2024|food|10.0|a  \r\n2|02-01-2024|rent|5.5|b\t\nbad line'):
+            columns = parse_block(text, 1, LoadReport(), {})
+            self.assertEqual(columns[5], ['a', 'b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spendwise import ExpenseManager
+
+# With stable IDs a deleted serial number stays retired, including after a
+# reload when it was the newest one, in every backend and loading mode.
+
+LEDGERS = ('ledger.txt', 'ledger.swb', 'ledger.db', 'shards/')
+
+
+class SerialReuseTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        output = contextlib.redirect_stdout(io.StringIO())
+        output.__enter__()
+        self.addCleanup(output.__exit__, None, None, None)
+
+    def manager(self, path, journal, lazy):
+        manager = ExpenseManager(journal=journal, stable_ids=True, lazy=lazy, compact_every=None)
+        if os.path.exists(path):
+            manager.load_expenses(path)
+        else:
+            manager.filename = path
+        self.addCleanup(manager.ledger_storage().close)
+        return manager
+
+    def test_deleted_serials_are_not_reused_after_reload(self):
+        for ledger in LEDGERS:
+            for journal in (False, True):
+                for lazy in (False, True):
+                    with self.subTest(ledger=ledger, journal=journal, lazy=lazy):
+                        path = os.path.join(self.directory.name, f"{journal}-{lazy}-{ledger}")
+                        manager = self.manager(path, journal, lazy)
+                        for day in range(1, 4):
+                            manager.add_expense('food', float(day), f"0{day}-05-2024")
+                        manager.compact()
+                        manager.delete_expense(3)
+                        manager.ledger_storage().close()
+                        manager = self.manager(path, journal, lazy)
+                        manager.add_expense('rent', 9.0, '04-05-2024')
+                        manager.ensure_loaded()
+                        self.assertEqual(sorted(expense['serial_number'] for expense in manager.expenses if expense is not None), [1, 2, 4])
+                        # And still after the delete has been compacted away.
+                        manager.delete_expense(4)
+                        manager.compact()
+                        manager.ledger_storage().close()
+                        manager = self.manager(path, journal, lazy)
+                        manager.add_expense('rent', 9.0, '04-05-2024')
+                        manager.ensure_loaded()
+                        self.assertEqual(sorted(expense['serial_number'] for expense in manager.expenses if expense is not None), [1, 2, 5])
+
+
+if __name__ == '__main__':
+    unittest.main()
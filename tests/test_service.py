@@ -0,0 +1,77 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from service import ExpenseService
+from spendwise import ExpenseManager
+
+# Queries must not wait for a group commit: the commit below blocks on the
+# executor thread, like a slow disk, until the queries have been answered.
+
+
+class CommitConcurrencyTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        output = contextlib.redirect_stdout(io.StringIO())
+        output.__enter__()
+        self.addCleanup(output.__exit__, None, None, None)
+        self.filename = os.path.join(directory.name, 'ledger.txt')
+        manager = ExpenseManager(stable_ids=True, cache_size=16)
+        manager.filename = self.filename
+        for day in range(1, 11):
+            manager.add_expense('food', float(day), f"{day:02d}-03-2024")
+        manager.ledger_storage().close()
+
+    def test_queries_finish_while_a_commit_is_written(self):
+        manager = ExpenseManager(stable_ids=True, cache_size=16)
+        manager.load_expenses(self.filename)
+        service = ExpenseService(manager)
+        self.addCleanup(service.executor.shutdown)
+        self.addCleanup(manager.ledger_storage().close)
+        writing, release = threading.Event(), threading.Event()
+        commit = service.commit
+
+        def slow_commit(batch):
+            writing.set()
+            release.wait(5)
+            commit(batch)
+
+        service.commit = slow_commit
+
+        async def run():
+            writer = asyncio.create_task(service.writer())
+            post = asyncio.create_task(service.dispatch('POST', '/expenses', json.dumps({"category": "rent", "amount": 5, "date": "15-03-2024"})))
+            await asyncio.get_running_loop().run_in_executor(None, writing.wait, 5)
+            self.assertTrue(writing.is_set())
+            # A second change waits for the commit without holding back queries.
+            patch = asyncio.create_task(service.dispatch('PATCH', '/expenses/2', json.dumps({"amount": 9})))
+            await asyncio.sleep(0)
+            status, totals = await asyncio.wait_for(service.dispatch('GET', '/totals?year=2024&month=3', b''), 1)
+            self.assertEqual(totals['total'], 60.0)
+            status, found = await asyncio.wait_for(service.dispatch('GET', '/expenses?start=01-03-2024&end=31-03-2024', b''), 1)
+            self.assertEqual(len(found['expenses']), 11)
+            self.assertFalse(post.done())
+            release.set()
+            status, added = await asyncio.wait_for(post, 5)
+            self.assertEqual(added['expense']['serial_number'], 11)
+            await asyncio.wait_for(patch, 5)
+            writer.cancel()
+
+        asyncio.run(run())
+        manager.ledger_storage().close()
+        reloaded = ExpenseManager(stable_ids=True)
+        reloaded.load_expenses(self.filename)
+        self.assertEqual(reloaded.aggregates.total(('month', 2024, 3)), 67.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spendwise import ExpenseManager
+from storage import ShardedStorage, shard_files
+
+# A sharded ledger keeps each month in its own file with its own cube. A
+# change rewrites only the shards of the months it touched, and a shard whose
+# file no longer matches its cube is read again instead of trusted.
+
+
+def records(manager):
+    return sorted((expense['serial_number'], expense['date'], expense['category'], expense['amount'])
+                  for expense in manager.expenses if expense is not None)
+
+
+class ShardedLedgerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        output = contextlib.redirect_stdout(io.StringIO())
+        output.__enter__()
+        self.addCleanup(output.__exit__, None, None, None)
+        self.path = os.path.join(self.directory.name, 'shards') + os.sep
+        manager = self.manager()
+        for day in range(1, 31):
+            manager.add_expense(('food', 'rent', 'fun')[day % 3], float(day), f"{day:02d}-0{1 + day % 3}-2024")
+        manager.ledger_storage().close()
+        self.expected = records(manager)
+
+    def manager(self, lazy=False):
+        manager = ExpenseManager(stable_ids=True, lazy=lazy)
+        if os.path.isdir(self.path):
+            manager.load_expenses(self.path)
+        else:
+            manager.filename = self.path
+        self.addCleanup(manager.ledger_storage().close)
+        return manager
+
+    def shard(self, name):
+        return os.path.join(self.path, name)
+
+    def stamps(self):
+        # The contents of every shard and cube file, by name.
+        stamps = {}
+        for name in sorted(os.listdir(self.path)):
+            with open(self.shard(name), 'rb') as f:
+                stamps[name] = f.read()
+        return stamps
+
+    def test_months_are_written_to_their_own_shards(self):
+        self.assertEqual([os.path.basename(path) for path in shard_files(self.path)], ['2024-01.txt', '2024-02.txt', '2024-03.txt'])
+        for month, path in enumerate(shard_files(self.path), start=1):
+            with open(path) as f:
+                self.assertEqual({line.split('|')[1][3:] for line in f}, {f"0{month}-2024"})
+        for lazy in (False, True):
+            manager = self.manager(lazy)
+            self.assertEqual(manager.aggregates.total(('month', 2024, 2)), sum(float(day) for day in range(1, 31) if day % 3 == 1))
+            manager.ensure_loaded()
+            self.assertEqual(records(manager), self.expected)
+
+    def test_changes_rewrite_only_their_shards(self):
+        manager = self.manager()
+        before = self.stamps()
+        manager.edit_expense(4, new_amount=40.0)
+        after = self.stamps()
+        self.assertEqual({name for name in before if before[name] != after[name]}, {'2024-02.txt', '2024-02.txt.cube'})
+        # Moving the last February record out removes its shard and cube.
+        for serial_number in [serial for serial, date, category, amount in self.expected if date.endswith('02-2024')][:-1]:
+            manager.delete_expense(serial_number)
+        manager.edit_expense(28, new_date='28-03-2024')
+        self.assertNotIn('2024-02.txt', os.listdir(self.path))
+        self.assertNotIn('2024-02.txt.cube', os.listdir(self.path))
+        manager.ledger_storage().close()
+        reloaded = self.manager()
+        self.assertEqual(records(reloaded), records(manager))
+        self.assertEqual(reloaded.aggregates.cells(), manager.aggregates.cells())
+
+    def test_stale_cube_is_not_trusted(self):
+        # A record appended to a shard behind the ledger's back.
+        with open(self.shard('2024-03.txt'), 'a') as f:
+            f.write("31|31-03-2024|food|100.0|\n")
+        storage = ShardedStorage(self.path)
+        self.assertIsNone(storage.load_cube())
+        self.assertEqual(storage.stale_cubes, {2024 * 12 + 2})
+        for lazy in (True, False):
+            manager = self.manager(lazy)
+            self.assertEqual(manager.aggregates.total(('month', 2024, 3)), 100.0 + sum(float(day) for day in range(1, 31) if day % 3 == 2))
+            manager.ensure_loaded()
+            self.assertEqual(records(manager), self.expected + [(31, '31-03-2024', 'food', 100.0)])
+            manager.ledger_storage().close()
+        # Reading the shard back brought its cube up to date.
+        self.assertIsNotNone(ShardedStorage(self.path).load_cube())
+
+    def test_lazy_add_reads_one_shard(self):
+        manager = self.manager(lazy=True)
+        manager.add_expense('food', 5.0, '15-01-2024')
+        self.assertEqual(manager.ledger_storage().unread, {2024 * 12 + 1, 2024 * 12 + 2})
+        self.assertEqual(manager.expenses[-1]['serial_number'], 31)
+        manager.ledger_storage().close()
+        reloaded = self.manager()
+        self.assertEqual(records(reloaded), self.expected + [(31, '15-01-2024', 'food', 5.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
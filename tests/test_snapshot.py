@@ -0,0 +1,37 @@
+import datetime
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import SnapshotStorage, write_snapshot
+
+FIRST_DAY = datetime.date(2024, 1, 1).toordinal()
+
+
+class SnapshotRangeTest(unittest.TestCase):
+    def test_ranges_read_each_row_once(self):
+        rng = random.Random(3)
+        ordinals = [FIRST_DAY + rng.randint(0, 90) for _ in range(500)]
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'ledger.swb')
+            write_snapshot(filename, list(range(1, 501)), ordinals, [rng.choice('abc') for _ in ordinals], [1.5] * 500, [''] * 500)
+            storage = SnapshotStorage(filename)
+            seen = []
+            for _ in range(5):
+                start = FIRST_DAY + rng.randint(0, 90)
+                end = start + rng.randint(0, 30)
+                expected = sorted(serial for serial, ordinal in zip(range(1, 501), ordinals) if start <= ordinal <= end and serial not in seen)
+                found = [serial for columns in storage.read_range(start, end, batch_size=16) for serial in columns[0]]
+                self.assertEqual(sorted(found), expected)
+                seen.extend(found)
+            seen.extend(serial for columns in storage.read() for serial in columns[0])
+            self.assertEqual(sorted(seen), list(range(1, 501)))
+            storage.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spendwise import ExpenseManager
+from storage import SQLiteStorage, migrate
+
+# A SQLite ledger holds the same records as the text ledger it came from,
+# and takes each mutation as its own transaction except renumbering deletes,
+# which it leaves to a full rewrite.
+
+
+def records(manager):
+    return sorted((expense['serial_number'], expense['date'], expense['category'], expense['amount'], expense['comment'] or '')
+                  for expense in manager.expenses if expense is not None)
+
+
+class SQLiteStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        output = contextlib.redirect_stdout(io.StringIO())
+        output.__enter__()
+        self.addCleanup(output.__exit__, None, None, None)
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def manager(self, path, stable_ids=True):
+        manager = ExpenseManager(stable_ids=stable_ids)
+        if os.path.exists(path):
+            manager.load_expenses(path)
+        else:
+            manager.filename = path
+        self.addCleanup(manager.ledger_storage().close)
+        return manager
+
+    def test_migrated_ledger_round_trips(self):
+        manager = self.manager(self.path('ledger.txt'))
+        for day in range(1, 21):
+            manager.add_expense(('food', 'rent', 'fun')[day % 3], day * 1.25, f"{day:02d}-0{1 + day % 2}-2024", f"note {day}")
+        manager.delete_expense(7)
+        manager.ledger_storage().close()
+        migrate(self.path('ledger.txt'), self.path('ledger.db'))
+        database = self.manager(self.path('ledger.db'))
+        self.assertEqual(records(database), records(manager))
+        self.assertEqual(database.aggregates.cells(), manager.aggregates.cells())
+        # Mutations made to the database survive a reload, and so does the
+        # deleted serial number.
+        database.add_expense('rent', 3.5, '05-03-2024', 'late')
+        database.edit_expense(2, 'fun', 8.0, '09-01-2024')
+        database.delete_expense(4)
+        database.ledger_storage().close()
+        reloaded = self.manager(self.path('ledger.db'))
+        self.assertEqual(records(reloaded), records(database))
+        self.assertEqual(reloaded.aggregates.cells(), database.aggregates.cells())
+        reloaded.add_expense('food', 1.0, '06-03-2024')
+        self.assertEqual(reloaded.expenses[-1]['serial_number'], 22)
+        migrate(self.path('ledger.db'), self.path('copy.txt'))
+        self.assertEqual(records(self.manager(self.path('copy.txt'))), records(reloaded))
+
+    def test_renumbering_delete_rewrites_the_database(self):
+        storage = SQLiteStorage(self.path('direct.db'))
+        self.addCleanup(storage.close)
+        expense = {"serial_number": 1, "date": '01-05-2024', "category": 'food', "amount": 2.0, "comment": ''}
+        self.assertTrue(storage.record('A', expense))
+        self.assertFalse(storage.record('D', expense, renumber=True))
+        # Left in place for the rewrite to renumber.
+        self.assertEqual([serials for serials, dates, parsed, categories, amounts, comments in storage.read()], [[1]])
+
+        manager = self.manager(self.path('ledger.db'), stable_ids=False)
+        for day in range(1, 5):
+            manager.add_expense('food', float(day), f"0{day}-05-2024")
+        manager.delete_expense(2)
+        self.assertEqual([serial for serial, date, category, amount, comment in records(manager)], [1, 2, 3])
+        manager.ledger_storage().close()
+        reloaded = self.manager(self.path('ledger.db'), stable_ids=False)
+        self.assertEqual(records(reloaded), records(manager))
+        self.assertEqual([amount for serial, date, category, amount, comment in records(reloaded)], [1.0, 3.0, 4.0])
+
+
+if __name__ == '__main__':
+    unittest.main()